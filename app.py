@@ -1,14 +1,23 @@
 import os
 import io
+import hashlib
+import hmac
+import html
+import json
 import uuid
 import time
+import threading
+import mimetypes
+from functools import lru_cache
 import requests
-from flask import Flask, request, send_from_directory, url_for, render_template_string, send_file, render_template, Response
+from flask import Flask, g, request, send_from_directory, url_for, render_template_string, send_file, render_template, stream_template, Response, jsonify
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file as send_file_from_environ
 from pptx import Presentation
 from pptx.util import Inches
 
+import numpy as np
 import pandas as pd
-import geopandas as gpd
 import folium
 # --- CHANGE: Import MarkerCluster ---
 from folium.plugins import MarkerCluster
@@ -25,6 +34,30 @@ except ImportError:  # pragma: no cover - Shapely < 2.1
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
 
+from utils.topojson import geodataframe_to_topojson
+from utils.tiles import is_valid_tile
+from utils.vector_tiles import VectorTileSource
+from utils.raster_tiles import RasterTileRenderer, color_scheme_key
+from utils.quantize import (QuantizationReport, payload_bytes, precision_from_setting,
+                            quantize_geodataframe)
+from utils.map_generation import (CategoryPinLayer, DensityLayer, PinCanvasLayer, PinDataLayer, PinSymbolSheet, ServerClusterLayer, ViewportPinLayer,
+                                  SharedStateLayer, VectorTileStateLayer, iter_json, render_map_parts, write_streamed)
+from utils.assets import ASSET_DIR, publish_asset, static_asset
+from utils.caching import IMMUTABLE, NO_STORE, REVALIDATE, SHARED, apply_cache_policy
+from utils.retention import (ArtifactIndex, Janitor, RetentionPolicy, limit_from_setting, map_artifact_key,
+                             pptx_artifact_key, tile_artifact_key, upload_artifact_key)
+from utils.compression import precompressed_variant, write_compressed_siblings
+from utils.clustering import ClusterIndex, parse_bbox
+from utils.spatial_index import PinGridIndex
+from utils.density import HEX_RADIUS, MAX_DENSITY_CELLS, density_levels
+from utils.fingerprint import map_fingerprint
+from utils.catalog import MAX_PAGE_SIZE, MapCatalog
+from utils.preprocessing import (build_table_data, format_zip_codes, geocode_country_names,
+                                 join_address_parts)
+from utils.colocation import FIRST_ROW, MERGED_COUNT, MERGED_NAMES, MERGED_CANDIDATES, merge_colocated_pins
+from utils.boundaries import (BoundaryStore, countries_in_data, countries_key, parse_countries_key,
+                              parse_country_list)
+
 # --- FIX: Define a base directory to make all file paths absolute ---
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -54,53 +87,285 @@ csrf = CSRFProtect(app)
 @app.errorhandler(RequestEntityTooLarge)
 def handle_file_too_large(e):
     return 'File too large. Maximum size is 10MB.', 413
-# Disable template caching for development
-app.config['TEMPLATES_AUTO_RELOAD'] = True
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# Reload edited templates only while developing; in production they are compiled once
+app.config['TEMPLATES_AUTO_RELOAD'] = DEBUG
 # Comment out SERVER_NAME for local development
 # app.config['SERVER_NAME'] = 'caas-map-old.link-smart-home.com'
 app.config['APPLICATION_ROOT'] = '/'
 app.config['PREFERRED_URL_SCHEME'] = 'https'
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'uploads')
 
-# Add cache-busting headers for remote deployment
+# HTTP caching per endpoint (see utils.caching); endpoints not listed here,
+# such as the upload and color selection forms, are never stored
+ROUTE_CACHE_POLICIES = {
+    # Content-hashed names, or data written once when the map was generated
+    "shared_asset": IMMUTABLE,
+    "map_category_pins": IMMUTABLE,
+    "map_clusters": IMMUTABLE,
+    "map_pins": IMMUTABLE,
+    # Kept by the browser and revalidated with the ETag of the file
+    "serve_map": REVALIDATE,
+    "static": REVALIDATE,
+    # Same URL, same result until the boundaries or the app are updated
+    "generate_custom_pin_svg": SHARED,
+    "state_vector_tile": SHARED,
+    "state_raster_tile": SHARED,
+    "download_template": SHARED,
+}
+
+
 @app.after_request
-def add_no_cache_headers(response):
-    """Add headers to prevent caching in production/remote environments"""
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, public, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    return response
+def add_cache_headers(response):
+    """Set the caching headers of the route's policy; errors are never stored."""
+    policy = ROUTE_CACHE_POLICIES.get(request.endpoint, NO_STORE)
+    return apply_cache_policy(response, policy if response.status_code < 400 else NO_STORE)
+
+# Hand generated files to a front proxy instead of streaming them from Python:
+# "x-sendfile" (Apache mod_xsendfile, lighttpd) sends the file path,
+# "x-accel-redirect" (nginx) sends X_ACCEL_REDIRECT_PREFIX plus the path
+# below static/, which the proxy maps to an internal location.
+FILE_SENDING = os.environ.get("FILE_SENDING", "")
+X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX", "/internal/static/")
 
 # Directories
 os.makedirs(os.path.join(basedir, "static", "maps"), exist_ok=True)
 os.makedirs(os.path.join(basedir, "static", "img"), exist_ok=True)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+TILE_CACHE_DIR = os.environ.get("TILE_CACHE_DIR", os.path.join(basedir, "tile_cache"))
+
+# Retention of generated files (see utils.retention): an artifact is deleted once
+# it has not been accessed for its kind's TTL (seconds), and the least recently
+# used ones while the kind is over its quota (MB). "none" turns a limit off.
+MB = 1024 * 1024
+artifact_indexes = {
+    "maps": ArtifactIndex(os.path.join(basedir, "static", "maps"), map_artifact_key),
+    "pptx": ArtifactIndex(os.path.join(basedir, "static", "maps"), pptx_artifact_key),
+    "uploads": ArtifactIndex(app.config['UPLOAD_FOLDER'], upload_artifact_key),
+    "tiles": ArtifactIndex(TILE_CACHE_DIR, tile_artifact_key, recursive=True),
+}
+RETENTION_POLICIES = {
+    "maps": RetentionPolicy(ttl=limit_from_setting(os.environ.get("MAP_TTL"), 30 * 24 * 3600),
+                            max_bytes=limit_from_setting(os.environ.get("MAP_QUOTA_MB"), 2048, MB)),
+    "pptx": RetentionPolicy(ttl=limit_from_setting(os.environ.get("PPTX_TTL"), 24 * 3600),
+                            max_bytes=limit_from_setting(os.environ.get("PPTX_QUOTA_MB"), 256, MB)),
+    # Uploads are deleted when their map is generated; this clears abandoned sessions
+    "uploads": RetentionPolicy(ttl=limit_from_setting(os.environ.get("UPLOAD_TTL"), 3600),
+                               max_bytes=limit_from_setting(os.environ.get("UPLOAD_QUOTA_MB"), 512, MB)),
+    # Tiles are rebuilt on demand, so only their total size is limited by default
+    "tiles": RetentionPolicy(ttl=limit_from_setting(os.environ.get("TILE_CACHE_TTL"), None),
+                             max_bytes=limit_from_setting(os.environ.get("TILE_CACHE_QUOTA_MB"), 1024, MB)),
+}
+# Metadata of every generated map, for the /maps listing (see utils.catalog).  Kept
+# outside static/ so it is never served.  Map ids are what grants access to a map, so the
+# listing (and the retention metrics) are only served with MAP_CATALOG_TOKEN, and not at
+# all while it is unset
+map_catalog = MapCatalog(os.environ.get("MAP_CATALOG_PATH", os.path.join(basedir, "map_catalog.sqlite3")))
+MAP_CATALOG_TOKEN = os.environ.get("MAP_CATALOG_TOKEN", "")
+
+
+def catalog_access_error():
+    """Error response unless the request carries MAP_CATALOG_TOKEN (?token= or a Bearer header)."""
+    if not MAP_CATALOG_TOKEN:
+        return "Error: Not found.", 404
+    token = request.args.get("token") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(token.encode(), MAP_CATALOG_TOKEN.encode()):
+        return "Error: A valid catalog token is required.", 403
+    return None
+
+
+def forget_evicted(kind, key):
+    """Drop deleted maps from the catalog."""
+    if kind == "maps":
+        map_catalog.remove(key)
+
+
+# Seconds between sweeps of the background janitor; 0 turns it off (e.g. in all but one worker)
+janitor = Janitor(limit_from_setting(os.environ.get("JANITOR_INTERVAL"), 300) or 0, log=app.logger.info,
+                  on_evict=forget_evicted)
+for kind, index in artifact_indexes.items():
+    janitor.add(kind, index, RETENTION_POLICIES[kind])
+janitor.start()
+
+
+def hold_artifact(kind, key):
+    """Keep an artifact from being deleted by the janitor until the request ends."""
+    artifact_indexes[kind].acquire(key)
+    g.setdefault("artifact_references", []).append((kind, key))
+
+
+@app.teardown_request
+def release_artifacts(exc):
+    """Release the references the request took with hold_artifact."""
+    for kind, key in g.pop("artifact_references", []):
+        artifact_indexes[kind].release(key)
+
+
+# Map ids being generated in this worker, with their lock and the number of
+# requests holding or waiting for it
+_generation_locks = {}
+_generation_locks_guard = threading.Lock()
+
+
+def hold_generation(map_id):
+    """
+    Wait until no other request of this worker is generating the same map, and
+    keep it that way until the request ends.
 
-# Preload groups & shapefile
-state_groups = pd.read_csv(os.path.join(basedir, "input_csv_files", "group_by_state.csv"))
-us_states = gpd.read_file(
-    os.path.join(basedir, "us_state_boundary_shapefiles", "ne_10m_admin_1_states_provinces_lakes.shp")
-)
-us_states = us_states[us_states["admin"] == "United States of America"]
-us_states["StateAbbr"] = us_states["iso_3166_2"].str.split("-").str[-1]
-us_states = us_states.merge(
-    state_groups, left_on="StateAbbr", right_on="State", how="left"
+    A second identical request (e.g. a double-clicked Generate) then finds the
+    map stored by the first. Across workers both may generate it; every file is
+    renamed into place whole, so the last write wins.
+    """
+    with _generation_locks_guard:
+        lock, holders = _generation_locks.get(map_id, (None, 0))
+        lock = lock or threading.Lock()
+        _generation_locks[map_id] = (lock, holders + 1)
+    lock.acquire()
+    g.generating_map = map_id
+
+
+@app.teardown_request
+def release_generation(exc):
+    map_id = g.pop("generating_map", None)
+    if map_id is None:
+        return
+    with _generation_locks_guard:
+        lock, holders = _generation_locks[map_id]
+        lock.release()
+        if holders > 1:
+            _generation_locks[map_id] = (lock, holders - 1)
+        else:
+            del _generation_locks[map_id]
+
+# Admin-1 boundaries are loaded per country on first use and merged with
+# input_csv_files/group_by_state.csv (US) or group_by_state_<CC>.csv
+boundary_store = BoundaryStore(
+    os.path.join(basedir, "us_state_boundary_shapefiles", "ne_10m_admin_1_states_provinces_lakes.shp"),
+    os.path.join(basedir, "input_csv_files"),
 )
+# Countries always drawn; a "Country" column in the upload adds more (e.g. "US,CA,MX")
+DEFAULT_BOUNDARY_COUNTRIES = parse_country_list(os.environ.get("BOUNDARY_COUNTRIES"))
 
 GROUP_COLORS = {"Group 1": "#0056b8", "Group 2": "#00a1e0", "Group 3": "#a1d0f3"}
 
+# State layer serialization: "geojson" embeds full-precision polygons,
+# "topojson" embeds quantized shared arcs decoded in the browser,
+# "vector_tiles" loads only the tiles in view from /tiles/states and
+# "raster_tiles" shows pre-rendered PNG tiles from /tiles/choropleth.
+STATE_LAYER_FORMATS = ("geojson", "topojson", "vector_tiles", "raster_tiles")
+# Pin rendering: "markers" writes one folium.Marker per row, "data" embeds the
+# pins as columnar JSON and builds the markers in the browser, "canvas" draws
+# them on a single canvas, "server" clusters them on the server and only
+# fetches the visible clusters, "viewport" fetches the pins in view from a
+# per-map spatial index, "hexbin" replaces the pins with candidate-weighted
+# density grids, "categories" loads each category's pins only when its layer
+# is turned on, and "auto" switches to canvas above CANVAS_PIN_THRESHOLD pins
+# and to viewport above VIEWPORT_PIN_THRESHOLD.
+PIN_LAYER_MODES = ("auto", "markers", "data", "canvas", "server", "viewport", "hexbin", "categories")
+CANVAS_PIN_THRESHOLD = int(os.environ.get("CANVAS_PIN_THRESHOLD", "3000"))
+VIEWPORT_PIN_THRESHOLD = int(os.environ.get("VIEWPORT_PIN_THRESHOLD", "20000"))
+# Map embedding: "direct" places the map's header, div and script in the page,
+# "iframe" keeps Folium's base64 data URI iframe (_repr_html_)
+MAP_EMBEDDING = os.environ.get("MAP_EMBEDDING", "direct")
+TOPOJSON_QUANTIZATION = int(os.environ.get("TOPOJSON_QUANTIZATION", "100000"))
+STATE_TILE_MAX_ZOOM = 14
+STATE_TILE_PROPERTIES = {"name": "name", "abbr": "StateAbbr", "group": "CaaS Group"}
+RASTER_TILE_MAX_ZOOM = 12
+# Decimal places kept for pin and polygon coordinates ("none" disables rounding)
+COORDINATE_PRECISION = precision_from_setting(os.environ.get("COORDINATE_PRECISION"))
+# Settings that change the generated page; part of every map fingerprint
+MAP_SETTINGS = {
+    "coordinate_precision": COORDINATE_PRECISION,
+    "map_embedding": MAP_EMBEDDING,
+    "canvas_pin_threshold": CANVAS_PIN_THRESHOLD,
+    "viewport_pin_threshold": VIEWPORT_PIN_THRESHOLD,
+    "topojson_quantization": TOPOJSON_QUANTIZATION,
+    "hex_radius": HEX_RADIUS,
+    "max_density_cells": MAX_DENSITY_CELLS,
+}
+# Derived state layers, cached per set of countries (see utils.boundaries.countries_key)
+_state_geojson = {}
+_state_raw_sizes = {}
+_state_payload_sizes = {}
+_state_topology = {}
+_state_tile_source = {}
+_state_raster_renderer = {}
+_state_asset_urls = {}
+
+
+def get_state_geojson(countries):
+    """Quantized state GeoJSON, built once and reused for every generated map."""
+    key = countries_key(countries)
+    if key not in _state_geojson:
+        _state_geojson[key] = quantize_geodataframe(boundary_store.boundaries(countries),
+                                                    COORDINATE_PRECISION).__geo_interface__
+    return _state_geojson[key]
+
+
+def get_state_raw_size(countries):
+    """Size of the state GeoJSON at full precision, the baseline of the state quantization report."""
+    key = countries_key(countries)
+    if key not in _state_raw_sizes:
+        _state_raw_sizes[key] = payload_bytes(boundary_store.boundaries(countries).__geo_interface__)
+    return _state_raw_sizes[key]
+
+
+def get_state_topology(countries):
+    """Build the state TopoJSON once and reuse it for every generated map."""
+    key = countries_key(countries)
+    if key not in _state_topology:
+        _state_topology[key] = geodataframe_to_topojson(
+            boundary_store.boundaries(countries),
+            object_name="states",
+            properties=["name", "StateAbbr", "CaaS Group"],
+            quantization=TOPOJSON_QUANTIZATION,
+        )
+    return _state_topology[key]
+
+
+def get_state_tile_source(countries):
+    """Vector tile source for the state layer, shared by all requests."""
+    key = countries_key(countries)
+    if key not in _state_tile_source:
+        _state_tile_source[key] = VectorTileSource(
+            boundary_store.boundaries(countries),
+            layer_name="states",
+            properties=STATE_TILE_PROPERTIES,
+            cache_dir=os.path.join(TILE_CACHE_DIR, "states", key),
+            max_zoom=STATE_TILE_MAX_ZOOM,
+        )
+    return _state_tile_source[key]
+
+
+def get_state_raster_renderer(countries):
+    """PNG choropleth tile renderer for the state layer, shared by all requests."""
+    key = countries_key(countries)
+    if key not in _state_raster_renderer:
+        _state_raster_renderer[key] = RasterTileRenderer(
+            boundary_store.boundaries(countries),
+            group_column="CaaS Group",
+            cache_dir=os.path.join(TILE_CACHE_DIR, "choropleth", key),
+            max_zoom=RASTER_TILE_MAX_ZOOM,
+            schemes=[color_scheme_key(GROUP_COLORS)],
+        )
+    return _state_raster_renderer[key]
+
+def get_state_asset_url(countries, state_layer):
+    """URL of the state GeoJSON or TopoJSON published as a content-hashed asset, shared by all maps."""
+    key = countries_key(countries)
+    if (key, state_layer) not in _state_asset_urls:
+        if state_layer == "topojson":
+            content, name = get_state_topology(countries), f"states-topo-{key}"
+        else:
+            content, name = get_state_geojson(countries), f"states-{key}"
+        payload = json.dumps(content, separators=(",", ":"))
+        # Raw and published sizes, for the quantization report of every map using this asset
+        _state_payload_sizes[(key, state_layer)] = (get_state_raw_size(countries), len(payload.encode("utf-8")))
+        _state_asset_urls[(key, state_layer)] = publish_asset(name, payload, "json")
+    return _state_asset_urls[(key, state_layer)]
+
 # Google Maps API Key (set your key here or via environment variable)
 GOOGLE_MAPS_API_KEY = os.environ.get("GOOGLE_MAPS_API_KEY", "YOUR_GOOGLE_MAPS_API_KEY")
 
-# --- NEW: Helper function to convert hex to rgba for table row coloring ---
-def hex_to_rgba(hex_color, alpha=0.2):
-    if pd.isna(hex_color):
-        return 'rgba(255, 255, 255, 0)' # Return transparent if color is missing
-    hex_color = hex_color.lstrip('#')
-    r, g, b = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-    return f'rgba({r}, {g}, {b}, {alpha})'
-
 # ------------------------------------------
 # Helper function to load an SVG and inject the row's candidate number
 # ------------------------------------------
@@ -488,6 +753,8 @@ def color_selection():
     
     if not filename:
         return "Error: No filename provided.", 400
+    # Still in use: keep the upload from expiring while colors are chosen
+    artifact_indexes["uploads"].touch(filename, os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename)))
     
     # Get pin assignments from form (now includes type and color)
     pin_assignments = {}
@@ -515,7 +782,9 @@ def color_selection():
         filename=filename,
         cluster_pins=cluster_pins,
         pin_assignments=pin_assignments,
-        default_colors=default_colors
+        default_colors=default_colors,
+        canvas_pin_threshold=CANVAS_PIN_THRESHOLD,
+        viewport_pin_threshold=VIEWPORT_PIN_THRESHOLD
     )
 
 
@@ -585,8 +854,38 @@ def generate_custom_pin_svg():
     return Response(svg_content, mimetype="image/svg+xml")
 
 
+def remove_upload(filepath):
+    """Delete an uploaded file once its map exists."""
+    try:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+            app.logger.info(f"Successfully deleted uploaded file: {filepath}")
+        else:
+            app.logger.warning(f"Uploaded file not found for deletion: {filepath}")
+    except PermissionError as e:
+        app.logger.warning(f"Permission denied when deleting uploaded file {filepath}: {e}")
+    except FileNotFoundError as e:
+        app.logger.info(f"Uploaded file already deleted or not found: {filepath}")
+    except Exception as e:
+        app.logger.error(f"Unexpected error deleting uploaded file {filepath}: {e}")
+
+
+def map_summary_path(map_id):
+    """Geocoding and quantization results of a stored map, shown again when it is reused."""
+    return os.path.join(basedir, "static", "maps", f"{map_id}.summary.json")
+
+
+def load_map_summary(map_id):
+    try:
+        with open(map_summary_path(map_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
 @app.route("/generate_map", methods=["POST"])
 def generate_map():
+    generate_start = time.perf_counter()
     filename = request.form.get("filename")
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename or "")
     if not os.path.exists(filepath):
@@ -602,6 +901,11 @@ def generate_map():
 
     df['Category Name'] = df['Category Name'].astype(str).fillna('Uncategorized')
 
+    # Only the boundary partitions this upload needs are loaded
+    countries = countries_in_data(df, DEFAULT_BOUNDARY_COUNTRIES)
+    boundaries_key = countries_key(countries)
+    states = boundary_store.boundaries(countries)
+
     # Get custom pin assignments (type and color) from form
     pin_assignments = {}
     for key, value in request.form.items():
@@ -615,6 +919,11 @@ def generate_map():
             if category not in pin_assignments:
                 pin_assignments[category] = {}
             pin_assignments[category]['color'] = value
+        elif key.startswith("pin_visible_"):
+            category = key[12:]  # Remove "pin_visible_" prefix
+            if category not in pin_assignments:
+                pin_assignments[category] = {}
+            pin_assignments[category]['visible'] = value != "hidden"
 
     # Get custom state colors from the form, fall back to defaults
     custom_colors = {
@@ -625,58 +934,38 @@ def generate_map():
 
     cluster_pins = request.form.get("cluster_pins") == 'true'
     show_labels = request.form.get("show_labels", "true") == 'true'  # Default to True
-
-    # Helper function to generate custom pin SVG
-    def generate_pin_svg(pin_type, color, number=None):
-        if pin_type == "sphere":
-            # Generate gradient colors - lighter version for gradient
-            if color.startswith("#"):
-                r = int(color[1:3], 16)
-                g = int(color[3:5], 16) 
-                b = int(color[5:7], 16)
-                r_light = min(255, r + 60)
-                g_light = min(255, g + 60)
-                b_light = min(255, b + 60)
-                light_color = f"#{r_light:02x}{g_light:02x}{b_light:02x}"
-            else:
-                light_color = color
-                
-            return f'''<svg width="50" height="50" viewBox="0 0 75 75" fill="none" xmlns="http://www.w3.org/2000/svg">
-  <defs>
-    <radialGradient id="pinGradient{hash(color) % 10000}" cx="30%" cy="30%" r="50%">
-      <stop offset="0%" stop-color="{light_color}"/>
-      <stop offset="100%" stop-color="{color}"/>
-    </radialGradient>
-  </defs>
-  <circle cx="50" cy="30" r="15" fill="url(#pinGradient{hash(color) % 10000})" />
-  <circle cx="44" cy="24" r="5" fill="#ffffff" fill-opacity="0.3" />
-  <path d="M45 45 L50 80" stroke="#888" stroke-width="2" transform="rotate(30, 50, 45)" />
-</svg>'''
-        else:  # number pin
-            if color.startswith("#"):
-                r = int(color[1:3], 16)
-                g = int(color[3:5], 16)
-                b = int(color[5:7], 16)
-                r_stroke = min(255, r + 80)
-                g_stroke = min(255, g + 80)
-                b_stroke = min(255, b + 80)
-                stroke_color = f"#{r_stroke:02x}{g_stroke:02x}{b_stroke:02x}"
-            else:
-                stroke_color = color
-                
-            return f'''<svg xmlns="http://www.w3.org/2000/svg" width="65" height="55" viewBox="0 0 65 55">
-  <g transform="translate(0,2)">
-  <path fill="{color}" stroke="{stroke_color}" stroke-width="2"
-        d="M32.5,0
-           C22.558,0 14.5,8.058 14.5,18
-           c0 13.5 18,32 18,32
-           s18-18.5 18-32
-           c0-9.942-8.058-18-18-18z" />
-  <circle cx="32.5" cy="20" r="10" fill="#ffffff"/>
-  <text x="32.5" y="24" text-anchor="middle" font-size="12" font-family="Calibri"
-        font-weight="bold" fill="#000000">{number if number else "1"}</text>
-  </g>
-</svg>'''
+    state_layer = request.form.get("state_layer", "geojson")
+    if state_layer not in STATE_LAYER_FORMATS:
+        state_layer = "geojson"
+    pin_layer = request.form.get("pin_layer", "auto")
+    if pin_layer not in PIN_LAYER_MODES:
+        pin_layer = "auto"
+    merge_colocated = request.form.get("colocated_pins", "merge") != "separate"
+
+    # Maps are stored under a fingerprint of the data and every choice that
+    # shapes them, so generating the same map again returns the stored one
+    map_id = map_fingerprint(df, {
+        "pin_assignments": pin_assignments,
+        "colors": custom_colors,
+        "cluster_pins": cluster_pins,
+        "show_labels": show_labels,
+        "state_layer": state_layer,
+        "pin_layer": pin_layer,
+        "merge_colocated": merge_colocated,
+        "countries": boundaries_key,
+        "settings": MAP_SETTINGS,
+    })
+    # Referenced before the check, so the janitor cannot delete the map in between
+    hold_artifact("maps", map_id)
+    hold_generation(map_id)
+    map_path = os.path.join(basedir, "static", "maps", f"{map_id}.html")
+    summary = load_map_summary(map_id) if os.path.isfile(map_path) else None
+    if summary is not None:
+        app.logger.info(f"Reusing map {map_id}: same data and options as a stored map")
+        artifact_indexes["maps"].touch(map_id, map_path)
+        map_catalog.record_reuse(map_id)
+        remove_upload(filepath)
+        return render_template("map_success.html", map_id=map_id, **summary)
 
     m = folium.Map(
         location=[39.8283, -98.5795],
@@ -687,28 +976,35 @@ def generate_map():
         zoomDelta=0.01
     )
 
-    folium.GeoJson(
-        data=us_states.__geo_interface__,
-        style_function=lambda feat: {
-            "fillColor": custom_colors.get(feat["properties"].get("CaaS Group"), "gray"),
-            "color": "black",
-            "weight": 1,
-            "fillOpacity": 1.0,
-            "className": ("group1-state" if feat["properties"].get("CaaS Group") == "Group 1" else "")
-        },
-        tooltip=folium.GeoJsonTooltip(fields=["name"], aliases=["State:"])
-    ).add_to(m)
+    if state_layer == "raster_tiles":
+        # Cheapest to paint: PNG tiles rendered server-side for this color scheme
+        get_state_raster_renderer(countries).allow_scheme(color_scheme_key(custom_colors))
+        folium.TileLayer(
+            tiles=f"/tiles/choropleth/{color_scheme_key(custom_colors)}/{{z}}/{{x}}/{{y}}.png?countries={boundaries_key}",
+            attr="State groups",
+            name="States",
+            overlay=True,
+            control=False,
+            max_native_zoom=RASTER_TILE_MAX_ZOOM
+        ).add_to(m)
+    elif state_layer == "vector_tiles":
+        # Group colors are applied in the browser, geometry comes from the tile endpoint
+        VectorTileStateLayer(
+            url=f"/tiles/states/{{z}}/{{x}}/{{y}}.pbf?countries={boundaries_key}",
+            group_colors=custom_colors,
+            layer_name="states",
+            max_native_zoom=STATE_TILE_MAX_ZOOM
+        ).add_to(m)
+    else:
+        # Geometry is a content-hashed asset shared by every map; only the colors are per map
+        SharedStateLayer(
+            url=get_state_asset_url(countries, state_layer),
+            group_colors=custom_colors,
+            topojson=state_layer == "topojson"
+        ).add_to(m)
 
     # Format ZIP codes
-    def format_zip(value):
-        if pd.isna(value) or value == "":
-            return ""
-        try:
-            return f"{int(float(value)):05d}"
-        except (ValueError, TypeError):
-            return str(value)
-    
-    df["ZIP/Postal Code"] = df["ZIP/Postal Code"].apply(format_zip)
+    df["ZIP/Postal Code"] = format_zip_codes(df["ZIP/Postal Code"])
     
     # Add missing columns
     for optional_col in ["Street Address", "City", "State"]:
@@ -717,22 +1013,12 @@ def generate_map():
         else:
             df[optional_col] = df[optional_col].fillna("")
     
-    # Build address strings for geocoding
-    def build_address_string(row):
-        parts = []
-        if row.get("Street Address", "").strip():
-            parts.append(row["Street Address"].strip())
-        if row.get("City", "").strip():
-            parts.append(row["City"].strip())
-        if row.get("State", "").strip():
-            parts.append(row["State"].strip())
-        if row.get("ZIP/Postal Code", "").strip():
-            parts.append(row["ZIP/Postal Code"].strip())
-        
-        if parts:
-            return ", ".join(parts) + ", USA"
-        else:
-            return "USA"
+    # Build address strings for geocoding: the non-empty parts plus the country
+    country_names = geocode_country_names(df)
+    address_parts = join_address_parts(df)
+    addresses = np.where(address_parts != "", address_parts + ", " + country_names, country_names)
+    zip_codes = df["ZIP/Postal Code"].str.strip()
+    state_abbrs = df["State"].astype(str).str.strip()
 
     # Geocode locations using the official Google Maps client
     lat_list, lon_list = [], []
@@ -742,11 +1028,11 @@ def generate_map():
 
     # Geocode locations with improved fallback and logging
     geocoding_stats = {"full_address": 0, "zip_only": 0, "state_centroid": 0, "failed": 0}
+    geocode_start = time.perf_counter()
     
-    for counter, (idx, row) in enumerate(df.iterrows(), 1):
+    rows = zip(df["Location Name"].astype(str), addresses, zip_codes, state_abbrs, country_names)
+    for location_name, addr_str, zip_code, state_abbr, country_name in rows:
         lat, lon = None, None # Reset lat/lon for each row
-        location_name = str(row.get("Location Name", f"Location {counter}"))
-        addr_str = build_address_string(row)
         geocoding_method = "failed"
         
         try:
@@ -759,8 +1045,8 @@ def generate_map():
                 geocoding_stats["full_address"] += 1
 
             # Fallback 1: ZIP only if the full address failed
-            if lat is None and row.get("ZIP/Postal Code", "").strip():
-                zip_addr = f"{row['ZIP/Postal Code']}, USA"
+            if lat is None and zip_code:
+                zip_addr = f"{zip_code}, {country_name}"
                 geocode_result = gmaps.geocode(zip_addr)
                 if geocode_result:
                     loc = geocode_result[0]['geometry']['location']
@@ -770,10 +1056,9 @@ def generate_map():
                     app.logger.info(f"Used ZIP fallback for {location_name}")
 
             # Fallback 2: State centroid
-            if lat is None and row.get("State", "").strip():
-                state_abbr = row["State"].strip()
-                if state_abbr in us_states["StateAbbr"].values:
-                    state_geom = us_states[us_states["StateAbbr"] == state_abbr].geometry.iloc[0]
+            if lat is None and state_abbr:
+                state_geom = boundary_store.find_unit(countries, state_abbr)
+                if state_geom is not None:
                     centroid = state_geom.centroid
                     lat, lon = centroid.y, centroid.x
                     geocoding_method = "state_centroid"
@@ -797,6 +1082,7 @@ def generate_map():
 
     df['Latitude'] = lat_list
     df['Longitude'] = lon_list
+    geocode_seconds = time.perf_counter() - geocode_start
     
     # Log detailed geocoding statistics
     total_locations = len(df)
@@ -815,164 +1101,340 @@ def generate_map():
     successful_geocoding = sum(1 for lat in lat_list if lat is not None)
     app.logger.info(f"Successfully geocoded {successful_geocoding}/{len(df)} locations")
 
-    df = df.merge(us_states[['StateAbbr', 'CaaS Group']], left_on='State', right_on='StateAbbr', how='left')
+    df = df.merge(states[['StateAbbr', 'CaaS Group']].drop_duplicates('StateAbbr'),
+                  left_on='State', right_on='StateAbbr', how='left')
 
+    if pin_layer == "auto":
+        pin_count = int((df["Latitude"].notna() & df["Longitude"].notna()).sum())
+        if pin_count > VIEWPORT_PIN_THRESHOLD:
+            pin_layer = "viewport"
+        elif pin_count > CANVAS_PIN_THRESHOLD:
+            pin_layer = "canvas"
+        else:
+            pin_layer = "markers"
+        app.logger.info(f"Rendering {pin_count} pins with the '{pin_layer}' pin layer")
+
+    pin_symbols = PinSymbolSheet().add_to(m)
+    icon_create_function = None
     if cluster_pins:
-        icon_create_function = """
-        function(cluster) {
-            var childCount = cluster.getChildCount();
-            var color = '#6bc04b'; // green default
-            if (childCount >= 100) {
-                color = '#0056b8'; // dark blue
-            } else if (childCount >= 50) {
-                color = '#00a1e0'; // light blue
-            } else if (childCount >= 10) {
-                color = '#00bfae'; // teal
-            }
-            return new L.DivIcon({
-                html: '<div style="background:' + color + '"><span>' + childCount + '</span></div>',
-                className: 'marker-cluster',
-                iconSize: new L.Point(40, 40)
-            });
-        }
-        """
+        # Shared with the server/viewport cluster icons via the MapViewer asset
+        icon_create_function = "MapViewer.clusterIcon"
+
+    if pin_layer == "data":
+        # One columnar JSON blob; markers and popups are built in the browser
+        pin_data = PinDataLayer(pin_symbols, show_labels=show_labels, cluster=cluster_pins,
+                                icon_create_function=icon_create_function).add_to(m)
+    elif pin_layer == "canvas":
+        # Same columnar data, drawn as image blits on one canvas
+        pin_data = PinCanvasLayer(pin_symbols, show_labels=show_labels, cluster=cluster_pins,
+                                  icon_create_function=icon_create_function).add_to(m)
+    elif pin_layer == "server":
+        # Clusters are precomputed per zoom and fetched for the visible bbox only
+        pin_data = ServerClusterLayer(pin_symbols, url=f"/map/{map_id}/clusters", show_labels=show_labels,
+                                      icon_create_function=icon_create_function).add_to(m)
+    elif pin_layer == "viewport":
+        # Pins are indexed on the server and fetched for the visible bbox only
+        pin_data = ViewportPinLayer(pin_symbols, url=f"/map/{map_id}/pins", show_labels=show_labels,
+                                    cluster=cluster_pins, icon_create_function=icon_create_function).add_to(m)
+    elif pin_layer == "categories":
+        # One chunk per category, fetched when its toggle in the layer control is turned on
+        hidden_categories = [category for category, assignment in pin_assignments.items()
+                             if not assignment.get('visible', True)]
+        pin_data = CategoryPinLayer(pin_symbols, url=f"/map/{map_id}/categories", show_labels=show_labels,
+                                    cluster=cluster_pins, icon_create_function=icon_create_function,
+                                    hidden_categories=hidden_categories).add_to(m)
+    elif pin_layer == "hexbin":
+        # Candidate-weighted hexbin grids per zoom level stand in for the pins
+        located = df[df["Latitude"].notna() & df["Longitude"].notna()]
+        levels = density_levels(located["Latitude"].astype(float), located["Longitude"].astype(float),
+                                pd.to_numeric(located["Electrification Candidates"], errors="coerce"))
+        DensityLayer(levels).add_to(m)
+        app.logger.info(f"Hexbin levels (zoom, cells): {[(level['zoom'], len(level['q'])) for level in levels]}")
+    elif cluster_pins:
         marker_layer = MarkerCluster(icon_create_function=icon_create_function).add_to(m)
     else:
         marker_layer = m
 
     legend_items = {}
-    table_rows = []
 
-    for _, row in df.iterrows():
-        lat, lon = row["Latitude"], row["Longitude"]
-        if pd.notnull(lat) and pd.notnull(lon):
-            category = row['Category Name']
-            
-            # Get pin assignment for this category
-            pin_assignment = pin_assignments.get(category, {
-                'type': 'sphere', 
-                'color': '#00a1e0'
-            })
-            pin_type = pin_assignment.get('type', 'sphere')
-            pin_color = pin_assignment.get('color', '#00a1e0')
-
-            # Add to legend (generate a sample SVG for legend)
-            if category not in legend_items:
-                legend_items[category] = f"/generate_custom_pin_svg?type={pin_type}&color={pin_color.replace('#', '%23')}"
-
-            # Generate custom pin SVG with conditional labels
-            if pin_type == 'number':
-                pin_svg = generate_pin_svg(pin_type, pin_color, row['Electrification Candidates'])
-                if show_labels:
-                    html = (
-                        f'<div class="div-icon-container">'
-                        f'<div class="pin-image-wrapper">{pin_svg}</div>'
-                        f'<div class="custom-label-text">{row["Location Name"]}</div>'
-                        f'</div>'
-                    )
-                    icon = folium.DivIcon(html=html, icon_size=(150, 110), icon_anchor=(32, 80))
-                else:
-                    html = (
-                        f'<div class="div-icon-container">'
-                        f'<div class="pin-image-wrapper">{pin_svg}</div>'
-                        f'</div>'
-                    )
-                    icon = folium.DivIcon(html=html, icon_size=(65, 55), icon_anchor=(32, 55))
-            else:  # sphere
-                pin_svg = generate_pin_svg(pin_type, pin_color)
-                if show_labels:
-                    html = (
-                        f'<div class="div-icon-container">'
-                        f'<div class="pin-image-wrapper">{pin_svg}</div>'
-                        f'<div class="custom-label-text">{row["Location Name"]}</div>'
-                        f'</div>'
-                    )
-                    icon = folium.DivIcon(html=html, icon_size=(150, 80), icon_anchor=(25, 50))
-                else:
-                    html = (
-                        f'<div class="div-icon-container">'
-                        f'<div class="pin-image-wrapper">{pin_svg}</div>'
-                        f'</div>'
-                    )
-                    icon = folium.DivIcon(html=html, icon_size=(50, 50), icon_anchor=(25, 50))
+    # Rows geocoded to the same point (ZIP or state centroid fallbacks) become one pin per
+    # category; the server-side modes index every row themselves and the hexbin mode draws no pins
+    pins_df = merge_colocated_pins(df.iloc[:0] if pin_layer == "hexbin" else df, COORDINATE_PRECISION,
+                                   merge=merge_colocated and pin_layer not in ("server", "viewport"))
+    app.logger.info(f"Rendering {len(pins_df)} pins for {int(pins_df[MERGED_COUNT].sum())} located rows")
+
+    for _, pin in pins_df.iterrows():
+        category = pin['Category Name']
+
+        # Get pin assignment for this category
+        pin_assignment = pin_assignments.get(category, {
+            'type': 'sphere', 
+            'color': '#00a1e0'
+        })
+        pin_type = pin_assignment.get('type', 'sphere')
+        pin_color = pin_assignment.get('color', '#00a1e0')
+
+        # Add to legend (generate a sample SVG for legend)
+        if category not in legend_items:
+            legend_items[category] = f"/generate_custom_pin_svg?type={pin_type}&color={pin_color.replace('#', '%23')}"
+
+        location = [pin["Latitude"], pin["Longitude"]]
+        count = int(pin[MERGED_COUNT])
+        members = list(zip(pin[MERGED_NAMES], pin[MERGED_CANDIDATES])) if count > 1 else None
+
+        if pin_layer == "categories":
+            pin_data.add_pin(location[0], location[1], pin_type, pin_color,
+                             pin["Location Name"], pin['Electrification Candidates'],
+                             count=count, members=members, category=category)
+        elif pin_layer in ("data", "canvas", "server", "viewport"):
+            pin_data.add_pin(location[0], location[1], pin_type, pin_color,
+                             pin["Location Name"], pin['Electrification Candidates'],
+                             count=count, members=members)
+        else:
+            # Each (type, color) image is defined once in the sheet; markers only reference it
+            icon = pin_symbols.icon(
+                pin_type,
+                pin_color,
+                number=pin['Electrification Candidates'] if pin_type == 'number' else None,
+                label=pin["Location Name"] if show_labels else None,
+                count=count
+            )
 
             # Create marker with popup information
-            popup_text = f"<strong>{row['Location Name']}</strong><br>Electrification Candidates: {row['Electrification Candidates']}"
+            # Names and values come from the upload, so they are escaped as HTML text
+            popup_text = (f"<strong>{html.escape(str(pin['Location Name']))}</strong><br>"
+                          f"Electrification Candidates: {html.escape(str(pin['Electrification Candidates']))}")
+            if members:
+                popup_text += '<ul class="pin-members">' + "".join(
+                    f"<li>{html.escape(str(name))}: {html.escape(str(candidates))}</li>" for name, candidates in members
+                ) + "</ul>"
             folium.Marker(
-                location=[lat, lon], 
+                location=location,
                 icon=icon,
                 popup=folium.Popup(popup_text, max_width=200)
             ).add_to(marker_layer)
 
-        n = row.get('Electrification Candidates', 1)
-        try:
-            n = int(n)
-        except Exception:
-            n = 1
-        if n >= 100:
-            color = '#0056b8'
-        elif n >= 50:
-            color = '#00a1e0'
-        elif n >= 10:
-            color = '#00bfae'
-        elif n >= 2:
-            color = '#6bc04b'
-        else:
-            color = None
-        if color:
-            rgba_color = hex_to_rgba(color, alpha=0.25)
+    table_data = build_table_data(df)
+
+    # Report how much coordinate quantization saved on the payloads this map actually serializes:
+    # the pins given to the pin layer or index (none in hexbin mode) and the published state asset
+    quantization_report = QuantizationReport(COORDINATE_PRECISION)
+    if len(pins_df):
+        quantized_pins = pins_df[["Latitude", "Longitude"]]
+        raw_pins = df.loc[pins_df[FIRST_ROW], ["Latitude", "Longitude"]].astype(float)
+        if pin_layer in ("data", "canvas", "server", "viewport", "categories"):
+            # Columnar lat/lon lists of the pin data
+            quantization_report.add_payloads("pins", [raw_pins[c].tolist() for c in raw_pins],
+                                             [quantized_pins[c].tolist() for c in quantized_pins])
         else:
-            rgba_color = "transparent"
-        table_rows.append({
-            "location": row['Location Name'],
-            "candidates": row['Electrification Candidates'],
-            "color": rgba_color
-        })
-
-    map_html = m._repr_html_()
+            # One [lat, lon] location per marker
+            quantization_report.add_payloads("pins", raw_pins.values.tolist(), quantized_pins.values.tolist())
+    if state_layer in ("geojson", "topojson"):
+        quantization_report.add("states", *_state_payload_sizes[(boundaries_key, state_layer)])
+    app.logger.info(str(quantization_report))
+
+    if show_labels and pin_layer in ("data", "canvas"):
+        # Label visibility per zoom is decided here once instead of on every redraw in the browser
+        placement = pin_data.place_labels()
+        app.logger.info(f"Placed labels per zoom: {placement.counts()}")
+
+    # Every file stored for the map, for its size in the catalog
+    map_files = []
+    if pin_layer == "server":
+        map_files.append(os.path.join(basedir, "static", "maps", f"{map_id}.clusters.npz"))
+        pin_data.build_index().save(map_files[-1])
+    elif pin_layer == "viewport":
+        map_files.append(os.path.join(basedir, "static", "maps", f"{map_id}.pins.npz"))
+        pin_data.build_index().save(map_files[-1])
+    elif pin_layer == "categories":
+        for index, chunk in enumerate(pin_data.chunks()):
+            chunk_path = os.path.join(basedir, "static", "maps", f"{map_id}.category-{index}.json")
+            write_streamed(chunk_path, [json.dumps(chunk, separators=(",", ":"))])
+            map_files += [chunk_path, *write_compressed_siblings(chunk_path)]
+
+    render_start = time.perf_counter()
+    if MAP_EMBEDDING == "iframe":
+        map_parts = {"map_html": m._repr_html_()}
+    else:
+        map_parts = render_map_parts(m)
 
     # Save the map to a file and redirect to intermediate page
-    map_id = str(uuid.uuid4())
-    map_path = os.path.join(basedir, "static", "maps", f"{map_id}.html")
-    
-    # Render the map template to a file
-    map_content = render_template("map_template.html", 
-                                  map_html=map_html, 
-                                  legend_items=legend_items, 
-                                  table_rows=table_rows,
-                                  group_colors=custom_colors)
-    
-    with open(map_path, 'w', encoding='utf-8') as f:
-        f.write(map_content)
+    # Stream the map template to the file; the page is never held in memory as a whole
+    page_bytes = write_streamed(map_path, stream_template("map_template.html",
+                                                          **map_parts,
+                                                          legend_items=legend_items,
+                                                          table_data=iter_json(table_data),
+                                                          group_colors=custom_colors,
+                                                          page_css=static_asset("css/map_page.css"),
+                                                          page_js=static_asset("js/location_table.js")))
+    render_seconds = time.perf_counter() - render_start
+    app.logger.info(f"Rendered map page ({MAP_EMBEDDING} embedding): {page_bytes} bytes in {render_seconds:.2f}s")
+    # Compressed once here instead of on every download
+    compress_start = time.perf_counter()
+    compressed = write_compressed_siblings(map_path)
+    map_files += [map_path, *compressed]
+    app.logger.info("Precompressed map page: " + ", ".join(f"{os.path.basename(p)} {os.path.getsize(p)} bytes"
+                                                           for p in compressed)
+                    + f" in {time.perf_counter() - compress_start:.2f}s")
     
+    # Hash of the uploaded file for the catalog, read before the upload is deleted
+    source_digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            source_digest.update(block)
+
     # Clean up: Delete the uploaded file after successful map generation
-    try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            app.logger.info(f"Successfully deleted uploaded file: {filepath}")
-        else:
-            app.logger.warning(f"Uploaded file not found for deletion: {filepath}")
-    except PermissionError as e:
-        app.logger.warning(f"Permission denied when deleting uploaded file {filepath}: {e}")
-    except FileNotFoundError as e:
-        app.logger.info(f"Uploaded file already deleted or not found: {filepath}")
-    except Exception as e:
-        app.logger.error(f"Unexpected error deleting uploaded file {filepath}: {e}")
+    remove_upload(filepath)
     
+    # Written last: a map is only reused once its page and summary both exist
+    summary = {
+        "geocoding_stats": {
+            'total': total_locations,
+            'successful': successful_geocoding,
+            'failed': geocoding_stats['failed']
+        },
+        "quantization": quantization_report.as_dict(),
+    }
+    write_streamed(map_summary_path(map_id), [json.dumps(summary)])
+    map_files.append(map_summary_path(map_id))
+
+    map_catalog.add(
+        map_id,
+        source_name=filename.split("_", 1)[-1],  # without the unique upload prefix
+        source_hash=source_digest.hexdigest(),
+        row_count=total_locations,
+        located_count=successful_geocoding,
+        pin_count=len(pins_df),
+        categories=df['Category Name'].unique().tolist(),
+        geocoding=geocoding_stats,
+        pin_layer=pin_layer,
+        state_layer=state_layer,
+        size_bytes=sum(os.path.getsize(path) for path in map_files),
+        geocode_seconds=geocode_seconds,
+        render_seconds=render_seconds,
+        total_seconds=time.perf_counter() - generate_start,
+    )
+
     # Redirect to intermediate page with Start Over button
     # Render the map generation success page with geocoding statistics
-    return render_template("map_success.html", 
-                          map_id=map_id,
-                          geocoding_stats={
-                              'total': total_locations,
-                              'successful': successful_geocoding,
-                              'failed': geocoding_stats['failed']
-                          })
+    return render_template("map_success.html", map_id=map_id, **summary)
+
+
+def send_precompressed(path, mimetype):
+    """
+    Send a generated file, preferring a precompressed sibling the client accepts.
+
+    The ETag of the chosen variant answers If-None-Match with 304; caching
+    headers come from the route's policy (ROUTE_CACHE_POLICIES).  With
+    FILE_SENDING set, the front proxy streams the file instead.
+    """
+    variant, encoding = precompressed_variant(path, request.accept_encodings)
+    response = send_file_from_environ(variant, request.environ, mimetype=mimetype,
+                                      use_x_sendfile=bool(FILE_SENDING), response_class=app.response_class)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    if FILE_SENDING == "x-accel-redirect" and "X-Sendfile" in response.headers:
+        internal = os.path.relpath(response.headers.pop("X-Sendfile"), os.path.join(basedir, "static"))
+        response.headers["X-Accel-Redirect"] = X_ACCEL_REDIRECT_PREFIX + internal.replace(os.sep, "/")
+    return response
 
 
 @app.route("/map/<map_id>")
 def serve_map(map_id):
-    return send_from_directory(os.path.join(basedir, "static", "maps"), f"{map_id}.html")
+    path = safe_join(os.path.join(basedir, "static", "maps"), f"{map_id}.html")
+    if path is None or not os.path.isfile(path):
+        return "Error: Map not found.", 404
+    artifact_indexes["maps"].touch(map_id, path)
+    return send_precompressed(path, "text/html")
+
+
+@lru_cache(maxsize=32)
+def load_cluster_index(path):
+    """Cluster indexes are loaded once and shared by every request for that map."""
+    return ClusterIndex.load(path)
+
+
+@app.route("/map/<map_id>/clusters")
+def map_clusters(map_id):
+    """Clusters and single pins of a server-clustered map for ?bbox=west,south,east,north&zoom=z."""
+    path = safe_join(os.path.join(basedir, "static", "maps"), f"{map_id}.clusters.npz")
+    if path is None or not os.path.isfile(path):
+        return "Error: Map not found.", 404
+    bbox = parse_bbox(request.args.get("bbox"))
+    zoom = request.args.get("zoom", type=int)
+    if bbox is None or zoom is None:
+        return "Error: bbox and zoom are required.", 400
+    return jsonify({"zoom": zoom, "features": load_cluster_index(path).get_clusters(bbox, zoom)})
+
+
+@lru_cache(maxsize=32)
+def load_pin_index(path):
+    """Pin indexes are loaded once and shared by every request for that map."""
+    return PinGridIndex.load(path)
+
+
+@app.route("/map/<map_id>/pins")
+def map_pins(map_id):
+    """Pins of a viewport-loaded map inside ?bbox=west,south,east,north, thinned for &zoom=z when crowded."""
+    path = safe_join(os.path.join(basedir, "static", "maps"), f"{map_id}.pins.npz")
+    if path is None or not os.path.isfile(path):
+        return "Error: Map not found.", 404
+    bbox = parse_bbox(request.args.get("bbox"))
+    zoom = request.args.get("zoom", type=int)
+    if bbox is None or zoom is None:
+        return "Error: bbox and zoom are required.", 400
+    return jsonify({"zoom": zoom, **load_pin_index(path).get_pins(bbox, zoom)})
+
+
+@app.route("/map/<map_id>/categories")
+def map_category_pins(map_id):
+    """Columnar pins of one category (?index=k) of a map with per-category layers."""
+    index = request.args.get("index", type=int)
+    if index is None or index < 0:
+        return "Error: index is required.", 400
+    path = safe_join(os.path.join(basedir, "static", "maps"), f"{map_id}.category-{index}.json")
+    if path is None or not os.path.isfile(path):
+        return "Error: Category not found.", 404
+    return send_precompressed(path, "application/json")
+
+
+@app.route("/assets/<path:filename>")
+def shared_asset(filename):
+    """Serve a content-hashed asset shared by the generated maps (see utils.assets)."""
+    path = safe_join(ASSET_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        return "Error: Asset not found.", 404
+    return send_precompressed(path, mimetypes.guess_type(path)[0] or "application/octet-stream")
+
+
+@app.route("/tiles/states/<int:z>/<int:x>/<int:y>.pbf")
+def state_vector_tile(z, x, y):
+    """Serve a Mapbox Vector Tile of the state boundaries."""
+    if not is_valid_tile(z, x, y, STATE_TILE_MAX_ZOOM):
+        return "Error: Tile out of range.", 404
+    countries = parse_countries_key(request.args.get("countries", countries_key(DEFAULT_BOUNDARY_COUNTRIES)))
+    if countries is None:
+        return "Error: Unsupported countries.", 400
+    tile = get_state_tile_source(countries).get_tile(z, x, y)
+    return Response(tile, mimetype="application/vnd.mapbox-vector-tile")
+
+
+@app.route("/tiles/choropleth/<scheme>/<int:z>/<int:x>/<int:y>.png")
+def state_raster_tile(scheme, z, x, y):
+    """Serve a pre-rendered PNG tile of the state choropleth for a color scheme."""
+    if not is_valid_tile(z, x, y, RASTER_TILE_MAX_ZOOM):
+        return "Error: Tile out of range.", 404
+    countries = parse_countries_key(request.args.get("countries", countries_key(DEFAULT_BOUNDARY_COUNTRIES)))
+    if countries is None:
+        return "Error: Unsupported countries.", 400
+    try:
+        tile = get_state_raster_renderer(countries).get_tile(scheme, z, x, y)
+    except ValueError:
+        return "Error: Invalid color scheme.", 400
+    except LookupError:
+        return "Error: Color scheme not found.", 404
+    return Response(tile, mimetype="image/png")
 
 
 @app.route("/ppt/<map_id>")
@@ -981,6 +1443,7 @@ def download_ppt(map_id):
     html_path = os.path.join(maps_dir, f"{map_id}.html")
     if not os.path.isfile(html_path):
         return "Error: Map not found.", 404
+    artifact_indexes["maps"].touch(map_id, html_path)
 
     link = url_for("serve_map", map_id=map_id, _external=True)
     prs = Presentation()
@@ -1012,6 +1475,40 @@ def download_ppt(map_id):
     return send_from_directory(maps_dir, ppt_filename, as_attachment=True)
 
 
+@app.route("/maps")
+def list_maps():
+    """
+    Page through the generated maps, newest first, from the catalog.
+
+    Query parameters: q (text in the file name or a category, or the start of
+    a map id), category, source_hash, pin_layer, state_layer, page and per_page.
+    """
+    error = catalog_access_error()
+    if error:
+        return error
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 20, type=int)
+    if page < 1 or not 1 <= per_page <= MAX_PAGE_SIZE:
+        return f"Error: page must be at least 1 and per_page between 1 and {MAX_PAGE_SIZE}.", 400
+    maps, total = map_catalog.search(request.args.get("q"), request.args.get("category"), page, per_page,
+                                     source_hash=request.args.get("source_hash"),
+                                     pin_layer=request.args.get("pin_layer"),
+                                     state_layer=request.args.get("state_layer"))
+    for entry in maps:
+        entry["url"] = url_for("serve_map", map_id=entry["id"])
+    return jsonify({"maps": maps, "page": page, "per_page": per_page, "total": total,
+                    "pages": (total + per_page - 1) // per_page})
+
+
+@app.route("/metrics/retention")
+def retention_metrics():
+    """Size of the stored maps, exports and uploads, and what the janitor deleted."""
+    error = catalog_access_error()
+    if error:
+        return error
+    return jsonify(janitor.metrics())
+
+
 @app.route("/download_template")
 def download_template():
     df = pd.DataFrame({
@@ -1,19 +1,32 @@
 import os
 import io
 import json
-import uuid
 import time
 import requests
 import logging
 from flask import Flask, request, send_from_directory, url_for, jsonify, render_template_string, redirect, Response, render_template, send_file, session
+import numpy as np
 import pandas as pd
-import geopandas as gpd
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
 from shapely.geometry import Point
 import googlemaps
 from dotenv import load_dotenv
 
+from utils.tiles import is_valid_tile
+from utils.vector_tiles import VectorTileSource
+from utils.raster_tiles import RasterTileRenderer, color_scheme_key
+from utils.quantize import QuantizationReport, precision_from_setting, round_coordinate
+from utils.clustering import ClusterIndex, parse_bbox
+from utils.spatial_index import PinGridIndex
+from utils.labels import place_labels
+from utils.density import DENSITY_COLORS, HEX_RADIUS, MAX_DENSITY_CELLS, density_levels
+from utils.fingerprint import map_fingerprint
+from utils.preprocessing import format_zip_codes, geocode_country_names, join_address_parts
+from utils.colocation import FIRST_ROW, MERGED_CANDIDATES, MERGED_COUNT, MERGED_NAMES, merge_colocated_pins
+from utils.boundaries import (BoundaryStore, countries_in_data, countries_key, parse_countries_key,
+                              parse_country_list)
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -48,22 +61,74 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 os.makedirs(os.path.join(basedir, "static", "maps"), exist_ok=True)
 os.makedirs(os.path.join(basedir, "static", "img"), exist_ok=True)
 
-# Preload groups & shapefile
-state_groups = pd.read_csv(os.path.join(basedir, "input_csv_files", "group_by_state.csv"))
-us_states = gpd.read_file(
-    os.path.join(basedir, "us_state_boundary_shapefiles", "ne_10m_admin_1_states_provinces_lakes.shp")
-)
-us_states = us_states[us_states["admin"] == "United States of America"]
-us_states["StateAbbr"] = us_states["iso_3166_2"].str.split("-").str[-1]
-us_states = us_states.merge(
-    state_groups, left_on="StateAbbr", right_on="State", how="left"
+# Admin-1 boundaries are loaded per country on first use and merged with
+# input_csv_files/group_by_state.csv (US) or group_by_state_<CC>.csv
+boundary_store = BoundaryStore(
+    os.path.join(basedir, "us_state_boundary_shapefiles", "ne_10m_admin_1_states_provinces_lakes.shp"),
+    os.path.join(basedir, "input_csv_files"),
 )
+# Countries always drawn; a "Country" column in the upload adds more (e.g. "US,CA,MX")
+DEFAULT_BOUNDARY_COUNTRIES = parse_country_list(os.environ.get("BOUNDARY_COUNTRIES"))
 
 GROUP_COLORS = {"Group 1": "#0056b8", "Group 2": "#00a1e0", "Group 3": "#a1d0f3"}
 
 # Google Maps API Key (set your key here or via environment variable)
 GOOGLE_MAPS_API_KEY = os.environ.get("GOOGLE_MAPS_API_KEY", "YOUR_GOOGLE_MAPS_API_KEY")
 
+# State layer modes: "polygons" embeds every state polygon in the page,
+# "vector_tiles" loads only the tiles in view from /tiles/states and
+# "raster_tiles" shows pre-rendered PNG tiles from /tiles/choropleth.
+STATE_LAYER_MODES = ("polygons", "vector_tiles", "raster_tiles")
+# Pin loading: "client" embeds every pin (clustered with MarkerClusterer in the
+# browser), "server" precomputes clusters per zoom and fetches only the visible
+# ones, "viewport" fetches the pins in view from a per-map spatial index,
+# "hexbin" shows candidate-weighted density hexagons instead of pins, and
+# "categories" fetches each category's pins when its toggle is turned on.
+PIN_LOADING_MODES = ("client", "server", "viewport", "hexbin", "categories")
+TILE_CACHE_DIR = os.environ.get("TILE_CACHE_DIR", os.path.join(basedir, "tile_cache"))
+STATE_TILE_MAX_ZOOM = 14
+STATE_TILE_PROPERTIES = {"name": "name", "abbr": "StateAbbr", "group": "CaaS Group"}
+RASTER_TILE_MAX_ZOOM = 12
+# Decimal places kept for pin and polygon coordinates ("none" disables rounding)
+COORDINATE_PRECISION = precision_from_setting(os.environ.get("COORDINATE_PRECISION"))
+# Settings that change the generated map; part of every map fingerprint
+MAP_SETTINGS = {
+    "coordinate_precision": COORDINATE_PRECISION,
+    "hex_radius": HEX_RADIUS,
+    "max_density_cells": MAX_DENSITY_CELLS,
+}
+# Tile sources, cached per set of countries (see utils.boundaries.countries_key)
+_state_tile_source = {}
+_state_raster_renderer = {}
+
+
+def get_state_tile_source(countries):
+    """Vector tile source for the state layer, shared by all requests."""
+    key = countries_key(countries)
+    if key not in _state_tile_source:
+        _state_tile_source[key] = VectorTileSource(
+            boundary_store.boundaries(countries),
+            layer_name="states",
+            properties=STATE_TILE_PROPERTIES,
+            cache_dir=os.path.join(TILE_CACHE_DIR, "states", key),
+            max_zoom=STATE_TILE_MAX_ZOOM,
+        )
+    return _state_tile_source[key]
+
+
+def get_state_raster_renderer(countries):
+    """PNG choropleth tile renderer for the state layer, shared by all requests."""
+    key = countries_key(countries)
+    if key not in _state_raster_renderer:
+        _state_raster_renderer[key] = RasterTileRenderer(
+            boundary_store.boundaries(countries),
+            group_column="CaaS Group",
+            cache_dir=os.path.join(TILE_CACHE_DIR, "choropleth", key),
+            max_zoom=RASTER_TILE_MAX_ZOOM,
+            schemes=[color_scheme_key(GROUP_COLORS)],
+        )
+    return _state_raster_renderer[key]
+
 # In-memory map data store
 MAP_DATA = {}
 
@@ -315,11 +380,25 @@ const CLUSTER_COLORS = [
   {bg: 'rgba(107,192,75,0.85)', row: 'rgba(107,192,75,0.13)'}
 ];
 
-let statePolygons, pins, clusteringEnabled, showLabels;
+let statePolygons, pins, clusteringEnabled, showLabels, stateLayerMode, groupColors, stateColorScheme, boundaryCountries;
+let pinLoading, pinIcons, clustersUrl, pinsUrl, labels, density, densityColors, categories, categoriesUrl;
 
 try {
   statePolygons = {{ state_polygons|safe }};
   pins = {{ pins|safe }};
+  stateLayerMode = {{ state_layer|tojson }};
+  groupColors = {{ group_colors|tojson }};
+  stateColorScheme = {{ state_color_scheme|tojson }};
+  boundaryCountries = {{ boundary_countries|tojson }};
+  pinLoading = {{ pin_loading|tojson }};
+  pinIcons = {{ pin_icons|tojson }};
+  clustersUrl = {{ clusters_url|tojson }};
+  pinsUrl = {{ pins_url|tojson }};
+  labels = {{ labels|tojson }};
+  density = {{ density|tojson }};
+  densityColors = {{ density_colors|tojson }};
+  categories = {{ categories|tojson }};
+  categoriesUrl = {{ categories_url|tojson }};
   
   // FIXED: Enhanced template variable injection with explicit type validation
   clusteringEnabled = {{ clustering_enabled|tojson }};
@@ -418,6 +497,386 @@ try {
   showError('Error loading map data. Please try refreshing the page.');
 }
 
+// Convert '#rrggbb' to a deck.gl [r, g, b, a] color
+function hexToRgba(hex, alpha) {
+  const value = /^#[0-9a-fA-F]{6}$/.test(hex || '') ? hex : '#cccccc';
+  return [parseInt(value.slice(1, 3), 16), parseInt(value.slice(3, 5), 16), parseInt(value.slice(5, 7), 16), alpha];
+}
+
+// State boundaries from the /tiles/states vector tile endpoint, styled client-side
+function addStateTileLayer(map) {
+  const script = document.createElement('script');
+  script.src = 'https://unpkg.com/deck.gl@8.9.35/dist.min.js';
+  script.onload = function() {
+    try {
+      const overlay = new deck.GoogleMapsOverlay({
+        layers: [
+          new deck.MVTLayer({
+            id: 'states',
+            data: '/tiles/states/{z}/{x}/{y}.pbf?countries=' + boundaryCountries,
+            maxZoom: {{ state_tile_max_zoom }},
+            pickable: true,
+            getFillColor: function(f) { return hexToRgba(groupColors[f.properties.group], 191); },
+            getLineColor: [0, 0, 0, 179],
+            lineWidthMinPixels: 1
+          })
+        ],
+        getTooltip: function(info) {
+          return info.object ? 'State: ' + (info.object.properties.name || '') : null;
+        }
+      });
+      overlay.setMap(map);
+      console.log('Added state vector tile layer');
+    } catch (e) {
+      console.error('Error creating state tile layer:', e);
+      showError('State boundaries could not be displayed.', 'warning');
+    }
+  };
+  script.onerror = function() {
+    showError('State boundary library failed to load. States will not be shaded.', 'warning', 8000);
+  };
+  document.head.appendChild(script);
+}
+
+// Pre-rendered PNG choropleth tiles from /tiles/choropleth for low-end clients
+function addStateRasterLayer(map) {
+  const maxZoom = {{ raster_tile_max_zoom }};
+  const stateTiles = new google.maps.ImageMapType({
+    getTileUrl: function(coord, zoom) {
+      if (zoom > maxZoom) return null;
+      const n = 1 << zoom;
+      if (coord.y < 0 || coord.y >= n) return null;
+      const x = ((coord.x % n) + n) % n;
+      return '/tiles/choropleth/' + stateColorScheme + '/' + zoom + '/' + x + '/' + coord.y + '.png?countries=' + boundaryCountries;
+    },
+    tileSize: new google.maps.Size(256, 256),
+    opacity: 0.75,
+    name: 'States'
+  });
+  map.overlayMapTypes.push(stateTiles);
+  console.log('Added state raster tile layer');
+}
+
+// Marker for a single pin returned by the clusters or pins endpoint
+function pinMarker(map, infoWindow, feature) {
+  const marker = new google.maps.Marker({
+    position: {lat: feature.lat, lng: feature.lon},
+    icon: {
+      url: pinIcons[feature.cat],
+      scaledSize: new google.maps.Size(40, 40),
+      anchor: new google.maps.Point(20, 20)
+    },
+    title: showLabels ? (feature.name || '') : ''
+  });
+  marker.addListener('click', function() {
+    const content = document.createElement('div');
+    const name = document.createElement('strong');
+    name.textContent = feature.name || 'Unknown Location';
+    content.appendChild(name);
+    content.appendChild(document.createElement('br'));
+    content.appendChild(document.createTextNode('Candidates: ' + (feature.candidates != null ? feature.candidates : 'N/A')));
+    infoWindow.setContent(content);
+    infoWindow.open(map, marker);
+  });
+  return marker;
+}
+
+// Info window of a pin with the locations merged into it, built from text nodes since the
+// names and values come from the uploaded spreadsheet
+function pinInfoContent(pin) {
+  const content = document.createElement('div');
+  const name = document.createElement('strong');
+  name.textContent = pin.label || 'Unknown Location';
+  content.appendChild(name);
+  content.appendChild(document.createElement('br'));
+  content.appendChild(document.createTextNode('Candidates: ' + (pin.electrification_candidates || 'N/A')));
+  if (pin.members) {
+    const list = document.createElement('ul');
+    list.style.cssText = 'max-height: 200px; overflow-y: auto; margin: 6px 0 0; padding-left: 18px;';
+    pin.members.forEach(function(member) {
+      const item = document.createElement('li');
+      item.textContent = member[0] + ': ' + member[1];
+      list.appendChild(item);
+    });
+    content.appendChild(list);
+  }
+  return content;
+}
+
+// Names placed on the server: one bitset per zoom level, bit i is pins[i]
+function showPlacedLabels(map, markers, markerPins) {
+  const labelBits = labels.bits.map(function(encoded) {
+    const raw = atob(encoded), bytes = new Uint8Array(raw.length);
+    for (let i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+    return bytes;
+  });
+  let shownZoom = null;
+
+  function update() {
+    const zoom = Math.max(labels.minZoom, Math.min(labels.maxZoom, Math.round(map.getZoom())));
+    if (zoom === shownZoom) return;
+    shownZoom = zoom;
+    const bits = labelBits[zoom - labels.minZoom];
+    markers.forEach(function(marker, k) {
+      const i = markerPins[k];
+      marker.setLabel((bits[i >> 3] >> (i & 7)) & 1
+        ? {text: pins[i].label || '', color: '#000', fontSize: '12px'}
+        : null);
+    });
+  }
+
+  map.addListener('zoom_changed', update);
+  update();
+}
+
+// Server-side clusters: only the clusters and pins in view are fetched on every idle event
+function addServerClusters(map, infoWindow) {
+  let shown = [];
+  let latestRequest = 0;
+
+  function clusterMarker(feature) {
+    const colorIdx = (feature.count <= 10) ? 0 : (feature.count <= 30) ? 1 : 2;
+    const position = {lat: feature.lat, lng: feature.lon};
+    const marker = new google.maps.Marker({
+      position,
+      icon: {
+        path: google.maps.SymbolPath.CIRCLE,
+        fillColor: CLUSTER_COLORS[colorIdx].bg,
+        fillOpacity: 1,
+        strokeColor: '#fff',
+        strokeWeight: 2,
+        scale: 24 + Math.min(24, feature.count)
+      },
+      label: {text: String(feature.count), color: '#fff', fontWeight: 'bold', fontSize: '15px'},
+      title: feature.count + ' locations, ' + feature.candidates + ' electrification candidates',
+      zIndex: 1000 + feature.count
+    });
+    marker.addListener('click', function() {
+      map.setCenter(position);
+      map.setZoom(feature.expansion_zoom);
+    });
+    return marker;
+  }
+
+  function refresh() {
+    const bounds = map.getBounds();
+    if (!bounds) return;
+    const sw = bounds.getSouthWest(), ne = bounds.getNorthEast();
+    const bbox = [sw.lng(), sw.lat(), ne.lng(), ne.lat()].map(function(v) { return v.toFixed(5); }).join(',');
+    const requestId = ++latestRequest;
+    fetch(clustersUrl + '?bbox=' + bbox + '&zoom=' + map.getZoom())
+      .then(function(response) { return response.json(); })
+      .then(function(result) {
+        // Ignore responses that arrive after a newer view was requested
+        if (requestId !== latestRequest) return;
+        shown.forEach(function(marker) { marker.setMap(null); });
+        shown = result.features.map(function(feature) {
+          const marker = feature.count ? clusterMarker(feature) : pinMarker(map, infoWindow, feature);
+          marker.setMap(map);
+          return marker;
+        });
+      })
+      .catch(function(error) { console.error('Failed to load clusters', error); });
+  }
+
+  map.addListener('idle', refresh);
+}
+
+// Viewport loading: pins in view are fetched on idle and kept; areas whose pins
+// were all returned are not requested again
+function addViewportPins(map, infoWindow) {
+  const loaded = {};
+  const completeAreas = [];
+  let latestRequest = 0;
+
+  function padded(bounds, ratio) {
+    const sw = bounds.getSouthWest(), ne = bounds.getNorthEast();
+    const dLat = (ne.lat() - sw.lat()) * ratio, dLng = (ne.lng() - sw.lng()) * ratio;
+    return {west: sw.lng() - dLng, south: sw.lat() - dLat, east: ne.lng() + dLng, north: ne.lat() + dLat};
+  }
+
+  function contains(area, bounds) {
+    const inner = padded(bounds, 0);
+    return inner.west >= area.west && inner.east <= area.east && inner.south >= area.south && inner.north <= area.north;
+  }
+
+  function refresh() {
+    const bounds = map.getBounds();
+    if (!bounds || completeAreas.some(function(area) { return contains(area, bounds); })) return;
+    // Fetch a margin around the view so small pans are already covered
+    const area = padded(bounds, 0.25);
+    const bbox = [area.west, area.south, area.east, area.north].map(function(v) { return v.toFixed(5); }).join(',');
+    const requestId = ++latestRequest;
+    fetch(pinsUrl + '?bbox=' + bbox + '&zoom=' + map.getZoom())
+      .then(function(response) { return response.json(); })
+      .then(function(result) {
+        result.pins.forEach(function(pin) {
+          if (loaded[pin.index]) return;
+          loaded[pin.index] = true;
+          pinMarker(map, infoWindow, pin).setMap(map);
+        });
+        if (!result.truncated) {
+          completeAreas.push(area);
+        } else if (requestId === latestRequest) {
+          console.info('Showing ' + result.pins.length + ' of ' + result.total + ' pins in view; zoom in to load the rest');
+        }
+      })
+      .catch(function(error) { console.error('Failed to load pins', error); });
+  }
+
+  map.addListener('idle', refresh);
+}
+
+// Density hexagons: the hexbin level for the current zoom is drawn for the cells in view on every idle event
+function addDensityHexagons(map, infoWindow) {
+  const SQRT3 = Math.sqrt(3);
+  let shown = [];
+  const legend = document.createElement('div');
+  legend.style.cssText = 'background: white; padding: 6px 8px; margin: 10px; font-size: 13px; box-shadow: 0 1px 4px rgba(0,0,0,0.3);';
+  map.controls[google.maps.ControlPosition.RIGHT_BOTTOM].push(legend);
+
+  function toLatLng(x, y) {
+    return {lat: Math.atan(Math.sinh(Math.PI * (1 - 2 * y))) * 180 / Math.PI, lng: x * 360 - 180};
+  }
+
+  function levelFor(zoom) {
+    let chosen = density[0];
+    density.forEach(function(level) { if (level.zoom <= zoom) chosen = level; });
+    return chosen;
+  }
+
+  function refresh() {
+    const bounds = map.getBounds();
+    if (!bounds || !density.length) return;
+    const level = levelFor(map.getZoom()), size = level.size;
+    const title = level.metric === 'candidates' ? 'Electrification candidates' : 'Locations';
+    legend.innerHTML = '<strong>' + title + ' per hexagon</strong>' + densityColors.map(function(color, k) {
+      return '<div><span style="display:inline-block;width:14px;height:14px;margin-right:6px;vertical-align:middle;background:' +
+             color + ';"></span>' + level.breaks[k] + ' - ' + level.breaks[k + 1] + '</div>';
+    }).join('');
+
+    shown.forEach(function(polygon) { polygon.setMap(null); });
+    shown = [];
+    for (let i = 0; i < level.q.length; i++) {
+      const cx = size * SQRT3 * (level.q[i] + level.r[i] / 2), cy = size * 1.5 * level.r[i];
+      const center = toLatLng(cx, cy);
+      if (!bounds.contains(center)) continue;
+      const corners = [];
+      for (let k = 0; k < 6; k++) {
+        const angle = Math.PI / 180 * (60 * k - 30);
+        corners.push(toLatLng(cx + size * Math.cos(angle), cy + size * Math.sin(angle)));
+      }
+      const color = densityColors[level.cls[i]];
+      const polygon = new google.maps.Polygon({
+        paths: corners, strokeColor: color, strokeWeight: 1, fillColor: color, fillOpacity: 0.6, map: map
+      });
+      const content = level.count[i] + ' locations, ' + level.candidates[i] + ' electrification candidates';
+      polygon.addListener('click', function() {
+        infoWindow.setContent(content);
+        infoWindow.setPosition(center);
+        infoWindow.open(map);
+      });
+      shown.push(polygon);
+    }
+  }
+
+  map.addListener('idle', refresh);
+}
+
+// Per-category layers: a checkbox per category; a category's pins are fetched and
+// their markers created the first time it is turned on
+function addCategoryLayers(map, infoWindow) {
+  const markers = {};
+  const loading = {};
+  const clusterer = (clusteringEnabled && !window.clusteringUnavailable && typeof markerClusterer !== 'undefined' &&
+                     markerClusterer && markerClusterer.MarkerClusterer) ? new markerClusterer.MarkerClusterer({
+    map: map,
+    markers: [],
+    renderer: {
+      render: function({ count, position }) {
+        const colorIdx = (count <= 10) ? 0 : (count <= 30) ? 1 : 2;
+        return new google.maps.Marker({
+          position,
+          icon: {
+            path: google.maps.SymbolPath.CIRCLE,
+            fillColor: CLUSTER_COLORS[colorIdx].bg,
+            fillOpacity: 1,
+            strokeColor: '#fff',
+            strokeWeight: 2,
+            scale: 24 + Math.min(24, count)
+          },
+          label: {text: String(count), color: '#fff', fontWeight: 'bold', fontSize: '15px'},
+          zIndex: 1000 + count
+        });
+      }
+    }
+  }) : null;
+
+  function categoryMarker(pin) {
+    const marker = new google.maps.Marker({
+      position: {lat: parseFloat(pin.lat), lng: parseFloat(pin.lng)},
+      icon: {url: pin.icon_url, scaledSize: new google.maps.Size(40, 40), anchor: new google.maps.Point(20, 20)},
+      title: (showLabels || pin.count > 1) ? (pin.label || '') : ''
+    });
+    marker.addListener('click', function() {
+      infoWindow.setContent(pinInfoContent(pin));
+      infoWindow.open(map, marker);
+    });
+    return marker;
+  }
+
+  function setShown(list, shown) {
+    if (clusterer) {
+      if (shown) clusterer.addMarkers(list); else clusterer.removeMarkers(list);
+    } else {
+      list.forEach(function(marker) { marker.setMap(shown ? map : null); });
+    }
+  }
+
+  const control = document.createElement('div');
+  control.style.cssText = 'background: white; padding: 6px 8px; margin: 10px; font-size: 13px; box-shadow: 0 1px 4px rgba(0,0,0,0.3);';
+  categories.forEach(function(category, k) {
+    const row = document.createElement('label');
+    row.style.cssText = 'display: flex; align-items: center; gap: 6px; cursor: pointer;';
+    const checkbox = document.createElement('input');
+    checkbox.type = 'checkbox';
+    checkbox.checked = category.visible;
+    const icon = document.createElement('img');
+    icon.src = category.icon_url;
+    icon.style.cssText = 'width: 20px; height: 20px;';
+    row.appendChild(checkbox);
+    row.appendChild(icon);
+    row.appendChild(document.createTextNode(category.name + ' (' + category.count + ')'));
+    control.appendChild(row);
+
+    function toggle() {
+      if (!checkbox.checked) {
+        if (markers[k]) setShown(markers[k], false);
+        return;
+      }
+      if (markers[k]) {
+        setShown(markers[k], true);
+        return;
+      }
+      if (loading[k]) return;
+      loading[k] = true;
+      fetch(categoriesUrl + '?index=' + k)
+        .then(function(response) { return response.json(); })
+        .then(function(result) {
+          markers[k] = result.pins.map(categoryMarker);
+          // The category may have been turned off while its pins were loading
+          if (checkbox.checked) setShown(markers[k], true);
+        })
+        .catch(function(error) { console.error('Failed to load category', category.name, error); })
+        .then(function() { loading[k] = false; });
+    }
+
+    checkbox.addEventListener('change', toggle);
+    if (category.visible) toggle();
+  });
+  map.controls[google.maps.ControlPosition.RIGHT_TOP].push(control);
+}
+
 function initMap() {
   // Check if Google Maps failed to load
   if (window.googleMapsUnavailable) {
@@ -525,7 +984,11 @@ function initMap() {
     });
     
     // Add state polygons with error handling
-    if (statePolygons && statePolygons.length > 0) {
+    if (stateLayerMode === 'vector_tiles') {
+      addStateTileLayer(map);
+    } else if (stateLayerMode === 'raster_tiles') {
+      addStateRasterLayer(map);
+    } else if (statePolygons && statePolygons.length > 0) {
       statePolygons.forEach(function(poly, index) {
         try {
           if (poly.paths && poly.paths.length > 0) {
@@ -549,6 +1012,17 @@ function initMap() {
     // Create markers with error handling
     const infoWindow = new google.maps.InfoWindow();
     let markers = [];
+    const markerPins = [];
+
+    if (pinLoading === 'server') {
+      addServerClusters(map, infoWindow);
+    } else if (pinLoading === 'viewport') {
+      addViewportPins(map, infoWindow);
+    } else if (pinLoading === 'hexbin') {
+      addDensityHexagons(map, infoWindow);
+    } else if (pinLoading === 'categories') {
+      addCategoryLayers(map, infoWindow);
+    }
     
     if (pins && pins.length > 0) {
       pins.forEach(function(pin, index) {
@@ -559,18 +1033,19 @@ function initMap() {
               icon: {
                 url: pin.icon_url,
                 scaledSize: new google.maps.Size(40, 40),
-                anchor: new google.maps.Point(20, 20)
+                anchor: new google.maps.Point(20, 20),
+                labelOrigin: new google.maps.Point(20, 48)
               },
-              title: showLabels ? (pin.label || '') : ''
+              title: (showLabels || pin.count > 1) ? (pin.label || '') : ''
             });
             
             marker.addListener('click', function() {
-              const content = `<div><strong>${pin.label || 'Unknown Location'}</strong><br>Candidates: ${pin.electrification_candidates || 'N/A'}</div>`;
-              infoWindow.setContent(content);
+              infoWindow.setContent(pinInfoContent(pin));
               infoWindow.open(map, marker);
             });
             
             markers.push(marker);
+            markerPins.push(index);
           } else {
             console.warn('Invalid pin coordinates at index', index, ':', pin);
           }
@@ -580,6 +1055,10 @@ function initMap() {
       });
       console.log('Created', markers.length, 'markers from', pins.length, 'pins');
     }
+
+    if (showLabels && labels && markers.length > 0) {
+      showPlacedLabels(map, markers, markerPins);
+    }
     
     // FIXED: Enhanced clustering decision logic with comprehensive boolean evaluation
     console.log('='.repeat(60));
@@ -722,9 +1201,16 @@ function initMap() {
                 console.log('DEBUG: Adding', pins.length, 'rows to cluster table');
                 pins.forEach(function(pin, index) {
                   try {
-                    const row = document.createElement('tr');
-                    row.innerHTML = `<td>${pin.label || 'Unknown'}</td><td style="text-align: right;">${pin.electrification_candidates || 'N/A'}</td>`;
-                    tableBody.appendChild(row);
+                    // Merged pins list each of their locations
+                    (pin.members || [[pin.label, pin.electrification_candidates]]).forEach(function(member) {
+                      const row = document.createElement('tr');
+                      const name = row.insertCell();
+                      name.textContent = member[0] || 'Unknown';
+                      const candidates = row.insertCell();
+                      candidates.style.textAlign = 'right';
+                      candidates.textContent = member[1] || 'N/A';
+                      tableBody.appendChild(row);
+                    });
                     if (index < 3) console.log('DEBUG: Added row', index + 1, ':', pin.label);
                   } catch (rowError) {
                     console.warn('Error adding table row', index, ':', rowError);
@@ -1165,13 +1651,23 @@ def google_maps_form():
         }
         clustering_enabled = request.form.get("clustering_enabled") == 'on'
         show_labels = request.form.get("show_labels") == 'on'
+        state_layer = request.form.get("state_layer", "polygons")
+        if state_layer not in STATE_LAYER_MODES:
+            state_layer = "polygons"
+        pin_loading = request.form.get("pin_loading", "client")
+        if pin_loading not in PIN_LOADING_MODES:
+            pin_loading = "client"
+        merge_colocated = request.form.get("colocated_pins", "merge") != "separate"
         
         # Store data for next step
         session_data = {
             'csv_data': df.to_json(),
             'clustering_enabled': clustering_enabled,
             'show_labels': show_labels,
-            'custom_colors': custom_colors
+            'custom_colors': custom_colors,
+            'state_layer': state_layer,
+            'pin_loading': pin_loading,
+            'merge_colocated': merge_colocated
         }
         
         # If multiple categories, show pin assignment page
@@ -1180,7 +1676,8 @@ def google_maps_form():
         else:
             # Single category - generate map directly
             pin_assignments = {'Default': {'type': 'sphere', 'color': '#00a1e0'}}
-            return generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_labels, custom_colors)
+            return generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_labels, custom_colors, state_layer,
+                                                 pin_loading, merge_colocated)
 
 @app.route("/generate_google_map", methods=["POST"])
 @csrf.exempt  # Temporarily exempt from CSRF for testing
@@ -1195,6 +1692,13 @@ def generate_google_map():
         clustering_enabled = session_data['clustering_enabled']
         show_labels = session_data.get('show_labels', True)  # Default to True for backward compatibility
         custom_colors = session_data['custom_colors']
+        state_layer = session_data.get('state_layer', 'polygons')
+        if state_layer not in STATE_LAYER_MODES:
+            state_layer = 'polygons'
+        pin_loading = session_data.get('pin_loading', 'client')
+        if pin_loading not in PIN_LOADING_MODES:
+            pin_loading = 'client'
+        merge_colocated = session_data.get('merge_colocated', True)
         
     except Exception as e:
         return Response(f"Error parsing session data: {e}", status=400)
@@ -1212,22 +1716,41 @@ def generate_google_map():
             if category not in pin_assignments:
                 pin_assignments[category] = {}
             pin_assignments[category]['color'] = value
+        elif key.startswith("pin_visible_"):
+            category = key[12:]  # Remove "pin_visible_" prefix
+            if category not in pin_assignments:
+                pin_assignments[category] = {}
+            pin_assignments[category]['visible'] = value != "hidden"
     
-    return generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_labels, custom_colors)
+    return generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_labels, custom_colors, state_layer,
+                                         pin_loading, merge_colocated)
 
-def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_labels, custom_colors):
+def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_labels, custom_colors, state_layer="polygons",
+                                  pin_loading="client", merge_colocated=True):
     """Generate Google Map from processed data"""
+
+    # Maps are stored under a fingerprint of the data and every choice that
+    # shapes them, so generating the same map again returns the stored one
+    map_id = map_fingerprint(df, {
+        "pin_assignments": pin_assignments,
+        "clustering_enabled": clustering_enabled,
+        "show_labels": show_labels,
+        "colors": custom_colors,
+        "state_layer": state_layer,
+        "pin_loading": pin_loading,
+        "merge_colocated": merge_colocated,
+        "settings": MAP_SETTINGS,
+    })
+    if map_id in MAP_DATA:
+        print(f"Reusing map {map_id}: same data and options as a stored map")
+        return map_ready_response(map_id, len(MAP_DATA[map_id]["pins"]), clustering_enabled)
     
     # Format ZIP codes
-    def format_zip(value):
-        if pd.isna(value) or value == "":
-            return ""
-        try:
-            return f"{int(float(value)):05d}"
-        except (ValueError, TypeError):
-            return str(value)
-    
-    df["ZIP/Postal Code"] = df["ZIP/Postal Code"].apply(format_zip)
+    df["ZIP/Postal Code"] = format_zip_codes(df["ZIP/Postal Code"])
+
+    # Only the boundary partitions this upload needs are loaded
+    countries = countries_in_data(df, DEFAULT_BOUNDARY_COUNTRIES)
+    states = boundary_store.boundaries(countries)
     
     # Add missing columns
     for optional_col in ["Street Address", "City", "State"]:
@@ -1236,21 +1759,16 @@ def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_
         else:
             df[optional_col] = df[optional_col].fillna("")
     
-    # Helper function to build address string
-    def build_address_string(row):
-        parts = []
-        if row.get("Street Address", "").strip():
-            parts.append(row["Street Address"].strip())
-        if row.get("City", "").strip():
-            parts.append(row["City"].strip())
-        if row.get("State", "").strip():
-            parts.append(row["State"].strip())
-        if row.get("ZIP/Postal Code", "").strip():
-            parts.append(row["ZIP/Postal Code"].strip())
-        
-        if parts:
-            return ", ".join(parts)
-        return ""
+    # Address strings: the non-empty parts, plus the country when the row names one
+    country_names = geocode_country_names(df)
+    address_parts = join_address_parts(df)
+    if "Country" in df.columns:
+        has_country = (df["Country"].notna() & (df["Country"].astype(str).str.strip() != "")).to_numpy()
+    else:
+        has_country = False
+    addresses = np.where((address_parts != "") & has_country, address_parts + ", " + country_names, address_parts)
+    zip_codes = df["ZIP/Postal Code"].str.strip()
+    state_abbrs = df["State"].astype(str).str.strip()
 
     # Geocode locations using the official Google Maps client with improved tracking
     lat_list, lon_list = [], []
@@ -1262,13 +1780,15 @@ def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_
 
     gmaps = googlemaps.Client(key=api_key)
 
-    for counter, (idx, row) in enumerate(df.iterrows(), 1):
+    if "Location Name" in df.columns:
+        location_names = df["Location Name"].astype(str)
+    else:
+        location_names = [f"Location {counter}" for counter in range(1, len(df) + 1)]
+    rows = zip(location_names, addresses, zip_codes, state_abbrs, country_names)
+    for location_name, addr_str, zip_code, state_abbr, country_name in rows:
         lat, lon = None, None # Reset lat/lon for each row
-        location_name = str(row.get("Location Name", f"Location {counter}"))
         
         try:
-            addr_str = build_address_string(row)
-
             # Primary: Try full address geocoding
             if addr_str:
                 geocode_result = gmaps.geocode(addr_str)
@@ -1278,8 +1798,8 @@ def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_
                     geocoding_stats["full_address"] += 1
 
             # Fallback 1: ZIP only if the full address failed
-            if lat is None and row.get("ZIP/Postal Code", "").strip():
-                zip_addr = f"{row['ZIP/Postal Code']}, USA"
+            if lat is None and zip_code:
+                zip_addr = f"{zip_code}, {country_name}"
                 geocode_result = gmaps.geocode(zip_addr)
                 if geocode_result:
                     loc = geocode_result[0]['geometry']['location']
@@ -1288,10 +1808,9 @@ def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_
                     print(f"Used ZIP fallback for {location_name}")
 
             # Fallback 2: State centroid
-            if lat is None and row.get("State", "").strip():
-                state_abbr = row["State"].strip()
-                if state_abbr in us_states["StateAbbr"].values:
-                    state_geom = us_states[us_states["StateAbbr"] == state_abbr].geometry.iloc[0]
+            if lat is None and state_abbr:
+                state_geom = boundary_store.find_unit(countries, state_abbr)
+                if state_geom is not None:
                     centroid = state_geom.centroid
                     lat, lon = centroid.y, centroid.x
                     geocoding_stats["state_centroid"] += 1
@@ -1324,6 +1843,7 @@ def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_
     
     # Create pins with improved error handling
     pins = []
+    raw_pin_coords = []
     pin_creation_errors = 0
     
     for index, row in df.iterrows():
@@ -1350,9 +1870,10 @@ def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_
                         pin_config['color'] = '#00a1e0'
                     
                     # Create the pin
+                    raw_pin_coords.append({"lat": lat_float, "lng": lon_float})
                     pin = {
-                        "lat": lat_float,
-                        "lng": lon_float,
+                        "lat": round_coordinate(lat_float, COORDINATE_PRECISION),
+                        "lng": round_coordinate(lon_float, COORDINATE_PRECISION),
                         "label": str(row.get("Location Name", f"Location {index + 1}")),
                         "electrification_candidates": str(row.get("Electrification Candidates", "0")),
                         "category": category,
@@ -1373,66 +1894,187 @@ def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_
     
     print(f"Created {len(pins)} pins successfully, {pin_creation_errors} errors")
     
-    # Create state polygons with improved error handling
+    # Create state polygons with improved error handling; the tile modes
+    # fetch state geometry from the /tiles endpoints instead
     state_polygons = []
-    for _, row in us_states.iterrows():
-        try:
-            color = custom_colors.get(row.get("CaaS Group"), "#cccccc")
-            geom = row["geometry"]
+    raw_state_paths = []
+    if state_layer == "polygons":
+        for _, row in states.iterrows():
+            try:
+                color = custom_colors.get(row.get("CaaS Group"), "#cccccc")
+                geom = row["geometry"]
+        
+                if pd.isna(geom) or geom is None:
+                    continue
             
-            if pd.isna(geom) or geom is None:
-                continue
-                
-            paths = []
-            if geom.geom_type == "Polygon":
-                # Convert exterior coordinates to lat/lng format
-                coords = list(geom.exterior.coords)
-                if len(coords) > 2:  # Need at least 3 points for a polygon
-                    path = [{"lat": float(y), "lng": float(x)} for x, y in coords]
-                    paths = [path]
-            elif geom.geom_type == "MultiPolygon":
-                # Handle multiple polygons
-                for poly in geom.geoms:
-                    coords = list(poly.exterior.coords)
-                    if len(coords) > 2:
-                        path = [{"lat": float(y), "lng": float(x)} for x, y in coords]
-                        paths.append(path)
-            else:
+                paths = []
+                if geom.geom_type == "Polygon":
+                    # Convert exterior coordinates to lat/lng format
+                    coords = list(geom.exterior.coords)
+                    if len(coords) > 2:  # Need at least 3 points for a polygon
+                        paths = [coords]
+                elif geom.geom_type == "MultiPolygon":
+                    # Handle multiple polygons
+                    for poly in geom.geoms:
+                        coords = list(poly.exterior.coords)
+                        if len(coords) > 2:
+                            paths.append(coords)
+                else:
+                    continue
+        
+                if paths:  # Only add if we have valid paths
+                    raw_state_paths.append([[{"lat": float(y), "lng": float(x)} for x, y in coords] for coords in paths])
+                    paths = [[{"lat": round_coordinate(y, COORDINATE_PRECISION),
+                               "lng": round_coordinate(x, COORDINATE_PRECISION)} for x, y in coords]
+                             for coords in paths]
+                    state_polygons.append({
+                        "paths": paths,
+                        "color": color,
+                        "state": row.get("StateAbbr", "Unknown")
+                    })
+            except Exception as e:
+                print(f"Error processing state polygon for {row.get('StateAbbr', 'Unknown')}: {e}")
                 continue
-            
-            if paths:  # Only add if we have valid paths
-                state_polygons.append({
-                    "paths": paths,
-                    "color": color,
-                    "state": row.get("StateAbbr", "Unknown")
-                })
-        except Exception as e:
-            print(f"Error processing state polygon for {row.get('StateAbbr', 'Unknown')}: {e}")
-            continue
     
     print(f"Created {len(state_polygons)} state polygons")
+
+    # Pins geocoded to the same point (ZIP or state centroid fallbacks) become one marker per
+    # category; the server-side modes index every pin themselves
+    if merge_colocated and pin_loading in ("client", "categories") and pins:
+        icon_urls = {pin["category"]: pin["icon_url"] for pin in pins}
+        merged = merge_colocated_pins(pd.DataFrame(pins), precision=None, lat_col="lat", lon_col="lng",
+                                      category_col="category", name_col="label",
+                                      candidates_col="electrification_candidates")
+        pins = [
+            {
+                "lat": pin["lat"],
+                "lng": pin["lng"],
+                "label": pin["label"],
+                "electrification_candidates": str(pin["electrification_candidates"]),
+                "category": pin["category"],
+                "icon_url": icon_urls[pin["category"]],
+                "count": int(pin[MERGED_COUNT]),
+                "members": [[name, candidates] for name, candidates in
+                            zip(pin[MERGED_NAMES], pin[MERGED_CANDIDATES])] if pin[MERGED_COUNT] > 1 else None,
+            }
+            for pin in merged.to_dict("records")
+        ]
+        print(f"Merged co-located pins into {len(pins)} markers")
+        # Each merged pin carries the coordinates of its first pin
+        raw_pin_coords = [raw_pin_coords[row] for row in merged[FIRST_ROW]]
+
+    # Report how much coordinate quantization saved on the pins and polygons this map serializes;
+    # the hexbin mode sends density cells instead of pins
+    quantization_report = QuantizationReport(COORDINATE_PRECISION)
+    if pins and pin_loading != "hexbin":
+        quantization_report.add_payloads("pins", raw_pin_coords, [{"lat": p["lat"], "lng": p["lng"]} for p in pins])
+    if state_polygons:
+        quantization_report.add_payloads("states", raw_state_paths, [p["paths"] for p in state_polygons])
+    print(quantization_report)
     
     # Store map data with validation
-    map_id = str(uuid.uuid4())
-    
     # Validate data before storing
     if not pins:
         print("Warning: No valid pins created for map")
-    if not state_polygons:
+    if not state_polygons and state_layer == "polygons":
         print("Warning: No state polygons created for map")
+
+    # Server-side clusters or pin index: built once per map, kept in memory and stored next to the hosted maps
+    pin_icons, cluster_index, pin_index = [], None, None
+    if pin_loading in ("server", "viewport"):
+        icon_index = {}
+        categories = [icon_index.setdefault(pin["icon_url"], len(icon_index)) for pin in pins]
+        pin_icons = list(icon_index)
+        pin_columns = (
+            [pin["lat"] for pin in pins],
+            [pin["lng"] for pin in pins],
+            pd.to_numeric(pd.Series([pin["electrification_candidates"] for pin in pins], dtype=object), errors="coerce"),
+            [pin["label"] for pin in pins],
+            categories,
+        )
+        if pin_loading == "server":
+            # Kept in MAP_DATA with the rest of the map, like the pins themselves
+            cluster_index = ClusterIndex.build(*pin_columns)
+            print(f"Built server-side cluster index for {len(pins)} pins")
+        else:
+            pin_index = PinGridIndex.build(*pin_columns)
+            print(f"Built viewport pin index for {len(pins)} pins")
     
+    # Candidate-weighted hexbin grids per zoom level stand in for the pins
+    density = None
+    if pin_loading == "hexbin":
+        density = density_levels(
+            [pin["lat"] for pin in pins],
+            [pin["lng"] for pin in pins],
+            pd.to_numeric(pd.Series([pin["electrification_candidates"] for pin in pins], dtype=object), errors="coerce"),
+        )
+        print(f"Hexbin levels (zoom, cells): {[(level['zoom'], len(level['q'])) for level in density]}")
+
+    # Per-category layers: each category's pins are served on their own once its toggle is turned on
+    categories, category_pins = None, None
+    if pin_loading == "categories":
+        category_index = {}
+        categories, category_pins = [], []
+        for pin in pins:
+            category = pin["category"]
+            if category not in category_index:
+                category_index[category] = len(categories)
+                categories.append({
+                    "name": str(category),
+                    "icon_url": pin["icon_url"],
+                    "count": 0,
+                    "visible": pin_assignments.get(category, {}).get("visible", True),
+                })
+                category_pins.append([])
+            categories[category_index[category]]["count"] += 1
+            category_pins[category_index[category]].append(pin)
+        print(f"Split pins into {len(categories)} category layers")
+
+    # Which pin names are drawn at each zoom is decided once here, not in the browser
+    labels = None
+    if show_labels and pin_loading == "client" and pins:
+        placement = place_labels(
+            [pin["lat"] for pin in pins],
+            [pin["lng"] for pin in pins],
+            [pin["label"] for pin in pins],
+            priority=pd.to_numeric(pd.Series([pin["electrification_candidates"] for pin in pins], dtype=object),
+                                   errors="coerce"),
+        )
+        labels = placement.as_json()
+        print(f"Placed labels per zoom: {placement.counts()}")
+
+    if state_layer == "raster_tiles":
+        # Only the color schemes of generated maps are rendered by /tiles/choropleth
+        get_state_raster_renderer(countries).allow_scheme(color_scheme_key(custom_colors))
+
     MAP_DATA[map_id] = {
         "pins": pins,
         "state_polygons": state_polygons,
         "clustering_enabled": clustering_enabled,
         "show_labels": show_labels,
         "group_colors": custom_colors,
+        "state_layer": state_layer,
+        "boundary_countries": countries_key(countries),
+        "pin_loading": pin_loading,
+        "cluster_index": cluster_index,
+        "pin_index": pin_index,
+        "pin_icons": pin_icons,
+        "labels": labels,
+        "density": density,
+        "categories": categories,
+        "category_pins": category_pins,
+        "quantization": quantization_report.as_dict(),
         "created_at": time.time()
     }
     
     print(f"Stored map data with ID {map_id}: {len(pins)} pins, {len(state_polygons)} polygons")
     
     # Return improved success message with progress indicator
+    return map_ready_response(map_id, len(pins), clustering_enabled)
+
+
+def map_ready_response(map_id, pin_count, clustering_enabled):
+    """Progress page that redirects to a stored map."""
     return Response(f'''
     <!DOCTYPE html>
     <html>
@@ -1458,7 +2100,7 @@ def generate_google_map_from_data(df, pin_assignments, clustering_enabled, show_
             <div class="status"><strong>Generating Your Map...</strong></div>
             <div class="progress-bar"><div class="progress-fill"></div></div>
             <div class="details">
-                <p>Processing {len(pins)} locations with geocoding and map rendering.</p>
+                <p>Processing {pin_count} locations with geocoding and map rendering.</p>
                 <p>This may take a moment. You will be redirected automatically when ready.</p>
                 <p><small>Clustering: {'Enabled' if clustering_enabled else 'Disabled'}</small></p>
             </div>
@@ -1502,6 +2144,13 @@ def serve_google_map(map_id):
         clustering_enabled = data.get("clustering_enabled", False)
         show_labels = data.get("show_labels", True)
         group_colors = data.get("group_colors", GROUP_COLORS)
+        state_layer = data.get("state_layer", "polygons")
+        boundary_countries = data.get("boundary_countries", countries_key(DEFAULT_BOUNDARY_COUNTRIES))
+        pin_loading = data.get("pin_loading", "client")
+        if pin_loading != "client":
+            # Pins are fetched per view from /google_map/<map_id>/clusters or /pins, per category from
+            # /categories, or replaced by the hexbin grids
+            pins = []
         
         # DEBUG: Enhanced logging for template rendering values
         print("=" * 60)
@@ -1548,13 +2197,89 @@ def serve_google_map(map_id):
             pins=json.dumps(pins),
             clustering_enabled=clustering_enabled,  # FIXED: Pass boolean directly
             show_labels=show_labels,  # FIXED: Pass boolean directly
-            group_colors=group_colors
+            group_colors=group_colors,
+            state_layer=state_layer,
+            state_tile_max_zoom=STATE_TILE_MAX_ZOOM,
+            raster_tile_max_zoom=RASTER_TILE_MAX_ZOOM,
+            state_color_scheme=color_scheme_key(group_colors),
+            boundary_countries=boundary_countries,
+            pin_loading=pin_loading,
+            pin_icons=data.get("pin_icons", []),
+            labels=data.get("labels"),
+            density=data.get("density"),
+            density_colors=DENSITY_COLORS,
+            categories=data.get("categories"),
+            categories_url=url_for("google_map_category_pins", map_id=map_id),
+            clusters_url=url_for("google_map_clusters", map_id=map_id),
+            pins_url=url_for("google_map_pins", map_id=map_id)
         )
         
     except Exception as e:
         print(f"Error serving map {map_id}: {e}")
         return Response(f"Error loading map: {str(e)}", status=500)
 
+@app.route("/google_map/<map_id>/clusters")
+def google_map_clusters(map_id):
+    """Clusters and single pins of a server-clustered map for ?bbox=west,south,east,north&zoom=z."""
+    data = MAP_DATA.get(map_id)
+    if not data or data.get("cluster_index") is None:
+        return Response("Map not found.", status=404)
+    bbox = parse_bbox(request.args.get("bbox"))
+    zoom = request.args.get("zoom", type=int)
+    if bbox is None or zoom is None:
+        return Response("bbox and zoom are required.", status=400)
+    return jsonify({"zoom": zoom, "features": data["cluster_index"].get_clusters(bbox, zoom)})
+
+@app.route("/google_map/<map_id>/pins")
+def google_map_pins(map_id):
+    """Pins of a viewport-loaded map inside ?bbox=west,south,east,north, thinned for &zoom=z when crowded."""
+    data = MAP_DATA.get(map_id)
+    if not data or data.get("pin_index") is None:
+        return Response("Map not found.", status=404)
+    bbox = parse_bbox(request.args.get("bbox"))
+    zoom = request.args.get("zoom", type=int)
+    if bbox is None or zoom is None:
+        return Response("bbox and zoom are required.", status=400)
+    return jsonify({"zoom": zoom, **data["pin_index"].get_pins(bbox, zoom)})
+
+@app.route("/google_map/<map_id>/categories")
+def google_map_category_pins(map_id):
+    """Pins of one category (?index=k) of a map with per-category layers."""
+    data = MAP_DATA.get(map_id)
+    if not data or data.get("category_pins") is None:
+        return Response("Map not found.", status=404)
+    index = request.args.get("index", type=int)
+    if index is None or not 0 <= index < len(data["category_pins"]):
+        return Response("A valid category index is required.", status=400)
+    return jsonify({"pins": data["category_pins"][index]})
+
+@app.route("/tiles/states/<int:z>/<int:x>/<int:y>.pbf")
+def state_vector_tile(z, x, y):
+    """Serve a Mapbox Vector Tile of the state boundaries."""
+    if not is_valid_tile(z, x, y, STATE_TILE_MAX_ZOOM):
+        return Response("Tile out of range.", status=404)
+    countries = parse_countries_key(request.args.get("countries", countries_key(DEFAULT_BOUNDARY_COUNTRIES)))
+    if countries is None:
+        return Response("Unsupported countries.", status=400)
+    tile = get_state_tile_source(countries).get_tile(z, x, y)
+    return Response(tile, mimetype="application/vnd.mapbox-vector-tile")
+
+@app.route("/tiles/choropleth/<scheme>/<int:z>/<int:x>/<int:y>.png")
+def state_raster_tile(scheme, z, x, y):
+    """Serve a pre-rendered PNG tile of the state choropleth for a color scheme."""
+    if not is_valid_tile(z, x, y, RASTER_TILE_MAX_ZOOM):
+        return Response("Tile out of range.", status=404)
+    countries = parse_countries_key(request.args.get("countries", countries_key(DEFAULT_BOUNDARY_COUNTRIES)))
+    if countries is None:
+        return Response("Unsupported countries.", status=400)
+    try:
+        tile = get_state_raster_renderer(countries).get_tile(scheme, z, x, y)
+    except ValueError:
+        return Response("Invalid color scheme.", status=400)
+    except LookupError:
+        return Response("Color scheme not found.", status=404)
+    return Response(tile, mimetype="image/png")
+
 @app.route("/download_template")
 def download_template():
     """Download Excel template with Location Pins sheet"""
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Preprocessing Micro-Benchmark
+
+Times the per-row ZIP formatting, address building and table row bucketing
+that map generation used to do against the columnar versions in
+utils/preprocessing.py, on a synthetic upload, and checks both give the
+same result.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.boundaries import geocode_country_name
+from utils.preprocessing import (build_table_data, format_zip_codes, geocode_country_names, hex_to_rgba,
+                                 join_address_parts)
+
+
+def synthetic_upload(rows, seed=0):
+    """Upload-like DataFrame with numeric and text ZIP codes, missing parts and a Country column."""
+    rng = np.random.default_rng(seed)
+    zips = rng.integers(501, 99950, rows).astype(object)
+    zips[rng.random(rows) < 0.1] = "K1A 0B6"
+    zips[rng.random(rows) < 0.05] = np.nan
+    return pd.DataFrame({
+        "Location Name": [f"Location {i}" for i in range(rows)],
+        "Street Address": np.where(rng.random(rows) < 0.7, "123 Main St", ""),
+        "City": np.where(rng.random(rows) < 0.8, "Anytown", ""),
+        "State": rng.choice(["CA", "TX", "NY", "", "ON"], rows),
+        "ZIP/Postal Code": zips,
+        "Country": rng.choice(["US", "Canada", None], rows),
+        "Electrification Candidates": rng.integers(0, 150, rows),
+        "Category Name": rng.choice(["Retail", "Warehouse", "Depot"], rows),
+    })
+
+
+# --- The per-row implementations generate_map used before ---
+
+def format_zip(value):
+    if pd.isna(value) or value == "":
+        return ""
+    try:
+        return f"{int(float(value)):05d}"
+    except (ValueError, TypeError):
+        return str(value)
+
+
+def build_address_string(row):
+    parts = []
+    for column in ("Street Address", "City", "State", "ZIP/Postal Code"):
+        if row.get(column, "").strip():
+            parts.append(row[column].strip())
+    country = geocode_country_name(row.get("Country"))
+    if parts:
+        return ", ".join(parts) + f", {country}"
+    return country
+
+
+def table_rows_per_row(df):
+    table_rows = []
+    for _, row in df.iterrows():
+        n = row.get('Electrification Candidates', 1)
+        try:
+            n = int(n)
+        except Exception:
+            n = 1
+        if n >= 100:
+            color = '#0056b8'
+        elif n >= 50:
+            color = '#00a1e0'
+        elif n >= 10:
+            color = '#00bfae'
+        elif n >= 2:
+            color = '#6bc04b'
+        else:
+            color = None
+        table_rows.append({
+            "location": row['Location Name'],
+            "candidates": row['Electrification Candidates'],
+            "color": hex_to_rgba(color, alpha=0.25) if color else "transparent",
+        })
+    return table_rows
+
+
+def addresses_columnar(df):
+    country_names = geocode_country_names(df)
+    parts = join_address_parts(df)
+    return list(np.where(parts != "", parts + ", " + country_names, country_names))
+
+
+def table_data_rows(data):
+    """The rows of :func:`build_table_data`'s columns, for comparing with the per-row table."""
+    return [{"location": location, "candidates": candidates, "color": data["tiers"][tier]["color"]}
+            for location, candidates, tier in zip(data["location"], data["candidates"], data["tier"])]
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-row and columnar upload preprocessing")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows in the synthetic upload (default: 100000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the fastest is reported (default: 3)")
+    args = parser.parse_args()
+
+    df = synthetic_upload(args.rows)
+    zipped = df.assign(**{"ZIP/Postal Code": df["ZIP/Postal Code"].apply(format_zip)})
+    stages = [
+        ("ZIP formatting",
+         lambda: list(df["ZIP/Postal Code"].apply(format_zip)),
+         lambda: list(format_zip_codes(df["ZIP/Postal Code"])), None),
+        ("Address building",
+         lambda: [build_address_string(row) for _, row in zipped.iterrows()],
+         lambda: addresses_columnar(zipped), None),
+        ("Table rows",
+         lambda: table_rows_per_row(df),
+         lambda: build_table_data(df), table_data_rows),
+    ]
+
+    print(f"{args.rows} rows, best of {args.repeat}")
+    print(f"{'Stage':<18} {'Per row (s)':>12} {'Columnar (s)':>13} {'Speedup':>8}")
+    for name, per_row, columnar, as_rows in stages:
+        per_row_time, expected = best_time(per_row, args.repeat)
+        columnar_time, result = best_time(columnar, args.repeat)
+        if (as_rows(result) if as_rows else result) != expected:
+            raise SystemExit(f"{name}: columnar result differs from the per-row result")
+        print(f"{name:<18} {per_row_time:>12.3f} {columnar_time:>13.3f} {per_row_time / columnar_time:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
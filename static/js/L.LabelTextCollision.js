@@ -5,6 +5,16 @@ L.LabelTextCollision = L.Canvas.extend({
          */
         collisionFlg: true,
         labelPadding: 2, // Added padding option
+        /**
+         * Side in pixels of the screen cells used to look up colliding labels;
+         * 0 compares every label with every drawn label (O(n^2))
+         */
+        collisionGridSize: 64,
+        /**
+         * Maximum number of labels tested per redraw (0 = no limit); labels
+         * past the cap are skipped for that frame
+         */
+        maxLabelsPerFrame: 0,
     },
 
     initialize: function(options) {
@@ -71,8 +81,10 @@ L.LabelTextCollision = L.Canvas.extend({
     },
 
     _update: function() {
-        // textList
+        // textList, and the same bounds bucketed by screen cell; rebuilt on every redraw
         this._textList = [];
+        this._textGrid = new Map();
+        this._labelsTested = 0;
 
         L.Renderer.prototype._update.call(this);
         var b = this._bounds,
@@ -114,6 +126,10 @@ L.LabelTextCollision = L.Canvas.extend({
 
     _text: function(ctx, layer) {
         if (layer.options.text != undefined) {
+            if (this.options.maxLabelsPerFrame && this._labelsTested >= this.options.maxLabelsPerFrame) {
+                return;
+            }
+            this._labelsTested++;
             ctx.globalAlpha = 1;
 
             var p = layer._point;
@@ -150,16 +166,11 @@ L.LabelTextCollision = L.Canvas.extend({
                 L.point(p.x + offsetX + textWidth + this.options.labelPadding, p.y + offsetY + (fontSize * 0.2) + this.options.labelPadding)
             );
 
-            if (this.options.collisionFlg) {
-                for (var index in this._textList) {
-                    var existingBounds = this._textList[index];
-                    if (labelBounds.intersects(existingBounds)) {
-                        return; //  Don't draw if it intersects.
-                    }
-                }
+            if (this.options.collisionFlg && this._collides(labelBounds)) {
+                return; //  Don't draw if it intersects.
             }
 
-            this._textList.push(labelBounds); // Store the padded bounds.
+            this._addLabelBounds(labelBounds); // Store the padded bounds.
 
             ctx.strokeStyle = "white";
             ctx.strokeText(layer.options.text, p.x + offsetX, p.y + offsetY);
@@ -174,6 +185,62 @@ L.LabelTextCollision = L.Canvas.extend({
         }
     },
 
+    // Visit the keys of the grid cells a bounds overlaps; stops when fn returns true.
+    // Keys are numeric; two cells sharing a key only adds candidates to the exact check.
+    _eachCell: function(bounds, fn) {
+        var size = this.options.collisionGridSize,
+            minX = Math.floor(bounds.min.x / size), maxX = Math.floor(bounds.max.x / size),
+            minY = Math.floor(bounds.min.y / size), maxY = Math.floor(bounds.max.y / size);
+
+        for (var x = minX; x <= maxX; x++) {
+            for (var y = minY; y <= maxY; y++) {
+                if (fn(x * 65536 + y)) {
+                    return true;
+                }
+            }
+        }
+        return false;
+    },
+
+    _collides: function(labelBounds) {
+        if (!this.options.collisionGridSize) {
+            for (var i = 0; i < this._textList.length; i++) {
+                if (labelBounds.intersects(this._textList[i])) {
+                    return true;
+                }
+            }
+            return false;
+        }
+
+        var grid = this._textGrid;
+        return this._eachCell(labelBounds, function(key) {
+            var cell = grid.get(key);
+            if (cell) {
+                for (var i = 0; i < cell.length; i++) {
+                    if (labelBounds.intersects(cell[i])) {
+                        return true;
+                    }
+                }
+            }
+            return false;
+        });
+    },
+
+    _addLabelBounds: function(labelBounds) {
+        this._textList.push(labelBounds);
+        if (this.options.collisionGridSize) {
+            var grid = this._textGrid;
+            this._eachCell(labelBounds, function(key) {
+                var cell = grid.get(key);
+                if (cell) {
+                    cell.push(labelBounds);
+                } else {
+                    grid.set(key, [labelBounds]);
+                }
+            });
+        }
+    },
+
     _getCenter: function(points) {
         var i, halfDist, segDist, dist, p1, p2, ratio, len = points.length;
 
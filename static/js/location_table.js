@@ -0,0 +1,138 @@
+// Virtual-scrolling location table of the generated map pages, served as a content-hashed asset.
+// The rows come as columnar JSON (utils/preprocessing.py build_table_data); only the rows in
+// view exist in the DOM, and sorting and filtering only reorder an array of row indexes.
+(function() {
+  var ROW_HEIGHT = 24; // px, the height of .location-row in map_page.css
+  var OVERSCAN = 8;    // rows kept rendered above and below the view
+
+  function init() {
+    var source = document.getElementById('location-table-data');
+    var container = document.getElementById('location-table');
+    if (!source || !container) { return; }
+    var data = JSON.parse(source.textContent);
+    var total = data.location.length;
+    var viewport = container.querySelector('.location-table-viewport');
+    var spacer = container.querySelector('.location-table-spacer');
+    var rowsEl = container.querySelector('.location-table-rows');
+    var countEl = container.querySelector('.location-table-count');
+    var tierSelect = container.querySelector('select[name="tier"]');
+    var categorySelect = container.querySelector('select[name="category"]');
+    var headers = container.querySelectorAll('[data-sort]');
+    var collator = new Intl.Collator(undefined, {numeric: true, sensitivity: 'base'});
+    var orders = {};  // row indexes in ascending order per sort key, computed on first use
+    var sortKey = null, sortDir = 1, view = [], pool = [], frame = null;
+
+    data.tiers.forEach(function(tier, index) {
+      tierSelect.add(new Option(tier.label, index));
+    });
+    data.categories.forEach(function(category, index) {
+      categorySelect.add(new Option(category, index));
+    });
+    categorySelect.hidden = data.categories.length < 2;
+
+    function candidateCount(i) {
+      var value = data.candidates[i];
+      return typeof value === 'number' ? value : -Infinity;
+    }
+
+    function sortedOrder(key) {
+      if (!orders[key]) {
+        var order = new Array(total);
+        for (var i = 0; i < total; i++) { order[i] = i; }
+        order.sort(key === 'location'
+          ? function(a, b) { return collator.compare(data.location[a], data.location[b]) || a - b; }
+          : function(a, b) { return (candidateCount(a) - candidateCount(b)) || a - b; });
+        orders[key] = order;
+      }
+      return orders[key];
+    }
+
+    // Rebuild the filtered, sorted list of row indexes and start at the top
+    function update() {
+      var tier = tierSelect.value === '' ? -1 : +tierSelect.value;
+      var category = categorySelect.value === '' ? -1 : +categorySelect.value;
+      var order = sortKey ? sortedOrder(sortKey) : null;
+      view = [];
+      for (var k = 0; k < total; k++) {
+        var i = order ? order[sortDir > 0 ? k : total - 1 - k] : k;
+        if ((tier < 0 || data.tier[i] === tier) && (category < 0 || data.category[i] === category)) {
+          view.push(i);
+        }
+      }
+      countEl.textContent = view.length === total
+        ? total + ' locations'
+        : view.length + ' of ' + total + ' locations';
+      container.setAttribute('aria-rowcount', view.length + 1);
+      spacer.style.height = view.length * ROW_HEIGHT + 'px';
+      viewport.scrollTop = 0;
+      render();
+    }
+
+    function createRow() {
+      var row = document.createElement('div');
+      row.className = 'location-row';
+      row.setAttribute('role', 'row');
+      for (var c = 0; c < 2; c++) {
+        var cell = document.createElement('div');
+        cell.setAttribute('role', 'cell');
+        row.appendChild(cell);
+      }
+      rowsEl.appendChild(row);
+      return row;
+    }
+
+    // Fill the pooled row elements with the rows in view
+    function render() {
+      frame = null;
+      var first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+      var count = Math.max(0, Math.min(view.length - first,
+                                       Math.ceil(viewport.clientHeight / ROW_HEIGHT) + 2 * OVERSCAN));
+      rowsEl.style.transform = 'translateY(' + first * ROW_HEIGHT + 'px)';
+      while (pool.length < count) { pool.push(createRow()); }
+      for (var j = 0; j < pool.length; j++) {
+        var row = pool[j];
+        if (j >= count) {
+          row.style.display = 'none';
+          continue;
+        }
+        var i = view[first + j];
+        row.style.display = '';
+        row.style.backgroundColor = data.tiers[data.tier[i]].color;
+        row.setAttribute('aria-rowindex', first + j + 2);
+        row.firstChild.textContent = data.location[i];
+        row.lastChild.textContent = data.candidates[i];
+      }
+    }
+
+    function scheduleRender() {
+      if (frame === null) { frame = requestAnimationFrame(render); }
+    }
+
+    headers.forEach(function(header) {
+      header.addEventListener('click', function() {
+        var key = header.getAttribute('data-sort');
+        if (sortKey === key) {
+          sortDir = -sortDir;
+        } else {
+          sortKey = key;
+          sortDir = key === 'candidates' ? -1 : 1; // most candidates first
+        }
+        headers.forEach(function(other) {
+          other.setAttribute('aria-sort', other === header ? (sortDir > 0 ? 'ascending' : 'descending') : 'none');
+        });
+        update();
+      });
+    });
+    tierSelect.addEventListener('change', update);
+    categorySelect.addEventListener('change', update);
+    viewport.addEventListener('scroll', scheduleRender, {passive: true});
+    window.addEventListener('resize', scheduleRender);
+    update();
+  }
+
+  if (document.readyState === 'loading') {
+    document.addEventListener('DOMContentLoaded', init);
+  } else {
+    init();
+  }
+})();
@@ -0,0 +1,96 @@
+// Shared helpers of the generated Leaflet map pages, served as a content-hashed asset
+var MapViewer = (function() {
+  function escapeHtml(value) {
+    return String(value).replace(/[&<>"']/g, function(c) {
+      return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+    });
+  }
+
+  // Per-zoom label bitsets placed on the server (utils/labels.py); bit i of a zoom is pin i
+  function decodeLabelBits(labels) {
+    return labels && labels.bits.map(function(encoded) {
+      var raw = atob(encoded), bytes = new Uint8Array(raw.length);
+      for (var i = 0; i < raw.length; i++) { bytes[i] = raw.charCodeAt(i); }
+      return bytes;
+    });
+  }
+
+  function labelVisible(labels, labelBits, i, zoom) {
+    if (!labelBits) { return true; }
+    zoom = Math.max(labels.minZoom, Math.min(labels.maxZoom, Math.round(zoom)));
+    return (labelBits[zoom - labels.minZoom][i >> 3] >> (i & 7)) & 1;
+  }
+
+  // Popup of a pin; members lists the locations merged into it
+  function popupHtml(name, candidates, members) {
+    var html = '<strong>' + escapeHtml(name) + '</strong><br>' +
+               'Electrification Candidates: ' + escapeHtml(candidates);
+    if (members) {
+      html += '<ul class="pin-members">' + members.map(function(member) {
+        return '<li>' + escapeHtml(member[0]) + ': ' + escapeHtml(member[1]) + '</li>';
+      }).join('') + '</ul>';
+    }
+    return html;
+  }
+
+  // Icon of a pin in one of the styles of utils/map_generation.py PinSymbolSheet: the candidate
+  // number on numbered styles, a badge on merged pins (count > 1) and the name when labels are
+  // shown. Icons without any of those are created once per style and shared by its pins.
+  function pinIcon(style, pin, showLabels) {
+    var count = pin.count || 1;
+    if (!style.number && !showLabels && count < 2) {
+      if (!style.sharedIcon) {
+        style.sharedIcon = L.divIcon({
+          html: '', className: style.className,
+          iconSize: style.iconSize, iconAnchor: style.iconAnchor
+        });
+      }
+      return style.sharedIcon;
+    }
+    var overlay = style.number
+      ? '<span class="pin-number-text">' + escapeHtml(pin.candidates || '1') + '</span>'
+      : '';
+    if (count > 1) {
+      overlay += '<span class="pin-count">' + count + '</span>';
+    }
+    if (!showLabels) {
+      return L.divIcon({
+        html: overlay, className: style.className,
+        iconSize: style.iconSize, iconAnchor: style.iconAnchor
+      });
+    }
+    return L.divIcon({
+      html: '<div class="' + style.className + '">' + overlay + '</div>' +
+            '<div class="custom-label-text">' + escapeHtml(pin.name) + '</div>',
+      className: 'div-icon-container',
+      iconSize: style.labelIconSize, iconAnchor: style.labelIconAnchor
+    });
+  }
+
+  // Cluster icons colored by the number of pins they hold
+  function clusterIcon(cluster) {
+    var childCount = cluster.getChildCount();
+    var color = '#6bc04b'; // green default
+    if (childCount >= 100) {
+      color = '#0056b8'; // dark blue
+    } else if (childCount >= 50) {
+      color = '#00a1e0'; // light blue
+    } else if (childCount >= 10) {
+      color = '#00bfae'; // teal
+    }
+    return new L.DivIcon({
+      html: '<div style="background:' + color + '"><span>' + childCount + '</span></div>',
+      className: 'marker-cluster',
+      iconSize: new L.Point(40, 40)
+    });
+  }
+
+  return {
+    escapeHtml: escapeHtml,
+    decodeLabelBits: decodeLabelBits,
+    labelVisible: labelVisible,
+    popupHtml: popupHtml,
+    pinIcon: pinIcon,
+    clusterIcon: clusterIcon
+  };
+})();
@@ -0,0 +1,65 @@
+"""
+Utility functions for content-hashed static assets shared by generated map pages
+
+Everything generated maps have in common (viewer script and styles, pin
+images, state geometry) is written once to ``static/assets`` under a name
+that contains a hash of its content, e.g. ``map_viewer.3f2a9c1d5e7b8a60.js``.
+A changed file gets a new name, so the served files never change and can be
+cached by browsers indefinitely; pages only reference them.
+"""
+import hashlib
+import os
+from typing import Dict, Tuple, Union
+
+from utils.compression import write_compressed_siblings
+from utils.files import atomic_write
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+ASSET_DIR = os.environ.get("ASSET_DIR", os.path.join(STATIC_DIR, "assets"))
+ASSET_URL_PREFIX = "/assets/"
+# Asset names change with their content, so a cached copy is never stale
+ASSET_MAX_AGE = 365 * 24 * 3600
+IMMUTABLE_CACHE_CONTROL = f"public, max-age={ASSET_MAX_AGE}, immutable"
+
+# Published URL per static file, keyed by (path, modification time)
+_static_assets: Dict[Tuple[str, float], str] = {}
+
+
+def publish_asset(name: str, content: Union[str, bytes], ext: str) -> str:
+    """
+    Store content as a content-hashed asset and return its URL.
+
+    Args:
+        name: Readable part of the file name, e.g. ``states-US``
+        content: File content; text is stored as UTF-8
+        ext: File extension without the dot
+
+    Returns:
+        URL of the asset, e.g. ``/assets/states-US.0123456789abcdef.json``
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    filename = f"{name}.{hashlib.sha256(content).hexdigest()[:16]}.{ext}"
+    path = os.path.join(ASSET_DIR, filename)
+    if not os.path.exists(path):
+        os.makedirs(ASSET_DIR, exist_ok=True)
+        # Written under a temporary name first so a request never sees a partial file
+        with atomic_write(path) as f:
+            f.write(content)
+        write_compressed_siblings(path)
+    return ASSET_URL_PREFIX + filename
+
+
+def static_asset(relative_path: str) -> str:
+    """
+    URL of the content-hashed copy of a file under ``static/``, e.g. ``js/map_viewer.js``.
+
+    The copy is published on first use and again whenever the file changes.
+    """
+    path = os.path.join(STATIC_DIR, relative_path)
+    key = (path, os.path.getmtime(path))
+    if key not in _static_assets:
+        name, ext = os.path.splitext(os.path.basename(path))
+        with open(path, "rb") as f:
+            _static_assets[key] = publish_asset(name, f.read(), ext.lstrip("."))
+    return _static_assets[key]
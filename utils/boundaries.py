@@ -0,0 +1,149 @@
+"""
+Utility functions for loading admin-1 boundaries (states, provinces) by country
+
+The Natural Earth shapefile covers admin-1 units worldwide.  Instead of
+reading it all up front, each country is loaded on first use, merged with its
+grouping CSV and kept in memory; combined frames (and their spatial indexes)
+are cached per set of countries so every request reuses them.
+"""
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import geopandas as gpd
+import pandas as pd
+
+# ISO 3166-1 alpha-2 code -> Natural Earth "admin" name
+COUNTRY_ADMIN_NAMES = {
+    "US": "United States of America",
+    "CA": "Canada",
+    "MX": "Mexico",
+}
+DEFAULT_COUNTRY = "US"
+
+# Spellings accepted in the "Country" column of an upload
+COUNTRY_ALIASES = {
+    "US": "US", "USA": "US", "UNITED STATES": "US", "UNITED STATES OF AMERICA": "US",
+    "CA": "CA", "CAN": "CA", "CANADA": "CA",
+    "MX": "MX", "MEX": "MX", "MEXICO": "MX", "MÉXICO": "MX",
+}
+
+# Address suffix used when geocoding locations in each country
+COUNTRY_GEOCODE_NAMES = {"US": "USA", "CA": "Canada", "MX": "Mexico"}
+
+_BOUNDARY_COLUMNS = ["name", "admin", "iso_a2", "iso_3166_2", "geometry"]
+
+
+def normalize_country(value) -> Optional[str]:
+    """Map a country name or ISO code to a supported alpha-2 code, or None."""
+    if value is None or pd.isna(value):
+        return None
+    return COUNTRY_ALIASES.get(str(value).strip().upper())
+
+
+def parse_country_list(value, default: Iterable[str] = (DEFAULT_COUNTRY,)) -> Tuple[str, ...]:
+    """Parse a comma separated list such as ``"US,CA"``; unknown entries are dropped."""
+    codes = {normalize_country(part) for part in str(value or "").split(",")}
+    codes.discard(None)
+    return tuple(sorted(codes)) or tuple(sorted(default))
+
+
+def countries_in_data(df, default: Iterable[str] = (DEFAULT_COUNTRY,)) -> Tuple[str, ...]:
+    """Countries whose boundaries a map needs: the defaults plus any in a ``Country`` column."""
+    codes = set(default)
+    if "Country" in df.columns:
+        codes.update(code for code in map(normalize_country, df["Country"].unique()) if code)
+    return tuple(sorted(codes))
+
+
+def geocode_country_name(value) -> str:
+    """Country suffix appended to geocoding queries; rows without a country are US."""
+    return COUNTRY_GEOCODE_NAMES[normalize_country(value) or DEFAULT_COUNTRY]
+
+
+def countries_key(countries: Iterable[str]) -> str:
+    """Stable key for a set of countries, e.g. ``CA-US``; used in URLs and cache paths."""
+    return "-".join(sorted(set(countries)))
+
+
+def parse_countries_key(key: str) -> Optional[Tuple[str, ...]]:
+    """Inverse of :func:`countries_key`; returns None if any code is unsupported."""
+    codes = tuple(sorted(set((key or "").split("-"))))
+    if not codes or any(code not in COUNTRY_ADMIN_NAMES for code in codes):
+        return None
+    return codes
+
+
+def group_csv_path(groups_dir: str, country: str) -> str:
+    """Grouping CSV for a country: ``group_by_state.csv`` for the US, ``group_by_state_<CC>.csv`` otherwise."""
+    if country == "US":
+        return os.path.join(groups_dir, "group_by_state.csv")
+    return os.path.join(groups_dir, f"group_by_state_{country}.csv")
+
+
+class BoundaryStore:
+    """Lazily loaded, country-partitioned admin-1 boundaries shared across requests."""
+
+    def __init__(self, shapefile_path: str, groups_dir: str):
+        """
+        Args:
+            shapefile_path: Natural Earth admin-1 shapefile
+            groups_dir: Directory holding the per-country grouping CSVs
+        """
+        self.shapefile_path = shapefile_path
+        self.groups_dir = groups_dir
+        self._partitions: Dict[str, gpd.GeoDataFrame] = {}
+        self._combined: Dict[Tuple[str, ...], gpd.GeoDataFrame] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loaded_countries(self) -> List[str]:
+        return sorted(self._partitions)
+
+    def partition(self, country: str) -> gpd.GeoDataFrame:
+        """Boundaries of one country with ``StateAbbr``, ``Country`` and ``CaaS Group`` columns."""
+        if country not in COUNTRY_ADMIN_NAMES:
+            raise ValueError(f"Unsupported country: {country}")
+        with self._lock:
+            if country not in self._partitions:
+                self._partitions[country] = self._load_partition(country)
+            return self._partitions[country]
+
+    def boundaries(self, countries: Iterable[str]) -> gpd.GeoDataFrame:
+        """
+        Combined boundaries for several countries.
+
+        The frame is cached per set of countries, so its spatial index is built
+        once and shared by every request that asks for the same set.
+        """
+        key = tuple(sorted(set(countries)))
+        if key not in self._combined:
+            frames = [self.partition(country) for country in key]
+            combined = frames[0] if len(frames) == 1 else gpd.GeoDataFrame(
+                pd.concat(frames, ignore_index=True), crs=frames[0].crs
+            )
+            with self._lock:
+                self._combined.setdefault(key, combined)
+        return self._combined[key]
+
+    def find_unit(self, countries: Iterable[str], abbr: str):
+        """Geometry of the state/province with the given abbreviation, or None."""
+        gdf = self.boundaries(countries)
+        matches = gdf[gdf["StateAbbr"] == abbr]
+        return matches.geometry.iloc[0] if len(matches) else None
+
+    def _load_partition(self, country: str) -> gpd.GeoDataFrame:
+        # The attribute filter is applied while reading, so other countries never reach memory
+        admin_name = COUNTRY_ADMIN_NAMES[country].replace("'", "''")
+        gdf = gpd.read_file(self.shapefile_path, where=f"admin = '{admin_name}'")
+        gdf = gdf[[c for c in _BOUNDARY_COLUMNS if c in gdf.columns]].copy()
+        gdf["StateAbbr"] = gdf["iso_3166_2"].str.split("-").str[-1]
+        gdf["Country"] = country
+
+        groups_path = group_csv_path(self.groups_dir, country)
+        if os.path.exists(groups_path):
+            groups = pd.read_csv(groups_path)
+        else:
+            groups = pd.DataFrame(columns=["State", "CaaS Group"])
+        gdf = gdf.merge(groups, left_on="StateAbbr", right_on="State", how="left")
+        return gdf.reset_index(drop=True)
@@ -0,0 +1,52 @@
+"""
+Utility functions for per-route HTTP caching policies
+
+Every response gets the Cache-Control of its route's policy class instead of
+one blanket header: content-hashed and write-once files are immutable, pages
+that can change are revalidated by ETag, and forms are never stored.
+"""
+import os
+import time
+
+from utils.assets import ASSET_MAX_AGE, IMMUTABLE_CACHE_CONTROL
+
+# Policy classes
+IMMUTABLE = "immutable"    # never changes under its URL (content-hashed assets, finished map data)
+SHARED = "shared"          # derived from shared inputs; cached for SHARED_CACHE_MAX_AGE
+REVALIDATE = "revalidate"  # kept by the browser but checked with If-None-Match before each use
+NO_STORE = "no-store"      # forms and per-request results; never cached
+
+SHARED_CACHE_MAX_AGE = int(os.environ.get("SHARED_CACHE_MAX_AGE", "86400"))
+
+CACHE_CONTROL = {
+    IMMUTABLE: IMMUTABLE_CACHE_CONTROL,
+    SHARED: f"public, max-age={SHARED_CACHE_MAX_AGE}",
+    REVALIDATE: "no-cache",
+    NO_STORE: "no-store, max-age=0",
+}
+_MAX_AGE = {IMMUTABLE: ASSET_MAX_AGE, SHARED: SHARED_CACHE_MAX_AGE}
+
+
+def apply_cache_policy(response, policy: str):
+    """
+    Set the caching headers of a policy class on a response.
+
+    Args:
+        response: Flask/Werkzeug response
+        policy: One of IMMUTABLE, SHARED, REVALIDATE or NO_STORE
+
+    Returns:
+        The same response
+    """
+    response.headers["Cache-Control"] = CACHE_CONTROL[policy]
+    if policy == NO_STORE:
+        # For HTTP/1.0 caches that ignore Cache-Control
+        response.headers["Pragma"] = "no-cache"
+        response.headers["Expires"] = "0"
+    else:
+        response.headers.pop("Pragma", None)
+        if policy in _MAX_AGE:
+            response.expires = int(time.time() + _MAX_AGE[policy])
+        else:
+            response.headers.pop("Expires", None)
+    return response
@@ -0,0 +1,155 @@
+"""
+Utility functions for the catalog of generated maps
+
+Every generated map gets a row in a small SQLite database: its id, the hash
+and name of the source file, row, located and pin counts, categories,
+geocoding results, stored size and timings.  The /maps listing and search
+read this index instead of scanning static/maps.  The database is opened in
+WAL mode with a connection per call, so worker threads and processes can
+write and query it concurrently.
+"""
+import json
+import sqlite3
+import time
+from contextlib import closing
+from typing import List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS maps (
+    id TEXT PRIMARY KEY,
+    source_name TEXT,
+    source_hash TEXT,
+    row_count INTEGER,
+    located_count INTEGER,
+    pin_count INTEGER,
+    categories TEXT,
+    geocoding TEXT,
+    pin_layer TEXT,
+    state_layer TEXT,
+    size_bytes INTEGER,
+    geocode_seconds REAL,
+    render_seconds REAL,
+    total_seconds REAL,
+    created_at REAL NOT NULL,
+    reuse_count INTEGER NOT NULL DEFAULT 0,
+    last_reused_at REAL
+);
+CREATE INDEX IF NOT EXISTS maps_created_at ON maps (created_at);
+CREATE INDEX IF NOT EXISTS maps_source_hash ON maps (source_hash);
+CREATE TABLE IF NOT EXISTS map_categories (
+    category TEXT NOT NULL,
+    map_id TEXT NOT NULL,
+    PRIMARY KEY (category, map_id)
+);
+CREATE INDEX IF NOT EXISTS map_categories_map_id ON map_categories (map_id);
+"""
+MAX_PAGE_SIZE = 100
+# Columns a search can be filtered on exactly
+FILTER_COLUMNS = ("source_hash", "pin_layer", "state_layer")
+
+
+def _like_pattern(text: str) -> str:
+    """``%text%`` for LIKE ... ESCAPE '\\', with the wildcards in ``text`` matched literally."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class MapCatalog:
+    """
+    Metadata of the generated maps in an SQLite database.
+
+    Args:
+        path: Database file; created with its tables on first use
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def add(self, map_id: str, *, source_name: Optional[str] = None, source_hash: Optional[str] = None,
+            row_count: int = 0, located_count: int = 0, pin_count: int = 0, categories: List[str] = (),
+            geocoding: Optional[dict] = None, pin_layer: Optional[str] = None, state_layer: Optional[str] = None,
+            size_bytes: int = 0, geocode_seconds: Optional[float] = None, render_seconds: Optional[float] = None,
+            total_seconds: Optional[float] = None, created_at: Optional[float] = None) -> None:
+        """Record a generated map, replacing an earlier entry with the same id."""
+        categories = sorted(set(categories))
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO maps (id, source_name, source_hash, row_count, located_count, pin_count, "
+                "categories, geocoding, pin_layer, state_layer, size_bytes, geocode_seconds, render_seconds, "
+                "total_seconds, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (map_id, source_name, source_hash, row_count, located_count, pin_count, json.dumps(categories),
+                 json.dumps(geocoding or {}), pin_layer, state_layer, size_bytes, geocode_seconds, render_seconds,
+                 total_seconds, time.time() if created_at is None else created_at))
+            connection.execute("DELETE FROM map_categories WHERE map_id = ?", (map_id,))
+            connection.executemany("INSERT INTO map_categories (category, map_id) VALUES (?, ?)",
+                                   [(category, map_id) for category in categories])
+
+    def record_reuse(self, map_id: str) -> None:
+        """Count a generation request that returned the stored map."""
+        with closing(self._connect()) as connection, connection:
+            connection.execute("UPDATE maps SET reuse_count = reuse_count + 1, last_reused_at = ? WHERE id = ?",
+                               (time.time(), map_id))
+
+    def remove(self, map_id: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM map_categories WHERE map_id = ?", (map_id,))
+            connection.execute("DELETE FROM maps WHERE id = ?", (map_id,))
+
+    def get(self, map_id: str) -> Optional[dict]:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM maps WHERE id = ?", (map_id,)).fetchone()
+        return self._as_dict(row) if row else None
+
+    def search(self, query: Optional[str] = None, category: Optional[str] = None, page: int = 1,
+               per_page: int = 20, **filters) -> Tuple[List[dict], int]:
+        """
+        Maps matching a search, newest first.
+
+        Args:
+            query: Text found in the source file name or a category, or the start of a map id
+            category: Exact category the map must contain
+            page: 1-based page number
+            per_page: Maps per page, at most MAX_PAGE_SIZE
+            **filters: Exact values of FILTER_COLUMNS (e.g. ``source_hash=...``)
+
+        Returns:
+            The maps on the page and the number of maps matching in total
+        """
+        conditions, parameters = [], []
+        if query:
+            pattern = _like_pattern(query)
+            conditions.append("(maps.source_name LIKE ? ESCAPE '\\' OR maps.id LIKE ? ESCAPE '\\' OR EXISTS "
+                              "(SELECT 1 FROM map_categories WHERE map_id = maps.id AND category LIKE ? ESCAPE '\\'))")
+            parameters += [pattern, pattern[1:], pattern]
+        if category:
+            conditions.append("EXISTS (SELECT 1 FROM map_categories WHERE map_id = maps.id AND category = ?)")
+            parameters.append(category)
+        for column, value in filters.items():
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Cannot filter maps on {column}")
+            if value is not None:
+                conditions.append(f"maps.{column} = ?")
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        per_page = max(1, min(MAX_PAGE_SIZE, per_page))
+        offset = (max(1, page) - 1) * per_page
+        with closing(self._connect()) as connection:
+            total = connection.execute(f"SELECT COUNT(*) FROM maps {where}", parameters).fetchone()[0]
+            rows = connection.execute(f"SELECT * FROM maps {where} ORDER BY created_at DESC, id LIMIT ? OFFSET ?",
+                                      parameters + [per_page, offset]).fetchall()
+        return [self._as_dict(row) for row in rows], total
+
+    @staticmethod
+    def _as_dict(row: sqlite3.Row) -> dict:
+        entry = dict(row)
+        entry["categories"] = json.loads(entry["categories"] or "[]")
+        entry["geocoding"] = json.loads(entry["geocoding"] or "{}")
+        return entry
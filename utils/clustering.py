@@ -0,0 +1,221 @@
+"""
+Utility functions for server-side pin clustering precomputed per zoom level
+
+Pins are projected to the unit Web Mercator square and merged bottom-up: the
+points are grid-clustered at the highest zoom, those clusters again at the
+next lower zoom, and so on (the hierarchy supercluster builds, with a grid
+instead of a KD-tree).  Each level is kept sorted by x so a bbox query is two
+binary searches plus a y filter.  Clusters carry the pin count and the sum of
+electrification candidates.
+"""
+import math
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from utils.files import atomic_write
+
+MIN_ZOOM = 0
+MAX_ZOOM = 16
+# Cluster radius in screen pixels at 256px tiles
+CLUSTER_RADIUS = 60
+TILE_SIZE = 256
+
+_LEVEL_FIELDS = ("x", "y", "count", "candidates", "point", "expansion_zoom", "cluster_id")
+
+
+def _project(lon, lat):
+    lon = np.asarray(lon, dtype=float)
+    lat = np.clip(np.asarray(lat, dtype=float), -85.0511287798, 85.0511287798)
+    x = lon / 360.0 + 0.5
+    sin = np.sin(np.radians(lat))
+    y = 0.5 - 0.25 * np.log((1 + sin) / (1 - sin)) / math.pi
+    return x, y
+
+
+def _unproject(x, y):
+    lon = (np.asarray(x) - 0.5) * 360.0
+    lat = np.degrees(2 * np.arctan(np.exp((1 - 2 * np.asarray(y)) * math.pi)) - math.pi / 2)
+    return lon, lat
+
+
+def _json_number(value) -> Union[int, float]:
+    # Whole numbers are sent as ints so number pins read "12", not "12.0"
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _sorted_level(level: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    order = np.argsort(level["x"], kind="stable")
+    return {name: values[order] for name, values in level.items()}
+
+
+class ClusterIndex:
+    """Hierarchical pin clusters for every zoom level of one map."""
+
+    def __init__(self, levels: Dict[int, Dict[str, np.ndarray]], names: np.ndarray,
+                 categories: np.ndarray, min_zoom: int = MIN_ZOOM, max_zoom: int = MAX_ZOOM):
+        self.levels = levels
+        self.names = names
+        self.categories = categories
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+
+    @classmethod
+    def build(cls, lats: Sequence[float], lons: Sequence[float], candidates: Sequence[float],
+              names: Sequence[str], categories: Sequence[int], min_zoom: int = MIN_ZOOM,
+              max_zoom: int = MAX_ZOOM, radius: int = CLUSTER_RADIUS) -> "ClusterIndex":
+        """
+        Build the cluster hierarchy for a set of pins.
+
+        Args:
+            lats, lons: Pin coordinates in degrees
+            candidates: Electrification candidates per pin (NaN counts as 0 in sums)
+            names: Location name per pin
+            categories: Pin style index per pin
+            min_zoom, max_zoom: Zoom range with clusters; above max_zoom single pins are returned
+            radius: Cluster radius in pixels
+        """
+        x, y = _project(lons, lats)
+        n = len(x)
+        # NaN (no candidate count) is kept for single pins and counted as 0 in cluster sums
+        candidate_values = np.asarray(candidates, dtype=float)
+        level = {
+            "x": x,
+            "y": y,
+            "count": np.ones(n, dtype=np.int64),
+            "candidates": candidate_values,
+            "point": np.arange(n, dtype=np.int64),
+            "expansion_zoom": np.full(n, -1, dtype=np.int64),
+            "cluster_id": np.full(n, -1, dtype=np.int64),
+        }
+        levels = {max_zoom + 1: _sorted_level(level)}
+        next_cluster_id = 0
+
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            cell = radius / (TILE_SIZE * 2 ** zoom)
+            if len(level["x"]) == 0:
+                levels[zoom] = level
+                continue
+            keys = np.stack([np.floor(level["x"] / cell), np.floor(level["y"] / cell)], axis=1)
+            _, group, sizes = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+            group = group.ravel()
+
+            weights = level["count"].astype(float)
+            groups = len(sizes)
+            count = np.bincount(group, weights=weights, minlength=groups)
+            merged = {
+                "x": np.bincount(group, weights=level["x"] * weights, minlength=groups) / count,
+                "y": np.bincount(group, weights=level["y"] * weights, minlength=groups) / count,
+                "count": count.astype(np.int64),
+                "candidates": np.bincount(group, weights=np.nan_to_num(level["candidates"], nan=0.0),
+                                          minlength=groups),
+                "point": np.full(groups, -1, dtype=np.int64),
+                "expansion_zoom": np.full(groups, zoom + 1, dtype=np.int64),
+                "cluster_id": np.arange(next_cluster_id, next_cluster_id + groups, dtype=np.int64),
+            }
+            # Groups with a single member keep that member (pin or cluster) unchanged
+            single = sizes == 1
+            if single.any():
+                member = np.zeros(groups, dtype=np.int64)
+                member[group] = np.arange(len(group))
+                members = member[single]
+                for name in _LEVEL_FIELDS:
+                    merged[name][single] = level[name][members]
+            next_cluster_id += groups
+            level = merged
+            levels[zoom] = _sorted_level(level)
+
+        return cls(levels, np.asarray(list(names), dtype=str), np.asarray(categories, dtype=np.int64),
+                   min_zoom=min_zoom, max_zoom=max_zoom)
+
+    def get_clusters(self, bbox: Sequence[float], zoom: int) -> List[dict]:
+        """
+        Clusters and single pins intersecting a bbox at a zoom level.
+
+        Args:
+            bbox: (west, south, east, north) in degrees; west > east crosses the antimeridian
+            zoom: Map zoom level, clamped to the indexed range
+
+        Returns:
+            List of dicts; clusters have ``count``/``candidates``/``expansion_zoom``,
+            single pins have ``index``/``name``/``cat``/``candidates``
+        """
+        zoom = int(max(self.min_zoom, min(self.max_zoom + 1, math.floor(zoom))))
+        level = self.levels[zoom]
+        west, south, east, north = bbox
+        if east - west >= 360:
+            west, east = -180.0, 180.0
+        else:
+            west = (west + 180.0) % 360.0 - 180.0
+            east = (east + 180.0) % 360.0 - 180.0
+        (min_x, max_x), (max_y, min_y) = _project([west, east], [south, north])
+
+        ranges = [(min_x, max_x)] if min_x <= max_x else [(0.0, max_x), (min_x, 1.0)]
+        found = []
+        for lo, hi in ranges:
+            start = np.searchsorted(level["x"], lo, side="left")
+            stop = np.searchsorted(level["x"], hi, side="right")
+            rows = np.arange(start, stop)
+            rows = rows[(level["y"][rows] >= min_y) & (level["y"][rows] <= max_y)]
+            found.append(rows)
+        rows = np.concatenate(found) if found else np.array([], dtype=np.int64)
+
+        lons, lats = _unproject(level["x"][rows], level["y"][rows])
+        features = []
+        for row, lon, lat in zip(rows.tolist(), lons.tolist(), lats.tolist()):
+            point = int(level["point"][row])
+            candidates = level["candidates"][row]
+            if point >= 0:
+                features.append({
+                    "index": point,
+                    "lat": round(lat, 6),
+                    "lon": round(lon, 6),
+                    "name": str(self.names[point]),
+                    "cat": int(self.categories[point]),
+                    "candidates": None if math.isnan(candidates) else _json_number(candidates),
+                })
+            else:
+                features.append({
+                    "id": int(level["cluster_id"][row]),
+                    "lat": round(lat, 6),
+                    "lon": round(lon, 6),
+                    "count": int(level["count"][row]),
+                    "candidates": _json_number(candidates),
+                    "expansion_zoom": int(level["expansion_zoom"][row]),
+                })
+        return features
+
+    def save(self, path: str) -> None:
+        """Store the index as a compressed ``.npz`` file next to its map."""
+        arrays = {"names": self.names, "categories": self.categories,
+                  "zoom_range": np.array([self.min_zoom, self.max_zoom])}
+        for zoom, level in self.levels.items():
+            for name in _LEVEL_FIELDS:
+                arrays[f"z{zoom}_{name}"] = level[name]
+        with atomic_write(path) as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "ClusterIndex":
+        with np.load(path, allow_pickle=False) as data:
+            min_zoom, max_zoom = (int(v) for v in data["zoom_range"])
+            levels = {
+                zoom: {name: data[f"z{zoom}_{name}"] for name in _LEVEL_FIELDS}
+                for zoom in range(min_zoom, max_zoom + 2)
+            }
+            return cls(levels, data["names"], data["categories"], min_zoom=min_zoom, max_zoom=max_zoom)
+
+
+def parse_bbox(value: Optional[str]) -> Optional[List[float]]:
+    """Parse a ``west,south,east,north`` query parameter; returns None when malformed."""
+    try:
+        parts = [float(v) for v in (value or "").split(",")]
+    except ValueError:
+        return None
+    if len(parts) != 4 or not all(math.isfinite(v) for v in parts):
+        return None
+    west, south, east, north = parts
+    if south > north or not (-90 <= south <= 90 and -90 <= north <= 90):
+        return None
+    return parts
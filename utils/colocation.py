@@ -0,0 +1,86 @@
+"""
+Utility functions for merging pins that share a location
+
+Geocoding fallbacks put many rows on exactly the same point: every ZIP-only
+match lands on the ZIP centroid and every state fallback on the state
+centroid.  Rows with identical (rounded) coordinates and the same category are
+grouped into a single pin that carries the number of locations, their
+candidate sum and the list of merged locations for its popup.
+"""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+MERGED_COUNT = "Merged Count"
+MERGED_NAMES = "Merged Names"
+MERGED_CANDIDATES = "Merged Candidates"
+FIRST_ROW = "First Row"
+
+
+def merge_colocated_pins(df: pd.DataFrame, precision: Optional[int] = 6, merge: bool = True,
+                         lat_col: str = "Latitude", lon_col: str = "Longitude",
+                         category_col: str = "Category Name", name_col: str = "Location Name",
+                         candidates_col: str = "Electrification Candidates") -> pd.DataFrame:
+    """
+    Group geocoded rows with the same rounded coordinates and category into one pin each.
+
+    Args:
+        df: Rows with coordinates; rows without coordinates are dropped
+        precision: Decimals the coordinates are rounded to before grouping (None keeps them as is)
+        merge: When False every row stays its own pin, with the same output columns
+        lat_col, lon_col, category_col, name_col, candidates_col: Column names
+
+    Returns:
+        One row per pin in first-appearance order with the coordinate, category,
+        name and candidates columns plus ``Merged Count``, ``Merged Names``,
+        ``Merged Candidates`` and ``First Row`` (the index label in ``df`` of
+        the row whose unrounded coordinates the pin carries).  Merged pins get
+        the candidate sum, a "<n> locations" name and the member lists; single
+        pins keep their original values and have no member lists (None).
+    """
+    located = df[df[lat_col].notna() & df[lon_col].notna()]
+    lats = located[lat_col].astype(float)
+    lons = located[lon_col].astype(float)
+    if precision is not None:
+        lats, lons = lats.round(precision), lons.round(precision)
+
+    if merge:
+        # Groups are numbered in order of first appearance
+        group = pd.DataFrame({"lat": lats, "lon": lons, "category": located[category_col]}) \
+            .groupby(["lat", "lon", "category"], sort=False, dropna=False).ngroup().to_numpy()
+    else:
+        group = np.arange(len(located))
+    _, first = np.unique(group, return_index=True)
+    counts = np.bincount(group)
+    numeric = pd.to_numeric(located[candidates_col], errors="coerce").fillna(0).to_numpy(dtype=float)
+    sums = np.bincount(group, weights=numeric)
+
+    pins = pd.DataFrame({
+        lat_col: lats.to_numpy()[first],
+        lon_col: lons.to_numpy()[first],
+        category_col: located[category_col].to_numpy()[first],
+        name_col: located[name_col].astype(str).to_numpy()[first],
+        # Object dtype so merged sums can replace text values
+        candidates_col: pd.Series(located[candidates_col].to_numpy(dtype=object)[first], dtype=object),
+        MERGED_COUNT: counts,
+        MERGED_NAMES: None,
+        MERGED_CANDIDATES: None,
+        FIRST_ROW: located.index.to_numpy()[first],
+    })
+
+    multiple = counts > 1
+    if multiple.any():
+        # Member lists are only built for the merged pins, grouped with one stable sort
+        rows = np.flatnonzero(multiple[group])
+        rows = rows[np.argsort(group[rows], kind="stable")]
+        bounds = np.cumsum(counts[multiple])[:-1]
+        names = located[name_col].astype(str).to_numpy()[rows]
+        candidates = located[candidates_col].to_numpy(dtype=object)[rows]
+        pins.loc[multiple, MERGED_NAMES] = pd.Series([list(part) for part in np.split(names, bounds)],
+                                                     index=pins.index[multiple])
+        pins.loc[multiple, MERGED_CANDIDATES] = pd.Series([list(part) for part in np.split(candidates, bounds)],
+                                                          index=pins.index[multiple])
+        pins.loc[multiple, candidates_col] = [int(s) if s.is_integer() else s for s in sums[multiple]]
+        pins.loc[multiple, name_col] = [f"{count} locations" for count in counts[multiple]]
+    return pins
@@ -0,0 +1,99 @@
+"""
+Utility functions for precompressed (gzip/brotli) copies of generated files
+
+Map pages and their data files are written once and downloaded many times,
+so they are compressed once at generation time instead of on every request.
+Each file gets ``.gz`` and, when the ``brotli`` package is installed, ``.br``
+siblings next to it; :func:`precompressed_variant` picks the smallest one a
+client accepts.
+"""
+import gzip
+import os
+from typing import List, Optional, Tuple
+
+from utils.files import atomic_write
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional, gzip is always written
+    brotli = None
+
+# Files smaller than this are not worth a compressed copy
+MIN_COMPRESS_BYTES = int(os.environ.get("MIN_COMPRESS_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "9"))
+# Quality 11 compresses a few percent better but is several times slower on multi-MB pages
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "9"))
+
+# Content-Encoding and file suffix, most preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+# Bytes read at a time, so compressing a large page never loads it whole
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+def _compress_atomic(path: str, target: str, open_compressor) -> None:
+    # Written under a temporary name, so a request never sees a partial sibling
+    with open(path, "rb") as source, atomic_write(target) as out:
+        compressor = open_compressor(out)
+        for chunk in iter(lambda: source.read(READ_CHUNK_BYTES), b""):
+            compressor.write(chunk)
+        compressor.close()
+
+
+class _BrotliWriter:
+    """File-like wrapper around ``brotli.Compressor`` (close() does not close ``out``)."""
+
+    def __init__(self, out):
+        self.out = out
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def write(self, chunk: bytes) -> None:
+        self.out.write(self.compressor.process(chunk))
+
+    def close(self) -> None:
+        self.out.write(self.compressor.finish())
+
+
+def write_compressed_siblings(path: str) -> List[str]:
+    """
+    Write ``path.gz`` (and ``path.br`` if brotli is available) next to a file.
+
+    Args:
+        path: File to compress; it is left unchanged
+
+    Returns:
+        Paths of the compressed copies written (none for small files)
+    """
+    if os.path.getsize(path) < MIN_COMPRESS_BYTES:
+        return []
+    # mtime=0 keeps the output identical for identical input
+    _compress_atomic(path, path + ".gz",
+                     lambda out: gzip.GzipFile(fileobj=out, mode="wb", compresslevel=GZIP_LEVEL, mtime=0))
+    written = [path + ".gz"]
+    if brotli is not None:
+        _compress_atomic(path, path + ".br", _BrotliWriter)
+        written.append(path + ".br")
+    return written
+
+
+def precompressed_variant(path: str, accept_encodings) -> Tuple[str, Optional[str]]:
+    """
+    Choose the file to send for a request's ``Accept-Encoding``.
+
+    Args:
+        path: Uncompressed file
+        accept_encodings: The request's parsed header (``request.accept_encodings``)
+
+    Returns:
+        Tuple ``(path to send, Content-Encoding or None)``; the uncompressed
+        file is used when the client accepts no encoding with an up-to-date
+        sibling
+    """
+    mtime = os.path.getmtime(path)
+    for encoding, suffix in ENCODINGS:
+        # A sibling older than the file is stale and ignored
+        if (accept_encodings.quality(encoding) > 0 and os.path.isfile(path + suffix)
+                and os.path.getmtime(path + suffix) >= mtime):
+            return path + suffix, encoding
+    return path, None
@@ -0,0 +1,115 @@
+"""
+Utility functions for aggregating pins into candidate-weighted hexbin density grids
+
+Instead of one marker per location, national-scale maps can show how many
+locations and electrification candidates fall into each hexagon of a grid in
+Web Mercator space.  A grid is built for several zoom levels so hexagons keep
+roughly the same size on screen; the map picks the level for its current zoom.
+Only the non-empty cells are embedded, as axial hex coordinates, so the page
+size depends on how spread out the pins are rather than on the row count.
+"""
+import math
+import os
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from utils.clustering import TILE_SIZE, _json_number, _project
+
+# Zoom levels a grid is built for; a map at zoom z uses the finest level <= z
+DENSITY_ZOOMS = (3, 5, 7, 9, 11)
+# Hexagon radius (center to corner) in screen pixels at a level's own zoom
+HEX_RADIUS = int(os.environ.get("HEX_RADIUS", "12"))
+# Finer levels are dropped once a level would embed more cells than this
+MAX_DENSITY_CELLS = int(os.environ.get("MAX_DENSITY_CELLS", "20000"))
+# Fill colors of the classes, lowest first (the cluster icon palette)
+DENSITY_COLORS = ("#6bc04b", "#00bfae", "#00a1e0", "#0056b8")
+DENSITY_CLASSES = len(DENSITY_COLORS)
+
+_SQRT3 = math.sqrt(3.0)
+
+
+def hexbin(x: np.ndarray, y: np.ndarray, weights: np.ndarray, size: float):
+    """
+    Bin projected points into pointy-top hexagons.
+
+    Args:
+        x, y: Points in unit Web Mercator coordinates
+        weights: Weight per point
+        size: Hexagon radius (center to corner) in the same units
+
+    Returns:
+        Tuple ``(q, r, weight, count)`` with the axial coordinates, weight sum
+        and point count of every non-empty hexagon, ordered by (q, r)
+    """
+    qf = (_SQRT3 / 3.0 * x - y / 3.0) / size
+    rf = (2.0 / 3.0 * y) / size
+    sf = -qf - rf
+    q, r, s = np.round(qf), np.round(rf), np.round(sf)
+    dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+    # Cube rounding: recompute the coordinate that moved the most
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+
+    # One integer key per cell; r is never negative and |q| stays far below 2**30
+    keys, cell = np.unique((q.astype(np.int64) + (1 << 30)) << 32 | r.astype(np.int64), return_inverse=True)
+    cell = cell.ravel()
+    return ((keys >> 32) - (1 << 30), keys & 0xFFFFFFFF,
+            np.bincount(cell, weights=weights, minlength=len(keys)), np.bincount(cell, minlength=len(keys)))
+
+
+def _classes(values: np.ndarray):
+    # Class k holds the values from breaks[k] up to breaks[k + 1]
+    top = values.max() if len(values) else 0
+    if top <= 0:
+        return np.zeros(len(values), dtype=np.int64), [0] * (DENSITY_CLASSES + 1)
+    scaled = np.log1p(values) / np.log1p(top)
+    classes = np.minimum(DENSITY_CLASSES - 1, np.floor(scaled * DENSITY_CLASSES)).astype(np.int64)
+    breaks = np.expm1(np.linspace(0, 1, DENSITY_CLASSES + 1) * np.log1p(top))
+    return classes, [_json_number(round(value)) for value in breaks]
+
+
+def density_levels(lats: Sequence[float], lons: Sequence[float], candidates: Sequence[float],
+                   zooms: Sequence[int] = DENSITY_ZOOMS, radius: int = HEX_RADIUS,
+                   max_cells: int = MAX_DENSITY_CELLS) -> List[Dict]:
+    """
+    Candidate-weighted hexbin grids for several zoom levels.
+
+    Args:
+        lats, lons: Pin coordinates in degrees
+        candidates: Electrification candidates per pin; missing values weigh 0
+        zooms: Zoom levels to build a grid for, coarsest first
+        radius: Hexagon radius in screen pixels at each level's zoom
+        max_cells: Stop adding finer levels once one would have more cells than this
+
+    Returns:
+        One dict per level with ``zoom``, ``size`` (hexagon radius in unit
+        Mercator coordinates) and the columns ``q``/``r`` (axial coordinates),
+        ``candidates``, ``count`` and ``cls`` (color class, log-scaled by
+        ``metric``: candidates, or count when no pin has candidates), plus the
+        class ``breaks`` for the legend
+    """
+    x, y = _project(lons, lats)
+    weights = np.nan_to_num(np.asarray(candidates, dtype=float), nan=0.0)
+    levels = []
+    for zoom in zooms:
+        size = radius / (TILE_SIZE * 2 ** zoom)
+        q, r, weight, count = hexbin(x, y, weights, size)
+        if levels and len(q) > max_cells:
+            break
+        metric = "candidates" if weight.any() else "count"
+        classes, breaks = _classes(weight if metric == "candidates" else count.astype(float))
+        levels.append({
+            "zoom": int(zoom),
+            "size": size,
+            "q": q.tolist(),
+            "r": r.tolist(),
+            "candidates": [_json_number(value) for value in weight],
+            "count": count.tolist(),
+            "cls": classes.tolist(),
+            "metric": metric,
+            "breaks": breaks,
+        })
+    return levels
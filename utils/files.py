@@ -0,0 +1,47 @@
+"""
+Utility functions for writing generated files atomically
+
+Maps, assets, compressed copies and tiles are read by other requests while
+they are written, and the same file can be written by two requests at once
+(e.g. the same map generated twice).  Every such file is written to its own
+uniquely named temporary file in the target directory and renamed into
+place, so readers see either the old file or the complete new one.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+# mkstemp creates files readable by the owner only; generated files are served
+# (possibly by a front proxy running as another user), like an ordinary open()
+FILE_MODE = 0o644
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "wb", **kwargs):
+    """
+    Open a temporary file that replaces ``path`` when the block completes.
+
+    The temporary file is hidden (its name starts with ".") so it is never
+    taken for an artifact, and it is removed if the block raises.
+
+    Args:
+        path: File to write
+        mode: "wb" or "w"
+        **kwargs: Passed to open(), e.g. ``encoding``
+
+    Yields:
+        The open temporary file
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            os.chmod(temporary, FILE_MODE)
+            yield f
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,58 @@
+"""
+Utility functions for fingerprinting map generation requests
+
+A generated map is stored under a fingerprint of everything that shapes it:
+the uploaded rows and the generation options.  The rows are normalized
+first, so the column order, whitespace around values and whether a reader
+parsed a column as text or numbers do not change the fingerprint.  The same
+spreadsheet generated with the same choices therefore gets the same map id,
+and the stored map can be returned without geocoding or rendering it again.
+"""
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+# Part of every fingerprint; bump it when the same input should produce a different map
+FINGERPRINT_VERSION = 1
+# Hex digits kept from the SHA-256 digest (128 bits)
+FINGERPRINT_LENGTH = 32
+
+
+def normalized_text(values: pd.Series) -> pd.Series:
+    """
+    A column as stripped text, with missing values empty.
+
+    Whole numbers in float columns (e.g. ZIP codes in a column with gaps)
+    are written without ``.0``, as they are in an integer or text column.
+    """
+    if pd.api.types.is_float_dtype(values):
+        whole = values.notna() & np.isfinite(values) & (values == np.trunc(values)) & (values.abs() < 2 ** 53)
+        text = values.astype(str).astype(object)
+        text[whole] = values[whole].astype(np.int64).astype(str)
+    else:
+        text = values.astype(str)
+    return text.str.strip().where(values.notna(), "")
+
+
+def map_fingerprint(df: pd.DataFrame, options: dict) -> str:
+    """
+    Storage key of the map generated from ``df`` with ``options``.
+
+    Args:
+        df: Uploaded rows, before any geocoding or formatting
+        options: JSON-serializable generation options and settings
+
+    Returns:
+        FINGERPRINT_LENGTH lowercase hex digits
+    """
+    digest = hashlib.sha256(f"v{FINGERPRINT_VERSION}\n".encode())
+    digest.update(json.dumps(options, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8"))
+    digest.update(f"\nrows={len(df)}".encode())
+    for column in sorted(df.columns, key=lambda name: str(name).strip()):
+        digest.update(f"\n{str(column).strip()}\n".encode("utf-8"))
+        # hash_pandas_object hashes a whole column at once with a fixed key
+        row_hashes = pd.util.hash_pandas_object(normalized_text(df[column]), index=False)
+        digest.update(row_hashes.to_numpy().tobytes())
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
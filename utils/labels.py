@@ -0,0 +1,180 @@
+"""
+Utility functions for precomputing which location labels are shown per zoom level
+
+Labels are placed greedily at generation time: pins are visited in priority
+order (most electrification candidates first) and a label is kept when its
+box, measured from the name's text metrics in projected pixel coordinates,
+does not overlap a label already kept at that zoom.  The result is one bitset
+per zoom level that the map pages look up instead of running collision
+checks in the browser.  Every label box sits at the same offset from its pin,
+so the choice does not depend on where a frontend draws its labels.
+"""
+import base64
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+from PIL import ImageFont
+
+from utils.clustering import TILE_SIZE, _project
+
+LABEL_MIN_ZOOM = 2
+LABEL_MAX_ZOOM = 14
+LABEL_FONT_SIZE = 12
+LABEL_LINE_HEIGHT = 1.5
+LABEL_PADDING = 2
+# Side in pixels of the grid cells used to find overlapping labels
+_CELL_SIZE = 64
+
+# Advance width of each glyph per font size; summing them ignores kerning but is
+# far cheaper than laying out every name
+_fonts: Dict[int, object] = {}
+_glyph_widths: Dict[int, Dict[str, float]] = {}
+
+
+def text_width(text: str, font_size: int = LABEL_FONT_SIZE) -> float:
+    """Approximate rendered width in pixels of a label in a sans-serif font."""
+    if font_size not in _fonts:
+        try:
+            _fonts[font_size] = ImageFont.load_default(size=font_size)
+        except TypeError:
+            # Pillow < 10.1 has no scalable default font; fall back to an average glyph width
+            _fonts[font_size] = None
+        _glyph_widths[font_size] = {}
+    font, widths = _fonts[font_size], _glyph_widths[font_size]
+    if font is None:
+        return len(text) * font_size * 0.55
+    total = 0.0
+    for char in text:
+        width = widths.get(char)
+        if width is None:
+            width = widths[char] = font.getlength(char)
+        total += width
+    return total
+
+
+class LabelPlacement:
+    """Per-zoom label visibility for the pins of one map."""
+
+    def __init__(self, visible: Dict[int, np.ndarray], min_zoom: int = LABEL_MIN_ZOOM,
+                 max_zoom: int = LABEL_MAX_ZOOM):
+        self.visible = visible
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+
+    def is_visible(self, index: int, zoom: float) -> bool:
+        """Whether pin ``index`` is labelled at ``zoom`` (clamped to the placed range)."""
+        zoom = int(max(self.min_zoom, min(self.max_zoom, round(zoom))))
+        return bool(self.visible[zoom][index])
+
+    def counts(self) -> Dict[int, int]:
+        """Number of labels shown at each zoom level."""
+        return {zoom: int(bits.sum()) for zoom, bits in self.visible.items()}
+
+    def as_json(self) -> dict:
+        """
+        Compact form embedded in the map: one base64 bitset per zoom level.
+
+        Bit ``i`` of a zoom's bitset is ``byte[i >> 3] >> (i & 7) & 1``.
+        """
+        return {
+            "minZoom": self.min_zoom,
+            "maxZoom": self.max_zoom,
+            "bits": [
+                base64.b64encode(np.packbits(self.visible[zoom], bitorder="little").tobytes()).decode("ascii")
+                for zoom in range(self.min_zoom, self.max_zoom + 1)
+            ],
+        }
+
+
+def _alone_in_cells(cx0, cx1, cy0, cy1) -> np.ndarray:
+    """True for boxes that share none of their grid cells with another box."""
+    columns = cx1 - cx0 + 1
+    spans = columns * (cy1 - cy0 + 1)
+    box = np.repeat(np.arange(len(spans)), spans)
+    offset = np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+    keys = (cx0[box] + offset % columns[box]) << 32 | (cy0[box] + offset // columns[box])
+    _, cell, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    crowded = np.zeros(len(spans), dtype=bool)
+    crowded[box[counts[cell.ravel()] > 1]] = True
+    return ~crowded
+
+
+def _collides(grid, keys, l, t, r, b) -> bool:
+    for key in keys:
+        for other_l, other_t, other_r, other_b in grid.get(key, ()):
+            if l < other_r and r > other_l and t < other_b and b > other_t:
+                return True
+    return False
+
+
+def place_labels(lats: Sequence[float], lons: Sequence[float], names: Sequence[str],
+                 priority: Optional[Sequence[float]] = None, font_size: int = LABEL_FONT_SIZE,
+                 min_zoom: int = LABEL_MIN_ZOOM, max_zoom: int = LABEL_MAX_ZOOM,
+                 padding: int = LABEL_PADDING) -> LabelPlacement:
+    """
+    Greedy label placement for every zoom level in a range.
+
+    Args:
+        lats, lons: Pin coordinates in degrees
+        names: Label text per pin
+        priority: Higher values are labelled first (NaN counts as lowest); input order breaks ties
+        font_size: Label font size in pixels, used for the text metrics
+        min_zoom, max_zoom: Zoom levels to place labels for
+        padding: Space in pixels kept around each label
+
+    Returns:
+        LabelPlacement with one boolean array per zoom level
+    """
+    names = [str(name) for name in names]
+    n = len(names)
+    x, y = _project(lons, lats)
+    widths_by_name = {}
+    widths = np.array([widths_by_name.setdefault(name, text_width(name, font_size)) for name in names],
+                      dtype=float) + 2 * padding
+    height = font_size * LABEL_LINE_HEIGHT + 2 * padding
+
+    if priority is None:
+        order = np.arange(n)
+    else:
+        priority = np.nan_to_num(np.asarray(priority, dtype=float), nan=-np.inf)
+        order = np.argsort(-priority, kind="stable")
+    x, y, widths = x[order], y[order], widths[order]
+
+    visible = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        scale = TILE_SIZE * 2 ** zoom
+        left = x * scale
+        top = y * scale
+        right = left + widths
+        bottom = top + height
+        cx0 = np.floor(left / _CELL_SIZE).astype(np.int64)
+        cx1 = np.floor(right / _CELL_SIZE).astype(np.int64)
+        cy0 = np.floor(top / _CELL_SIZE).astype(np.int64)
+        cy1 = np.floor(bottom / _CELL_SIZE).astype(np.int64)
+
+        # A label alone in all of its cells overlaps nothing: it is shown and never blocks another,
+        # so only the crowded ones go through the greedy pass
+        placed = _alone_in_cells(cx0, cx1, cy0, cy1)
+        crowded = np.flatnonzero(~placed)
+        grid = {}
+        for rank, l, t, r, b, x0, x1, y0, y1 in zip(
+                crowded.tolist(), left[crowded].tolist(), top[crowded].tolist(), right[crowded].tolist(),
+                bottom[crowded].tolist(), cx0[crowded].tolist(), cx1[crowded].tolist(),
+                cy0[crowded].tolist(), cy1[crowded].tolist()):
+            keys = [cx << 32 | cy for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+            if _collides(grid, keys, l, t, r, b):
+                continue
+            placed[rank] = True
+            box = (l, t, r, b)
+            for key in keys:
+                cell = grid.get(key)
+                if cell is None:
+                    grid[key] = [box]
+                else:
+                    cell.append(box)
+
+        zoom_visible = np.zeros(n, dtype=bool)
+        zoom_visible[order] = placed
+        visible[zoom] = zoom_visible
+
+    return LabelPlacement(visible, min_zoom=min_zoom, max_zoom=max_zoom)
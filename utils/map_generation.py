@@ -1,10 +1,25 @@
 """
 Utility functions for map creation and HTML generation
 """
+import json
+import math
 import os
+import re
 import uuid
+from html import escape
 import folium
-from jinja2 import Environment, FileSystemLoader
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.plugins import MarkerCluster
+from jinja2 import Environment, FileSystemLoader, Template
+from jinja2.utils import htmlsafe_json_dumps
+
+from utils.assets import publish_asset, static_asset
+from utils.clustering import ClusterIndex
+from utils.density import DENSITY_COLORS
+from utils.files import atomic_write
+from utils.labels import LABEL_FONT_SIZE, place_labels
+from utils.spatial_index import PinGridIndex
 
 
 def create_folium_map(us_states, df, pin_map, get_pin_types, cluster_pins, group_colors):
@@ -21,14 +36,115 @@ def create_folium_map(us_states, df, pin_map, get_pin_types, cluster_pins, group
     return m
 
 
-def generate_map_html(map_obj, legend_items, table_rows, template_path):
+# Characters per chunk when a large JSON value is streamed into a page
+JSON_CHUNK_CHARS = 64 * 1024
+_JSON_ENCODER = json.JSONEncoder(separators=(",", ":"))
+# The escaping of Jinja's tojson, so a value can never close the <script> it is in
+_HTML_SAFE_JSON = str.maketrans({"<": "\\u003c", ">": "\\u003e", "&": "\\u0026", "'": "\\u0027"})
+_PLACEHOLDER = re.compile("\x00([^\x00.]+)\\.([^\x00]+)\x00")
+
+
+def iter_json(value, chunk_chars=JSON_CHUNK_CHARS):
+    """Serialize a value as HTML-safe JSON in pieces of about ``chunk_chars`` characters."""
+    buffer, size = [], 0
+    for piece in _JSON_ENCODER.iterencode(value):
+        buffer.append(piece.translate(_HTML_SAFE_JSON))
+        size += len(piece)
+        if size >= chunk_chars:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+class StreamedJsonMixin:
+    """
+    Lets :func:`render_map_parts` stream an element's large JSON values into the page.
+
+    Templates write ``{{ this.json_value("data") }}``.  That is the value
+    itself when the element is rendered as usual (e.g. ``_repr_html_``), or a
+    placeholder that :func:`render_map_parts` replaces with :func:`iter_json`
+    chunks, so the serialized pins are never held in memory as one string.
+    """
+
+    streamed = False
+
+    def json_value(self, field):
+        if self.streamed:
+            return f"\x00{self.get_name()}.{field}\x00"
+        return htmlsafe_json_dumps(getattr(self, field))
+
+
+def _stream_elements(element, found):
+    # Every StreamedJsonMixin element below ``element``, by name
+    for child in element._children.values():
+        if isinstance(child, StreamedJsonMixin):
+            child.streamed = True
+            found[child.get_name()] = child
+        _stream_elements(child, found)
+    return found
+
+
+def _stream_script(script, elements):
+    position = 0
+    for match in _PLACEHOLDER.finditer(script):
+        if match.group(1) not in elements:
+            continue
+        yield script[position:match.start()]
+        yield from iter_json(getattr(elements[match.group(1)], match.group(2)))
+        position = match.end()
+    yield script[position:]
+
+
+def render_map_parts(map_obj):
+    """
+    Render a Folium map as the header, body and script sections of its HTML document.
+
+    ``_repr_html_()`` wraps the whole map document in a base64 data URI iframe
+    (about a third larger, and decoded by the browser before anything
+    shows); these sections are placed straight into the page instead.
+
+    Returns:
+        Dict with ``map_header`` (CSS/JS includes and styles for ``<head>``),
+        ``map_html`` (the map div) and ``map_script`` (the map's JavaScript,
+        which has to come after the div, as an iterator of chunks: the pin
+        data of :class:`StreamedJsonMixin` layers is serialized while it is
+        written out)
     """
-    Render HTML for the map page given the Folium map HTML snippet, legend items, and table rows.
+    root = map_obj.get_root()
+    elements = _stream_elements(root, {})
+    # Rendering the figure makes every element add its parts to the three sections
+    root.render()
+    return {
+        "map_header": root.header.render(),
+        "map_html": root.html.render(),
+        "map_script": _stream_script(root.script.render(), elements),
+    }
+
+
+def generate_map_html(map_obj, legend_items, table_data, template_path):
+    """
+    Render HTML for the map page given the Folium map, legend items, and table data
+    (see utils.preprocessing.build_table_data).
     """
     env = Environment(loader=FileSystemLoader(os.path.dirname(template_path)))
     template = env.get_template(os.path.basename(template_path))
-    map_html = map_obj._repr_html_()
-    return template.render(map_html=map_html, legend_items=legend_items, table_rows=table_rows)
+    return template.render(legend_items=legend_items, table_data=iter_json(table_data), **render_map_parts(map_obj))
+
+
+def write_streamed(path, chunks):
+    """
+    Write text chunks to ``path`` through a temporary file renamed into place.
+
+    Only one chunk is held at a time, and readers never see a partial file.
+
+    Returns:
+        Size of the written file in bytes
+    """
+    with atomic_write(path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return os.path.getsize(path)
 
 
 def save_map_file(html_content, output_folder: str) -> str:
@@ -42,3 +158,931 @@ def save_map_file(html_content, output_folder: str) -> str:
     with open(filepath, 'w', encoding='utf-8') as f:
         f.write(html_content)
     return map_id, filepath
+
+
+class VectorTileStateLayer(JSCSSMixin, MacroElement):
+    """
+    State boundaries loaded from the ``/tiles/states/{z}/{x}/{y}.pbf`` endpoint.
+
+    Only the tiles in view are downloaded; the per-map group colors are passed
+    as a small style object and applied in the browser.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_colors = {{ this.group_colors|tojson }};
+            var {{ this.get_name() }} = L.vectorGrid.protobuf({{ this.url|tojson }}, {
+                rendererFactory: L.canvas.tile,
+                interactive: true,
+                maxNativeZoom: {{ this.max_native_zoom }},
+                getFeatureId: function(f) { return f.properties.abbr; },
+                vectorTileLayerStyles: {
+                    {{ this.layer_name|tojson }}: function(properties) {
+                        return {
+                            fill: true,
+                            fillColor: {{ this.get_name() }}_colors[properties.group] || 'gray',
+                            fillOpacity: 1.0,
+                            color: 'black',
+                            weight: 1
+                        };
+                    }
+                }
+            }).addTo({{ this._parent.get_name() }});
+
+            var {{ this.get_name() }}_tooltip = L.tooltip({sticky: true});
+            {{ this.get_name() }}.on('mousemove', function(e) {
+                {{ this.get_name() }}_tooltip
+                    .setLatLng(e.latlng)
+                    .setContent('State: ' + (e.layer.properties.name || ''));
+                {{ this._parent.get_name() }}.openTooltip({{ this.get_name() }}_tooltip);
+            });
+            {{ this.get_name() }}.on('mouseout', function() {
+                {{ this._parent.get_name() }}.closeTooltip({{ this.get_name() }}_tooltip);
+            });
+        {% endmacro %}
+    """)
+
+    default_js = [
+        ("leaflet_vectorgrid", "https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.js"),
+    ]
+
+    def __init__(self, url, group_colors, layer_name="states", max_native_zoom=14):
+        super().__init__()
+        self._name = "VectorTileStateLayer"
+        self.url = url
+        self.group_colors = group_colors
+        self.layer_name = layer_name
+        self.max_native_zoom = max_native_zoom
+
+
+class SharedStateLayer(JSCSSMixin, MacroElement):
+    """
+    State boundaries fetched from a content-hashed GeoJSON or TopoJSON asset.
+
+    Every map with the same countries references the same geometry file, which
+    the browser caches; only the per-map group colors are written into the page.
+    The states get their own pane below the markers, so pins added before the
+    geometry arrives are never covered by it.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var map = {{ this._parent.get_name() }};
+                var colors = {{ this.group_colors|tojson }};
+                var pane = map.createPane({{ this.get_name()|tojson }});
+                pane.style.zIndex = 350;
+                var layer = L.geoJson(null, {
+                    pane: {{ this.get_name()|tojson }},
+                    style: function(feature) {
+                        var group = feature.properties['CaaS Group'];
+                        return {
+                            fillColor: colors[group] || 'gray',
+                            color: 'black',
+                            weight: 1,
+                            fillOpacity: 1.0,
+                            className: group === 'Group 1' ? 'group1-state' : ''
+                        };
+                    },
+                    onEachFeature: function(feature, stateLayer) {
+                        stateLayer.bindTooltip('State: ' + MapViewer.escapeHtml(feature.properties.name || ''),
+                                               {sticky: true});
+                    }
+                }).addTo(map);
+                fetch({{ this.url|tojson }}).then(function(response) { return response.json(); }).then(function(data) {
+                    {% if this.topojson %}
+                    data = topojson.feature(data, data.objects[{{ this.object_name|tojson }}]);
+                    {% endif %}
+                    layer.addData(data);
+                });
+                return layer;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, group_colors, topojson=False, object_name="states"):
+        super().__init__()
+        self._name = "SharedStateLayer"
+        self.url = url
+        self.group_colors = group_colors
+        self.topojson = topojson
+        self.object_name = object_name
+        self.default_js = [("map_viewer", static_asset("js/map_viewer.js"))]
+        if topojson:
+            self.default_js.append(("topojson", "https://cdnjs.cloudflare.com/ajax/libs/topojson/1.6.9/topojson.min.js"))
+
+
+def _shade(color, amount):
+    """Lighten a ``#rrggbb`` color by ``amount`` per channel; other colors pass through."""
+    if not (color.startswith("#") and len(color) == 7):
+        return color
+    r, g, b = (min(255, int(color[i:i + 2], 16) + amount) for i in (1, 3, 5))
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def pin_symbol_svg(pin_type, color):
+    """Standalone marker SVG for a (pin type, color) pair; number pins leave the badge empty."""
+    if pin_type == "sphere":
+        return f'''<svg xmlns="http://www.w3.org/2000/svg" width="50" height="50" viewBox="0 0 75 75" fill="none">
+  <defs>
+    <radialGradient id="g" cx="30%" cy="30%" r="50%">
+      <stop offset="0%" stop-color="{_shade(color, 60)}"/>
+      <stop offset="100%" stop-color="{color}"/>
+    </radialGradient>
+  </defs>
+  <circle cx="50" cy="30" r="15" fill="url(#g)"/>
+  <circle cx="44" cy="24" r="5" fill="#ffffff" fill-opacity="0.3"/>
+  <path d="M45 45 L50 80" stroke="#888" stroke-width="2" transform="rotate(30, 50, 45)"/>
+</svg>'''
+    return f'''<svg xmlns="http://www.w3.org/2000/svg" width="65" height="55" viewBox="0 0 65 55">
+  <g transform="translate(0,2)">
+  <path fill="{color}" stroke="{_shade(color, 80)}" stroke-width="2"
+        d="M32.5,0 C22.558,0 14.5,8.058 14.5,18 c0 13.5 18,32 18,32 s18-18.5 18-32 c0-9.942-8.058-18-18-18z"/>
+  <circle cx="32.5" cy="20" r="10" fill="#ffffff"/>
+  </g>
+</svg>'''
+
+
+def _json_value(value):
+    """NumPy scalars to Python values and NaN to None, so they serialize as JSON."""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class PinSymbolSheet(JSCSSMixin, MacroElement):
+    """
+    Defines every (pin type, color) marker image once as a CSS class.
+
+    Markers reference the class instead of carrying their own inline SVG, so
+    a map with thousands of pins embeds each pin image only once.  Number
+    pins draw their number as a text overlay on top of the shared image.
+    The images, the pin styles and the viewer helpers (``MapViewer``) are
+    content-hashed assets (see :mod:`utils.assets`) shared by all maps.
+    """
+
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+            <style>
+                {% for class_name, uri in this.symbols.values() %}
+                .{{ class_name }} { background-image: url("{{ uri }}"); }
+                {% endfor %}
+            </style>
+        {% endmacro %}
+    """)
+
+    # icon_size and icon_anchor of each pin type, with and without a label underneath
+    ICON_GEOMETRY = {
+        "sphere": {"plain": ((50, 50), (25, 50)), "labelled": ((150, 80), (25, 50))},
+        "number": {"plain": ((65, 55), (32, 55)), "labelled": ((150, 110), (32, 80))},
+    }
+
+    def __init__(self):
+        super().__init__()
+        self._name = "PinSymbolSheet"
+        self.symbols = {}
+        self.default_js = [("map_viewer", static_asset("js/map_viewer.js"))]
+        self.default_css = [("map_viewer", static_asset("css/map_viewer.css"))]
+
+    def css_class(self, pin_type, color):
+        """Register a (pin type, color) pair and return the CSS classes that draw it."""
+        pin_type = "sphere" if pin_type == "sphere" else "number"
+        key = (pin_type, color)
+        if key not in self.symbols:
+            uri = publish_asset(f"pin-{pin_type}", pin_symbol_svg(pin_type, color), "svg")
+            self.symbols[key] = (f"pin-symbol-{len(self.symbols)}", uri)
+        return f"pin-icon pin-{pin_type} {self.symbols[key][0]}"
+
+    def symbol_uri(self, pin_type, color):
+        """URL of the pin image for a (pin type, color) pair."""
+        self.css_class(pin_type, color)
+        return self.symbols[("sphere" if pin_type == "sphere" else "number", color)][1]
+
+    def icon_spec(self, pin_type, color):
+        """Client-side description of a pin style: CSS classes and icon geometry with/without a label."""
+        geometry = self.ICON_GEOMETRY["sphere" if pin_type == "sphere" else "number"]
+        return {
+            "className": self.css_class(pin_type, color),
+            "number": pin_type != "sphere",
+            "iconSize": geometry["plain"][0],
+            "iconAnchor": geometry["plain"][1],
+            "labelIconSize": geometry["labelled"][0],
+            "labelIconAnchor": geometry["labelled"][1],
+        }
+
+    def icon(self, pin_type, color, number=None, label=None, count=1):
+        """Build a DivIcon that references the shared symbol for this pin; ``count`` > 1 adds a badge."""
+        spec = self.icon_spec(pin_type, color)
+        overlay = ""
+        if spec["number"]:
+            overlay = f'<span class="pin-number-text">{escape(str(number)) if number else "1"}</span>'
+        if count > 1:
+            overlay += f'<span class="pin-count">{count}</span>'
+        if label is None:
+            return folium.DivIcon(html=overlay, icon_size=spec["iconSize"], icon_anchor=spec["iconAnchor"],
+                                  class_name=spec["className"])
+        html = f'<div class="{spec["className"]}">{overlay}</div><div class="custom-label-text">{escape(str(label))}</div>'
+        return folium.DivIcon(html=html, icon_size=spec["labelIconSize"], icon_anchor=spec["labelIconAnchor"],
+                              class_name="div-icon-container")
+
+
+class PinDataLayer(StreamedJsonMixin, JSCSSMixin, MacroElement):
+    """
+    All pins of a map as one columnar JSON blob plus a client-side marker factory.
+
+    Folium writes several lines of JavaScript per ``folium.Marker``; this layer
+    writes one array per column (lat, lon, category index, name, candidates)
+    and builds the markers in the browser.  Icons reuse the
+    :class:`PinSymbolSheet` classes and popups are only built when opened.
+    After :meth:`place_labels`, names are shown or hidden per zoom level from
+    precomputed bitsets (see :mod:`utils.labels`).
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var data = {{ this.json_value("data") }};
+                var styles = {{ this.styles|tojson }};
+                var showLabels = {{ this.show_labels|tojson }};
+                var labels = {{ this.json_value("labels") }};
+                var map = {{ this._parent.get_name() }};
+
+                // Per-zoom label bitsets placed on the server; bit i of a zoom is pin i
+                var labelBits = MapViewer.decodeLabelBits(labels);
+
+                function labelVisible(i) {
+                    return MapViewer.labelVisible(labels, labelBits, i, map.getZoom());
+                }
+
+                var PinMarker = L.Marker.extend({
+                    onAdd: function(map) {
+                        L.Marker.prototype.onAdd.call(this, map);
+                        this._updateLabel();
+                    },
+                    _updateLabel: function() {
+                        if (this._icon) {
+                            L.DomUtil[labelVisible(this.options.index) ? 'removeClass' : 'addClass'](
+                                this._icon, 'pin-label-hidden');
+                        }
+                    }
+                });
+
+                function makeIcon(i) {
+                    return MapViewer.pinIcon(styles[data.cat[i]], {
+                        candidates: data.candidates[i], count: data.count[i], name: data.name[i]
+                    }, showLabels);
+                }
+
+                function makePopup(i) {
+                    return function() { return MapViewer.popupHtml(data.name[i], data.candidates[i], data.members[i]); };
+                }
+
+                {% if this.cluster %}
+                var layer = L.markerClusterGroup({
+                    chunkedLoading: true,
+                    {% if this.icon_create_function %}iconCreateFunction: {{ this.icon_create_function }}{% endif %}
+                });
+                {% else %}
+                var layer = L.featureGroup();
+                {% endif %}
+
+                var markers = new Array(data.lat.length);
+                for (var i = 0; i < data.lat.length; i++) {
+                    markers[i] = new PinMarker([data.lat[i], data.lon[i]], {icon: makeIcon(i), index: i})
+                        .bindPopup(makePopup(i), {maxWidth: 200});
+                }
+                {% if this.cluster %}
+                layer.addLayers(markers);
+                {% else %}
+                markers.forEach(function(marker) { layer.addLayer(marker); });
+                {% endif %}
+                if (showLabels && labelBits) {
+                    map.on('zoomend', function() {
+                        markers.forEach(function(marker) { marker._updateLabel(); });
+                    });
+                }
+                return layer.addTo(map);
+            })();
+        {% endmacro %}
+    """)
+
+    default_js = MarkerCluster.default_js
+    default_css = MarkerCluster.default_css
+
+    # Font size of the labels this layer draws, used for the placement text metrics
+    label_font_size = LABEL_FONT_SIZE
+
+    def __init__(self, pin_symbols, show_labels=True, cluster=False, icon_create_function=None):
+        """
+        Args:
+            pin_symbols: PinSymbolSheet providing the CSS classes of each pin style
+            show_labels: Draw the location name under each pin
+            cluster: Group pins with Leaflet.markercluster
+            icon_create_function: Optional JavaScript function for cluster icons
+        """
+        super().__init__()
+        self._name = "PinDataLayer"
+        self.pin_symbols = pin_symbols
+        self.show_labels = show_labels
+        self.cluster = cluster
+        self.icon_create_function = icon_create_function
+        self.styles = []
+        self._style_index = {}
+        self.data = {"lat": [], "lon": [], "cat": [], "name": [], "candidates": [], "count": [], "members": []}
+        self.labels = None
+
+    def _style_spec(self, pin_type, color):
+        return self.pin_symbols.icon_spec(pin_type, color)
+
+    def place_labels(self):
+        """Precompute which names are shown at each zoom level; pins with more candidates win."""
+        placement = place_labels(
+            self.data["lat"], self.data["lon"], self.data["name"],
+            priority=[c if isinstance(c, (int, float)) else float("nan") for c in self.data["candidates"]],
+            font_size=self.label_font_size,
+        )
+        self.labels = placement.as_json()
+        return placement
+
+    def add_pin(self, lat, lon, pin_type, color, name, candidates, count=1, members=None):
+        """
+        Append one pin; (pin type, color) pairs are stored once as a style index.
+
+        ``count`` and ``members`` (``(name, candidates)`` pairs) describe a pin
+        that stands for several locations at the same point.
+        """
+        key = (pin_type, color)
+        if key not in self._style_index:
+            self._style_index[key] = len(self.styles)
+            self.styles.append(self._style_spec(pin_type, color))
+        self.data["lat"].append(lat)
+        self.data["lon"].append(lon)
+        self.data["cat"].append(self._style_index[key])
+        self.data["name"].append(str(name))
+        self.data["candidates"].append(_json_value(candidates))
+        self.data["count"].append(int(count))
+        self.data["members"].append(
+            [[str(member), _json_value(value)] for member, value in members] if members else None
+        )
+
+
+class PinCanvasLayer(PinDataLayer):
+    """
+    Columnar pin layer drawn on a single canvas instead of one DOM node per pin.
+
+    Each pin style is decoded once into an image and blitted for every pin;
+    labels go through ``L.LabelTextCollision`` so overlapping names are
+    skipped, or, after :meth:`place_labels`, are drawn straight from the
+    precomputed per-zoom bitsets.  Clicks are hit-tested against the pin
+    image to open popups.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var data = {{ this.json_value("data") }};
+                var styles = {{ this.styles|tojson }};
+                var showLabels = {{ this.show_labels|tojson }};
+                var labels = {{ this.json_value("labels") }};
+
+                // Per-zoom label bitsets placed on the server; bit i of a zoom is pin i
+                var labelBits = MapViewer.decodeLabelBits(labels);
+
+                var renderer = new (L.LabelTextCollision.extend({
+                    initialize: function(options) {
+                        // Run the base renderer setup (layer registry, stamp) as well as the options
+                        L.Canvas.prototype.initialize.call(this, options);
+                    },
+                    _updateCircle: function(layer) {
+                        var style = layer.options.pinStyle;
+                        if (!style) {
+                            return L.LabelTextCollision.prototype._updateCircle.call(this, layer);
+                        }
+                        if (!this._drawing || layer._empty()) { return; }
+                        var ctx = this._ctx, p = layer._point;
+                        var left = p.x - style.iconAnchor[0], top = p.y - style.iconAnchor[1];
+                        if (style.sprite.complete) {
+                            ctx.drawImage(style.sprite, left, top, style.iconSize[0], style.iconSize[1]);
+                        }
+                        if (style.number) {
+                            ctx.font = 'bold 12px Calibri, sans-serif';
+                            ctx.textAlign = 'center';
+                            ctx.fillStyle = '#000';
+                            ctx.fillText(String(layer.options.number || '1'), left + style.iconSize[0] / 2, top + 26);
+                            ctx.textAlign = 'start';
+                        }
+                        if (layer.options.count > 1) {
+                            // Badge with the number of locations merged into this pin
+                            var badgeX = left + style.iconSize[0] - 9, badgeY = top + 9;
+                            ctx.beginPath();
+                            ctx.arc(badgeX, badgeY, 9, 0, 2 * Math.PI);
+                            ctx.fillStyle = '#d9534f';
+                            ctx.fill();
+                            ctx.font = 'bold 11px Calibri, sans-serif';
+                            ctx.textAlign = 'center';
+                            ctx.textBaseline = 'middle';
+                            ctx.fillStyle = '#fff';
+                            ctx.fillText(String(layer.options.count), badgeX, badgeY);
+                            ctx.textAlign = 'start';
+                            ctx.textBaseline = 'alphabetic';
+                        }
+                        if (MapViewer.labelVisible(labels, labelBits, layer.options.index, this._map.getZoom())) {
+                            this._text(this._ctxLabel, layer);
+                        }
+                    }
+                }))({collisionFlg: !labelBits});
+
+                var PinSprite = L.CircleMarker.extend({
+                    // Hit-test the pin image rather than a circle around the anchor point
+                    _containsPoint: function(p) {
+                        var style = this.options.pinStyle;
+                        var left = this._point.x - style.iconAnchor[0], top = this._point.y - style.iconAnchor[1];
+                        return p.x >= left && p.x <= left + style.iconSize[0] &&
+                               p.y >= top && p.y <= top + style.iconSize[1];
+                    }
+                });
+
+                styles.forEach(function(style) {
+                    style.sprite = new Image();
+                    style.sprite.onload = function() {
+                        if (renderer._map) { renderer._redraw(); }
+                    };
+                    style.sprite.src = style.image;
+                });
+
+                function makePopup(i) {
+                    return function() { return MapViewer.popupHtml(data.name[i], data.candidates[i], data.members[i]); };
+                }
+
+                {% if this.cluster %}
+                var layer = L.markerClusterGroup({
+                    chunkedLoading: true,
+                    {% if this.icon_create_function %}iconCreateFunction: {{ this.icon_create_function }}{% endif %}
+                });
+                {% else %}
+                var layer = L.featureGroup();
+                {% endif %}
+
+                var markers = new Array(data.lat.length);
+                for (var i = 0; i < data.lat.length; i++) {
+                    var style = styles[data.cat[i]];
+                    markers[i] = new PinSprite([data.lat[i], data.lon[i]], {
+                        renderer: renderer,
+                        pinStyle: style,
+                        index: i,
+                        // The radius only sizes the redraw/culling bounds so the whole image is covered
+                        radius: Math.max(style.iconSize[0], style.iconSize[1]),
+                        stroke: false,
+                        fill: false,
+                        number: data.candidates[i],
+                        count: data.count[i],
+                        text: showLabels ? data.name[i] : undefined,
+                        textColor: '#000'
+                    }).bindPopup(makePopup(i), {maxWidth: 200});
+                }
+                {% if this.cluster %}
+                layer.addLayers(markers);
+                {% else %}
+                markers.forEach(function(marker) { layer.addLayer(marker); });
+                {% endif %}
+                return layer.addTo({{ this._parent.get_name() }});
+            })();
+        {% endmacro %}
+    """)
+
+    # Matches the 16px font L.LabelTextCollision draws with
+    label_font_size = 16
+
+    def __init__(self, pin_symbols, show_labels=True, cluster=False, icon_create_function=None):
+        super().__init__(pin_symbols, show_labels=show_labels, cluster=cluster,
+                         icon_create_function=icon_create_function)
+        self._name = "PinCanvasLayer"
+        self.default_js = PinDataLayer.default_js + [
+            ("label_text_collision", static_asset("js/L.LabelTextCollision.js")),
+        ]
+
+    def _style_spec(self, pin_type, color):
+        spec = self.pin_symbols.icon_spec(pin_type, color)
+        spec["image"] = self.pin_symbols.symbol_uri(pin_type, color)
+        return spec
+
+
+class CategoryPinLayer(PinDataLayer):
+    """
+    Columnar pins split into one chunk per category, loaded when the category is turned on.
+
+    The page embeds just the pin styles and the category list; a layer control
+    has a toggle per category and the first time a category is shown its
+    chunk is fetched from ``url`` (``?index=<category index>``, see
+    :meth:`chunks`) and its markers are built.  Hidden categories are neither
+    downloaded nor instantiated, so opening the map only costs the categories
+    that start visible.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var map = {{ this._parent.get_name() }};
+                var styles = {{ this.styles|tojson }};
+                var showLabels = {{ this.show_labels|tojson }};
+                var categories = {{ this.categories|tojson }};
+                {% if this.cluster %}
+                var layer = L.markerClusterGroup({
+                    chunkedLoading: true,
+                    {% if this.icon_create_function %}iconCreateFunction: {{ this.icon_create_function }}{% endif %}
+                }).addTo(map);
+                {% else %}
+                var layer = L.featureGroup().addTo(map);
+                {% endif %}
+                var markers = {};
+                var loading = {};
+
+                function makeIcon(data, i) {
+                    return MapViewer.pinIcon(styles[data.cat[i]], {
+                        candidates: data.candidates[i], count: data.count[i], name: data.name[i]
+                    }, showLabels);
+                }
+
+                function makePopup(data, i) {
+                    return function() { return MapViewer.popupHtml(data.name[i], data.candidates[i], data.members[i]); };
+                }
+
+                function addMarkers(list) {
+                    {% if this.cluster %}
+                    layer.addLayers(list);
+                    {% else %}
+                    list.forEach(function(marker) { layer.addLayer(marker); });
+                    {% endif %}
+                }
+
+                function removeMarkers(list) {
+                    {% if this.cluster %}
+                    layer.removeLayers(list);
+                    {% else %}
+                    list.forEach(function(marker) { layer.removeLayer(marker); });
+                    {% endif %}
+                }
+
+                var toggles = categories.map(function() { return L.layerGroup(); });
+
+                function show(k) {
+                    if (markers[k]) { addMarkers(markers[k]); return; }
+                    if (loading[k]) { return; }
+                    loading[k] = true;
+                    fetch({{ this.url|tojson }} + '?index=' + k)
+                        .then(function(response) { return response.json(); })
+                        .then(function(data) {
+                            markers[k] = data.lat.map(function(lat, i) {
+                                return L.marker([lat, data.lon[i]], {icon: makeIcon(data, i)})
+                                    .bindPopup(makePopup(data, i), {maxWidth: 200});
+                            });
+                            // The category may have been turned off while its chunk was loading
+                            if (map.hasLayer(toggles[k])) { addMarkers(markers[k]); }
+                        })
+                        .catch(function(error) { console.error('Failed to load category', categories[k].name, error); })
+                        .then(function() { loading[k] = false; });
+                }
+
+                var overlays = {};
+                toggles.forEach(function(toggle, k) {
+                    toggle.on('add', function() { show(k); });
+                    toggle.on('remove', function() { if (markers[k]) { removeMarkers(markers[k]); } });
+                    overlays[MapViewer.escapeHtml(categories[k].name) + ' (' + categories[k].count + ')'] = toggle;
+                });
+                L.control.layers(null, overlays, {collapsed: false}).addTo(map);
+                toggles.forEach(function(toggle, k) {
+                    if (categories[k].visible) { toggle.addTo(map); }
+                });
+                return layer;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, pin_symbols, url, show_labels=True, cluster=False, icon_create_function=None,
+                 hidden_categories=()):
+        """
+        Args:
+            pin_symbols: PinSymbolSheet providing the CSS classes of each pin style
+            url: Category chunk endpoint for this map, e.g. ``/map/<map_id>/categories``
+            show_labels: Draw the location name under each pin
+            cluster: Group the shown pins with Leaflet.markercluster
+            icon_create_function: Optional JavaScript function for cluster icons
+            hidden_categories: Categories that start turned off (and unloaded)
+        """
+        super().__init__(pin_symbols, show_labels=show_labels, cluster=cluster,
+                         icon_create_function=icon_create_function)
+        self._name = "CategoryPinLayer"
+        self.url = url
+        self.hidden_categories = set(hidden_categories)
+        self.categories = []
+        self._category_index = {}
+        self._pin_category = []
+
+    def add_pin(self, lat, lon, pin_type, color, name, candidates, count=1, members=None, category=""):
+        """Append one pin to the chunk of ``category``; see :meth:`PinDataLayer.add_pin`."""
+        super().add_pin(lat, lon, pin_type, color, name, candidates, count=count, members=members)
+        if category not in self._category_index:
+            self._category_index[category] = len(self.categories)
+            self.categories.append({"name": str(category), "count": 0,
+                                    "visible": category not in self.hidden_categories})
+        index = self._category_index[category]
+        self.categories[index]["count"] += 1
+        self._pin_category.append(index)
+
+    def chunks(self):
+        """Columnar pin data of each category, in the order of :attr:`categories`; stored next to the map."""
+        chunks = [{column: [] for column in self.data} for _ in self.categories]
+        for i, index in enumerate(self._pin_category):
+            for column, values in self.data.items():
+                chunks[index][column].append(values[i])
+        return chunks
+
+
+class ServerClusterLayer(PinDataLayer):
+    """
+    Pins clustered on the server and fetched for the visible area only.
+
+    The page embeds just the pin styles; on every ``moveend`` it requests the
+    clusters and single pins for the current bbox and zoom from ``url`` (see
+    :class:`utils.clustering.ClusterIndex`).  Cluster icons reuse the map's
+    ``icon_create_function`` and show the pin count; clicking a cluster zooms
+    to the level where it splits.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var map = {{ this._parent.get_name() }};
+                var styles = {{ this.styles|tojson }};
+                var showLabels = {{ this.show_labels|tojson }};
+                var layer = L.layerGroup().addTo(map);
+                var iconCreateFunction = {{ this.icon_create_function or 'null' }};
+                var latestRequest = 0;
+
+                var escapeHtml = MapViewer.escapeHtml;
+
+                function clusterIcon(feature) {
+                    var fakeCluster = {getChildCount: function() { return feature.count; }};
+                    if (iconCreateFunction) { return iconCreateFunction(fakeCluster); }
+                    return L.divIcon({
+                        html: '<div><span>' + feature.count + '</span></div>',
+                        className: 'marker-cluster marker-cluster-small',
+                        iconSize: L.point(40, 40)
+                    });
+                }
+
+                function render(features) {
+                    layer.clearLayers();
+                    features.forEach(function(feature) {
+                        if (feature.count) {
+                            L.marker([feature.lat, feature.lon], {icon: clusterIcon(feature)})
+                                .bindTooltip(feature.count + ' locations, ' +
+                                             feature.candidates + ' electrification candidates')
+                                .on('click', function() {
+                                    map.setView([feature.lat, feature.lon], feature.expansion_zoom);
+                                })
+                                .addTo(layer);
+                        } else {
+                            var icon = MapViewer.pinIcon(styles[feature.cat], feature, showLabels);
+                            L.marker([feature.lat, feature.lon], {icon: icon})
+                                .bindPopup(function() {
+                                    return '<strong>' + escapeHtml(feature.name) + '</strong><br>' +
+                                           'Electrification Candidates: ' + escapeHtml(feature.candidates);
+                                }, {maxWidth: 200})
+                                .addTo(layer);
+                        }
+                    });
+                }
+
+                function refresh() {
+                    var bounds = map.getBounds();
+                    var bbox = [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()]
+                        .map(function(v) { return v.toFixed(5); }).join(',');
+                    var requestId = ++latestRequest;
+                    fetch({{ this.url|tojson }} + '?bbox=' + bbox + '&zoom=' + Math.floor(map.getZoom()))
+                        .then(function(response) { return response.json(); })
+                        .then(function(result) {
+                            // Ignore responses that arrive after a newer view was requested
+                            if (requestId === latestRequest) { render(result.features); }
+                        })
+                        .catch(function(error) { console.error('Failed to load clusters', error); });
+                }
+
+                map.on('moveend', refresh);
+                refresh();
+                return layer;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, pin_symbols, url, show_labels=True, icon_create_function=None):
+        """
+        Args:
+            pin_symbols: PinSymbolSheet providing the CSS classes of each pin style
+            url: Cluster endpoint for this map, e.g. ``/map/<map_id>/clusters``
+            show_labels: Draw the location name under single pins
+            icon_create_function: Optional JavaScript function for cluster icons
+        """
+        super().__init__(pin_symbols, show_labels=show_labels, cluster=True,
+                         icon_create_function=icon_create_function)
+        self._name = "ServerClusterLayer"
+        self.url = url
+
+    def build_index(self):
+        """Cluster the collected pins; the result is stored with the map, not embedded in it."""
+        return ClusterIndex.build(
+            self.data["lat"], self.data["lon"],
+            [c if isinstance(c, (int, float)) else float("nan") for c in self.data["candidates"]],
+            self.data["name"], self.data["cat"],
+        )
+
+
+class ViewportPinLayer(PinDataLayer):
+    """
+    Pins fetched for the visible area only, from a per-map spatial index.
+
+    The page embeds just the pin styles; on every ``moveend`` it asks ``url``
+    for the pins in the (padded) view (see
+    :class:`utils.spatial_index.PinGridIndex`) and adds the ones it has not
+    seen yet.  Areas whose pins were all returned are remembered, so panning
+    back or zooming in does not refetch; crowded views come back thinned and
+    are requested again once the map is zoomed in.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var map = {{ this._parent.get_name() }};
+                var styles = {{ this.styles|tojson }};
+                var showLabels = {{ this.show_labels|tojson }};
+                {% if this.cluster %}
+                var layer = L.markerClusterGroup({
+                    chunkedLoading: true,
+                    {% if this.icon_create_function %}iconCreateFunction: {{ this.icon_create_function }}{% endif %}
+                }).addTo(map);
+                {% else %}
+                var layer = L.featureGroup().addTo(map);
+                {% endif %}
+                var loaded = {};
+                var completeAreas = [];
+                var latestRequest = 0;
+
+                var escapeHtml = MapViewer.escapeHtml;
+
+                function addPins(pins) {
+                    var markers = [];
+                    pins.forEach(function(pin) {
+                        if (loaded[pin.index]) { return; }
+                        loaded[pin.index] = true;
+                        markers.push(L.marker([pin.lat, pin.lon], {icon: MapViewer.pinIcon(styles[pin.cat], pin, showLabels)})
+                            .bindPopup(function() {
+                                return '<strong>' + escapeHtml(pin.name) + '</strong><br>' +
+                                       'Electrification Candidates: ' + escapeHtml(pin.candidates);
+                            }, {maxWidth: 200}));
+                    });
+                    {% if this.cluster %}
+                    layer.addLayers(markers);
+                    {% else %}
+                    markers.forEach(function(marker) { layer.addLayer(marker); });
+                    {% endif %}
+                }
+
+                function refresh() {
+                    var view = map.getBounds();
+                    if (completeAreas.some(function(area) { return area.contains(view); })) { return; }
+                    // Fetch a margin around the view so small pans are already covered
+                    var area = view.pad(0.25);
+                    var bbox = [area.getWest(), area.getSouth(), area.getEast(), area.getNorth()]
+                        .map(function(v) { return v.toFixed(5); }).join(',');
+                    var requestId = ++latestRequest;
+                    fetch({{ this.url|tojson }} + '?bbox=' + bbox + '&zoom=' + Math.floor(map.getZoom()))
+                        .then(function(response) { return response.json(); })
+                        .then(function(result) {
+                            addPins(result.pins);
+                            if (!result.truncated) { completeAreas.push(area); }
+                            else if (requestId === latestRequest) {
+                                console.info('Showing ' + result.pins.length + ' of ' + result.total +
+                                             ' pins in view; zoom in to load the rest');
+                            }
+                        })
+                        .catch(function(error) { console.error('Failed to load pins', error); });
+                }
+
+                map.on('moveend', refresh);
+                refresh();
+                return layer;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, pin_symbols, url, show_labels=True, cluster=False, icon_create_function=None):
+        """
+        Args:
+            pin_symbols: PinSymbolSheet providing the CSS classes of each pin style
+            url: Pin endpoint for this map, e.g. ``/map/<map_id>/pins``
+            show_labels: Draw the location name under each pin
+            cluster: Group the loaded pins with Leaflet.markercluster
+            icon_create_function: Optional JavaScript function for cluster icons
+        """
+        super().__init__(pin_symbols, show_labels=show_labels, cluster=cluster,
+                         icon_create_function=icon_create_function)
+        self._name = "ViewportPinLayer"
+        self.url = url
+
+    def build_index(self):
+        """Index the collected pins; the result is stored with the map, not embedded in it."""
+        return PinGridIndex.build(
+            self.data["lat"], self.data["lon"],
+            [c if isinstance(c, (int, float)) else float("nan") for c in self.data["candidates"]],
+            self.data["name"], self.data["cat"],
+        )
+
+
+class DensityLayer(StreamedJsonMixin, MacroElement):
+    """
+    Hexbin density grids in place of individual pins.
+
+    The grids of :func:`utils.density.density_levels` are embedded as axial
+    hex coordinates; on every ``moveend`` the level for the current zoom is
+    picked and its hexagons in view are drawn as polygons on one canvas, with
+    a legend of the color classes and a tooltip per hexagon.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var map = {{ this._parent.get_name() }};
+                var levels = {{ this.json_value("levels") }};
+                var colors = {{ this.colors|tojson }};
+                var renderer = L.canvas({padding: 0.5});
+                var layer = L.layerGroup().addTo(map);
+                var legend = L.control({position: 'bottomright'});
+                var SQRT3 = Math.sqrt(3);
+
+                function toLatLng(x, y) {
+                    return L.latLng(Math.atan(Math.sinh(Math.PI * (1 - 2 * y))) * 180 / Math.PI, x * 360 - 180);
+                }
+
+                function levelFor(zoom) {
+                    var chosen = levels[0];
+                    levels.forEach(function(level) { if (level.zoom <= zoom) { chosen = level; } });
+                    return chosen;
+                }
+
+                legend.onAdd = function() {
+                    this._div = L.DomUtil.create('div', 'legend');
+                    this._div.style.background = 'white';
+                    this._div.style.padding = '6px 8px';
+                    return this._div;
+                };
+                legend.update = function(level) {
+                    var title = level.metric === 'candidates' ? 'Electrification candidates' : 'Locations';
+                    this._div.innerHTML = '<strong>' + title + ' per hexagon</strong>' + colors.map(function(color, k) {
+                        return '<div><span style="display:inline-block;width:14px;height:14px;margin-right:6px;' +
+                               'vertical-align:middle;background:' + color + ';"></span>' +
+                               level.breaks[k] + ' - ' + level.breaks[k + 1] + '</div>';
+                    }).join('');
+                };
+
+                function render() {
+                    layer.clearLayers();
+                    if (!levels.length) { return; }
+                    var level = levelFor(map.getZoom()), size = level.size;
+                    var view = map.getBounds().pad(0.1);
+                    legend.update(level);
+                    for (var i = 0; i < level.q.length; i++) {
+                        var cx = size * SQRT3 * (level.q[i] + level.r[i] / 2), cy = size * 1.5 * level.r[i];
+                        if (!view.contains(toLatLng(cx, cy))) { continue; }
+                        var corners = [];
+                        for (var k = 0; k < 6; k++) {
+                            var angle = Math.PI / 180 * (60 * k - 30);
+                            corners.push(toLatLng(cx + size * Math.cos(angle), cy + size * Math.sin(angle)));
+                        }
+                        var color = colors[level.cls[i]];
+                        L.polygon(corners, {renderer: renderer, color: color, weight: 1, fillColor: color, fillOpacity: 0.6})
+                            .bindTooltip(level.count[i] + ' locations, ' + level.candidates[i] +
+                                         ' electrification candidates')
+                            .addTo(layer);
+                    }
+                }
+
+                legend.addTo(map);
+                map.on('moveend', render);
+                render();
+                return layer;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, levels, colors=DENSITY_COLORS):
+        """
+        Args:
+            levels: Hexbin grids from :func:`utils.density.density_levels`, coarsest first
+            colors: Fill color per color class, lowest first
+        """
+        super().__init__()
+        self._name = "DensityLayer"
+        self.levels = levels
+        self.colors = list(colors)
@@ -0,0 +1,127 @@
+"""
+Utility functions for columnar preprocessing of uploaded location tables
+
+ZIP formatting, geocoding address assembly and the location table colors are
+computed for whole columns with pandas/NumPy instead of per row, which keeps
+large uploads (100k+ rows) from spending seconds in Python loops before
+geocoding or rendering even starts.  ``benchmark_preprocessing.py`` compares
+these functions with the per-row versions they replace.
+"""
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+from utils.boundaries import geocode_country_name
+
+ADDRESS_COLUMNS = ("Street Address", "City", "State", "ZIP/Postal Code")
+# Location table highlight per candidate count, highest threshold first (the cluster icon palette)
+CANDIDATE_COLOR_BUCKETS = ((100, "#0056b8"), (50, "#00a1e0"), (10, "#00bfae"), (2, "#6bc04b"))
+TABLE_ROW_ALPHA = 0.25
+
+
+def hex_to_rgba(hex_color, alpha=0.2):
+    """CSS ``rgba()`` for a ``#rrggbb`` color; missing colors are transparent."""
+    if pd.isna(hex_color):
+        return 'rgba(255, 255, 255, 0)'
+    hex_color = hex_color.lstrip('#')
+    r, g, b = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    return f'rgba({r}, {g}, {b}, {alpha})'
+
+
+def format_zip_codes(values: pd.Series) -> pd.Series:
+    """
+    Format a ZIP/postal code column as strings.
+
+    Numbers (including ``"2134.0"`` or 2134 read as a float) become
+    zero-padded 5-digit ZIP codes, other values (e.g. Canadian postal codes)
+    are kept as text and missing values become empty strings.
+    """
+    numbers = pd.to_numeric(values, errors="coerce")
+    # Values that int(float(value)) accepted; inf and huge numbers stay text
+    numeric = numbers.notna() & (numbers.abs() < 1e18)
+    formatted = values.astype(str).astype(object)
+    formatted[numeric] = np.trunc(numbers[numeric]).astype(np.int64).astype(str).str.zfill(5)
+    formatted[values.isna() | (formatted == "")] = ""
+    return formatted
+
+
+def join_address_parts(df: pd.DataFrame, columns: Sequence[str] = ADDRESS_COLUMNS) -> pd.Series:
+    """The stripped, non-empty values of ``columns`` per row, joined with ``", "``."""
+    joined = pd.Series("", index=df.index, dtype=object)
+    for column in columns:
+        if column not in df.columns:
+            continue
+        part = df[column].fillna("").astype(str).str.strip()
+        separator = np.where((joined != "") & (part != ""), ", ", "")
+        joined = joined + separator + part
+    return joined
+
+
+def geocode_country_names(df: pd.DataFrame) -> pd.Series:
+    """Country suffix for the geocoding query of every row (see :func:`geocode_country_name`)."""
+    if "Country" not in df.columns:
+        return pd.Series(geocode_country_name(None), index=df.index, dtype=object)
+    # Resolved once per distinct value; missing values take the last slot (code -1)
+    codes, uniques = pd.factorize(df["Country"])
+    names = np.array([geocode_country_name(value) for value in uniques] + [geocode_country_name(None)],
+                     dtype=object)
+    return pd.Series(names[codes], index=df.index)
+
+
+def candidate_tiers(candidates: pd.Series) -> np.ndarray:
+    """
+    Index into CANDIDATE_COLOR_BUCKETS of each electrification candidate count.
+
+    Counts below the last threshold, and counts that are not numbers (which
+    count as 1), get ``len(CANDIDATE_COLOR_BUCKETS)``: no highlight.
+    """
+    numbers = pd.to_numeric(candidates, errors="coerce")
+    counts = np.trunc(numbers.fillna(1).to_numpy(dtype=float))
+    return np.select([counts >= threshold for threshold, _ in CANDIDATE_COLOR_BUCKETS],
+                     list(range(len(CANDIDATE_COLOR_BUCKETS))), default=len(CANDIDATE_COLOR_BUCKETS))
+
+
+def candidate_tier_legend(alpha: float = TABLE_ROW_ALPHA) -> list:
+    """Label and row background of every candidate tier, in :func:`candidate_tiers` order."""
+    legend, upper = [], None
+    for threshold, color in CANDIDATE_COLOR_BUCKETS:
+        label = f"{threshold}+" if upper is None else f"{threshold}\u2013{upper - 1}"
+        legend.append({"label": label, "color": hex_to_rgba(color, alpha=alpha)})
+        upper = threshold
+    legend.append({"label": f"Under {upper}", "color": "transparent"})
+    return legend
+
+
+def _json_values(values: pd.Series) -> list:
+    """Numbers as JSON numbers (whole ones as integers), anything else as its text."""
+    numbers = pd.to_numeric(values, errors="coerce")
+    finite = np.isfinite(numbers)
+    whole = finite & (numbers == np.trunc(numbers)) & (numbers.abs() < 2 ** 53)
+    converted = values.fillna("").astype(str).astype(object)
+    converted[finite] = numbers[finite].astype(object)
+    converted[whole] = numbers[whole].astype(np.int64).astype(object)
+    return converted.tolist()
+
+
+def build_table_data(df: pd.DataFrame) -> dict:
+    """
+    Columnar data of the location table next to the map.
+
+    The page renders it with a virtual-scrolling table (static/js/location_table.js),
+    so only the rows in view become DOM elements.
+
+    Returns:
+        Dict with one list per column (``location``, ``candidates``, ``tier``
+        and ``category``, the last two as indexes) plus the ``tiers`` legend and
+        the sorted ``categories`` names they index
+    """
+    category_codes, categories = pd.factorize(df["Category Name"], sort=True)
+    return {
+        "location": df["Location Name"].fillna("").astype(str).tolist(),
+        "candidates": _json_values(df["Electrification Candidates"]),
+        "tier": candidate_tiers(df["Electrification Candidates"]).tolist(),
+        "category": category_codes.tolist(),
+        "tiers": candidate_tier_legend(),
+        "categories": [str(category) for category in categories],
+    }
@@ -0,0 +1,159 @@
+"""
+Utility functions for rasterizing the state choropleth into PNG tiles
+
+Pre-rendered tiles are much cheaper to paint than a vector layer with opaque
+fills, which helps on low-end clients.  Rendering uses NumPy for the
+projection and Pillow for polygon rasterization; tiles are cached on disk by
+color scheme and z/x/y.  Only the color schemes of generated maps are
+rendered, and tiles without any state are served from memory, so requests
+for arbitrary schemes or empty areas cannot fill the cache.
+"""
+import io
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import shapely
+from PIL import Image, ImageDraw
+from shapely.geometry import box
+
+from utils.tiles import cached_tile, lonlat_to_mercator, tile_bounds_lonlat, tile_bounds_mercator
+
+TILE_SIZE = 256
+# Polygons are drawn at this multiple of the tile size and downsampled for antialiasing
+SUPERSAMPLE = 2
+MISSING_COLOR = "808080"
+GROUP_ORDER = ("Group 1", "Group 2", "Group 3")
+
+_SCHEME_RE = re.compile(r"^[0-9a-f]{6}(-[0-9a-f]{6}){%d}$" % (len(GROUP_ORDER) - 1))
+_HEX_RE = re.compile(r"^#?[0-9a-fA-F]{6}$")
+
+
+def color_scheme_key(group_colors: Dict[str, str]) -> str:
+    """Encode the group colors as a URL/cache-safe key, e.g. ``0056b8-00a1e0-a1d0f3``."""
+    parts = []
+    for group in GROUP_ORDER:
+        color = group_colors.get(group) or ""
+        parts.append(color.lstrip("#").lower() if _HEX_RE.match(color) else MISSING_COLOR)
+    return "-".join(parts)
+
+
+def parse_color_scheme(scheme: str) -> Optional[Dict[str, str]]:
+    """Inverse of :func:`color_scheme_key`; returns None for malformed keys."""
+    if not _SCHEME_RE.match(scheme or ""):
+        return None
+    return {group: f"#{color}" for group, color in zip(GROUP_ORDER, scheme.split("-"))}
+
+
+def _polygon_parts(geom) -> list:
+    if geom is None or geom.is_empty:
+        return []
+    if geom.geom_type == "Polygon":
+        return [geom]
+    if geom.geom_type in ("MultiPolygon", "GeometryCollection"):
+        return [part for g in geom.geoms for part in _polygon_parts(g)]
+    return []
+
+
+def _hex_to_rgba(color: str, alpha: int = 255):
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4)) + (alpha,)
+
+
+def _png(image: Image.Image) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+# Served for tiles without any state; never written to the cache
+EMPTY_TILE = _png(Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0)))
+
+
+class RasterTileRenderer:
+    """Renders a GeoDataFrame of grouped polygons to cached PNG tiles."""
+
+    def __init__(self, gdf, group_column: str, cache_dir: str, max_zoom: int = 12, schemes: Iterable[str] = ()):
+        """
+        Args:
+            gdf: GeoDataFrame with lon/lat polygon geometries
+            group_column: Column holding the group name used to pick a fill color
+            cache_dir: Directory for cached ``{scheme}/{z}/{x}/{y}.png`` files
+            max_zoom: Highest zoom level rendered
+            schemes: Color scheme keys always rendered (e.g. the default colors);
+                others must be allowed with :meth:`allow_scheme` first
+        """
+        self.cache_dir = cache_dir
+        self.max_zoom = max_zoom
+        self._schemes = set(schemes)
+        self._gdf = gdf.reset_index(drop=True)
+        self._groups = self._gdf[group_column].tolist()
+        self._mercator = shapely.transform(
+            self._gdf.geometry.values, lambda xy: np.column_stack(lonlat_to_mercator(xy[:, 0], xy[:, 1]))
+        )
+
+    def allow_scheme(self, scheme: str) -> None:
+        """
+        Let :meth:`get_tile` render a color scheme; called when a map using it is generated.
+
+        The scheme's cache directory is the record, so every worker process sees it.
+        """
+        if parse_color_scheme(scheme) is None:
+            raise ValueError(f"Invalid color scheme: {scheme}")
+        os.makedirs(os.path.join(self.cache_dir, scheme), exist_ok=True)
+
+    def is_allowed(self, scheme: str) -> bool:
+        return scheme in self._schemes or os.path.isdir(os.path.join(self.cache_dir, scheme))
+
+    def get_tile(self, scheme: str, z: int, x: int, y: int) -> bytes:
+        """
+        Return the PNG for a color scheme key and tile, from the disk cache when available.
+
+        Raises:
+            ValueError: The scheme is malformed
+            LookupError: The scheme is not used by any map (see :meth:`allow_scheme`)
+        """
+        group_colors = parse_color_scheme(scheme)
+        if group_colors is None:
+            raise ValueError(f"Invalid color scheme: {scheme}")
+        if not self.is_allowed(scheme):
+            raise LookupError(f"Unknown color scheme: {scheme}")
+        tile = cached_tile(self.cache_dir, os.path.join(scheme, str(z), str(x), f"{y}.png"),
+                           lambda: self.render_tile(group_colors, z, x, y))
+        return EMPTY_TILE if tile is None else tile
+
+    def render_tile(self, group_colors: Dict[str, str], z: int, x: int, y: int) -> Optional[bytes]:
+        """Rasterize all polygons intersecting tile z/x/y; None if the tile stays fully transparent."""
+        size = TILE_SIZE * SUPERSAMPLE
+        image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+
+        minx, miny, maxx, maxy = tile_bounds_mercator(z, x, y)
+        scale = size / (maxx - minx)
+        # Clip a few pixels outside the tile so the artificial clip edges stay invisible
+        pad = 4 * SUPERSAMPLE / scale
+        outline = (0, 0, 0, 255)
+        missing = _hex_to_rgba(MISSING_COLOR)
+
+        candidates = self._gdf.sindex.query(box(*tile_bounds_lonlat(z, x, y)), predicate="intersects")
+        for row_index in sorted(int(i) for i in candidates):
+            color = group_colors.get(self._groups[row_index])
+            fill = _hex_to_rgba(color) if color else missing
+            geom = shapely.clip_by_rect(self._mercator[row_index], minx - pad, miny - pad, maxx + pad, maxy + pad)
+            for polygon in _polygon_parts(geom):
+                rings = [polygon.exterior] + list(polygon.interiors)
+                for ring_index, ring in enumerate(rings):
+                    coords = np.asarray(ring.coords)[:, :2]
+                    pixels = np.column_stack(((coords[:, 0] - minx) * scale, (maxy - coords[:, 1]) * scale))
+                    points = [tuple(p) for p in pixels.tolist()]
+                    if len(points) < 3:
+                        continue
+                    draw.polygon(points, fill=fill if ring_index == 0 else (0, 0, 0, 0))
+                    draw.line(points, fill=outline, width=SUPERSAMPLE)
+
+        if image.getchannel("A").getbbox() is None:
+            return None
+        if SUPERSAMPLE > 1:
+            image = image.resize((TILE_SIZE, TILE_SIZE), Image.LANCZOS)
+        return _png(image)
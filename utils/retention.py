@@ -0,0 +1,371 @@
+"""
+Utility functions for retention of generated artifacts
+
+Generated maps (the page with its data files and compressed copies),
+PowerPoint exports, staged uploads and cached tiles are each tracked by an
+ArtifactIndex: the size, creation time and last access of every artifact in
+a directory.
+A Janitor sweeps the indexes in a background thread.  It deletes the
+artifacts of a kind that have not been accessed within the kind's TTL, then
+the least recently used ones while the kind is over its size quota, and
+keeps counters and a log of those decisions for the metrics endpoint.
+
+Last access times are stored on the files themselves (their atime, set with
+os.utime), so every worker process, and the next start of the app, sees the
+same order.
+
+Requests that are about to use an artifact hold a reference on it
+(:meth:`ArtifactIndex.acquire`); the janitor skips referenced artifacts.
+References are counted per process; across processes, the recent access
+time keeps an artifact in use out of reach of the quota (DEFAULT_MIN_IDLE).
+"""
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional
+
+# Accesses closer together than this only update the index, not the file
+ACCESS_RESOLUTION = 60
+# Artifacts used this recently are never evicted to meet a quota (maps being
+# written, uploads whose pins are still being chosen)
+DEFAULT_MIN_IDLE = 300
+
+
+def limit_from_setting(value, default: Optional[float], scale: float = 1) -> Optional[float]:
+    """
+    Parse a TTL or quota setting such as an environment variable; "none"/"off" disables the limit.
+
+    Args:
+        value: The setting, or None when it is not set
+        default: Limit used when the setting is missing or invalid, in the setting's unit
+        scale: Multiplier from the setting's unit to the returned one (e.g. MB to bytes)
+    """
+    limit = default
+    if value is not None:
+        value = str(value).strip().lower()
+        if value in ("", "none", "off", "false"):
+            return None
+        try:
+            limit = max(0.0, float(value))
+        except ValueError:
+            pass
+    return None if limit is None else limit * scale
+
+
+def map_artifact_key(filename: str) -> Optional[str]:
+    """Map id of a file written for a map (``<id>.html``, ``<id>.html.gz``, ``<id>.pins.npz``, ...)."""
+    if filename.startswith(".") or filename.endswith(".pptx"):
+        return None
+    return filename.split(".", 1)[0]
+
+
+def pptx_artifact_key(filename: str) -> Optional[str]:
+    """Map id of a PowerPoint export (``<id>.pptx``)."""
+    return filename[:-len(".pptx")] if filename.endswith(".pptx") else None
+
+
+def upload_artifact_key(filename: str) -> Optional[str]:
+    """Every staged upload is its own artifact."""
+    return None if filename.startswith(".") else filename
+
+
+def tile_artifact_key(relative_path: str) -> Optional[str]:
+    """Every cached tile (``states/<countries>/<z>/<x>/<y>.pbf``, ...) is its own artifact."""
+    return None if os.path.basename(relative_path).startswith(".") else relative_path
+
+
+class Artifact:
+    """The files stored under one key, with their total size and times."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.paths: List[str] = []
+        self.size = 0
+        self.created = float("inf")
+        self.last_accessed = 0.0
+
+    def add_file(self, path: str, stat: os.stat_result) -> None:
+        self.paths.append(path)
+        self.size += stat.st_size
+        self.created = min(self.created, stat.st_mtime)
+        self.last_accessed = max(self.last_accessed, stat.st_atime, stat.st_mtime)
+
+
+class RetentionPolicy:
+    """
+    Limits of one kind of artifact.
+
+    Args:
+        ttl: Seconds since the last access after which an artifact is deleted (None: no TTL)
+        max_bytes: Total size above which the least recently used artifacts are deleted (None: no quota)
+        min_idle: Seconds since the last access before an artifact may be deleted to meet the quota
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_bytes: Optional[float] = None,
+                 min_idle: float = DEFAULT_MIN_IDLE):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.min_idle = min_idle
+
+    def as_dict(self) -> dict:
+        return {"ttl": self.ttl, "max_bytes": self.max_bytes, "min_idle": self.min_idle}
+
+
+class ArtifactIndex:
+    """
+    Size, creation time and last access of the artifacts in one directory.
+
+    Args:
+        directory: Directory holding the artifacts
+        key_for: Artifact key of a file name, or None for files that are not artifacts of this kind
+        recursive: Also index the files in subdirectories; ``key_for`` then gets
+            their path relative to ``directory``
+    """
+
+    def __init__(self, directory: str, key_for: Callable[[str], Optional[str]], recursive: bool = False):
+        self.directory = directory
+        self.key_for = key_for
+        self.recursive = recursive
+        self._artifacts: Dict[str, Artifact] = {}
+        self._references = Counter()
+        self._lock = threading.Lock()
+
+    def _entries(self, directory: str) -> List[os.DirEntry]:
+        try:
+            with os.scandir(directory) as scanned:
+                return list(scanned)
+        except FileNotFoundError:
+            return []
+
+    def scan(self) -> None:
+        """Rebuild the index from the files on disk."""
+        artifacts: Dict[str, Artifact] = {}
+        entries = self._entries(self.directory)
+        while entries:
+            entry = entries.pop()
+            if self.recursive and entry.is_dir(follow_symlinks=False):
+                entries += self._entries(entry.path)
+                continue
+            name = os.path.relpath(entry.path, self.directory) if self.recursive else entry.name
+            key = self.key_for(name)
+            if key is None:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # deleted since the directory was listed
+            artifacts.setdefault(key, Artifact(key)).add_file(entry.path, stat)
+        with self._lock:
+            self._artifacts = artifacts
+
+    def artifacts(self) -> List[Artifact]:
+        with self._lock:
+            return list(self._artifacts.values())
+
+    def touch(self, key: str, path: str, now: Optional[float] = None) -> None:
+        """
+        Record an access to an artifact through one of its files.
+
+        The file's atime is set (its mtime, and with it the ETag, is kept) at
+        most once per ACCESS_RESOLUTION seconds.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            artifact = self._artifacts.get(key)
+            if artifact is not None:
+                if now - artifact.last_accessed < ACCESS_RESOLUTION:
+                    return
+                artifact.last_accessed = now
+        try:
+            os.utime(path, (now, os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def acquire(self, key: str) -> None:
+        """Take a reference on an artifact; it is not deleted until every reference is released."""
+        with self._lock:
+            self._references[key] += 1
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._references[key] -= 1
+            if self._references[key] <= 0:
+                del self._references[key]
+
+    def in_use(self, key: str) -> bool:
+        with self._lock:
+            return self._references[key] > 0
+
+    def remove(self, artifact: Artifact) -> Optional[int]:
+        """
+        Delete the files of an artifact.
+
+        Returns:
+            The bytes freed, or None if the artifact is referenced and was kept
+        """
+        freed = 0
+        # Under the lock, so no reference can be taken while the files go
+        with self._lock:
+            if self._references[artifact.key] > 0:
+                return None
+            for path in artifact.paths:
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    freed += size
+                except FileNotFoundError:
+                    pass  # already deleted by another worker
+            self._artifacts.pop(artifact.key, None)
+        return freed
+
+
+class Janitor:
+    """
+    Enforces the retention policy of each registered kind of artifact.
+
+    Args:
+        interval: Seconds between sweeps of the background thread (0 disables it)
+        log: Called with a message for every deletion and failed sweep
+        on_evict: Called with the kind and key of every deleted artifact
+        history: Number of recent decisions kept for :meth:`metrics`
+    """
+
+    def __init__(self, interval: float, log: Optional[Callable[[str], None]] = None,
+                 on_evict: Optional[Callable[[str, str], None]] = None, history: int = 100):
+        self.interval = interval
+        self.log = log
+        self.on_evict = on_evict
+        self.kinds: Dict[str, tuple] = {}
+        self.decisions = deque(maxlen=history)
+        self.evictions = Counter()
+        self.bytes_freed = Counter()
+        self.sweeps = 0
+        self.errors = 0
+        self.last_sweep: Optional[float] = None
+        self.last_sweep_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, kind: str, index: ArtifactIndex, policy: RetentionPolicy) -> None:
+        self.kinds[kind] = (index, policy)
+
+    def sweep(self, now: Optional[float] = None) -> List[dict]:
+        """
+        Rescan every index and delete what its policy no longer allows.
+
+        Returns:
+            One decision per deleted artifact: kind, key, reason ("ttl" or
+            "quota"), bytes freed and seconds since its last access
+        """
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+        decisions = []
+        with self._lock:
+            for kind, (index, policy) in self.kinds.items():
+                index.scan()
+                # Least recently used first
+                artifacts = sorted(index.artifacts(), key=lambda artifact: artifact.last_accessed)
+                total = sum(artifact.size for artifact in artifacts)
+                kept = []
+                for artifact in artifacts:
+                    if index.in_use(artifact.key):
+                        continue  # a request is using it; it does not count as evictable
+                    if policy.ttl is not None and now - artifact.last_accessed > policy.ttl:
+                        decision = self._evict(kind, index, artifact, "ttl", now)
+                        if decision:
+                            decisions.append(decision)
+                            total -= artifact.size
+                            continue
+                    kept.append(artifact)
+                for artifact in kept:
+                    if policy.max_bytes is None or total <= policy.max_bytes:
+                        break
+                    if now - artifact.last_accessed < policy.min_idle:
+                        break  # every remaining artifact is in use
+                    decision = self._evict(kind, index, artifact, "quota", now)
+                    if decision:
+                        decisions.append(decision)
+                        total -= artifact.size
+            self.sweeps += 1
+            self.last_sweep = now
+            self.last_sweep_seconds = time.perf_counter() - start
+        return decisions
+
+    def _evict(self, kind: str, index: ArtifactIndex, artifact: Artifact, reason: str,
+               now: float) -> Optional[dict]:
+        freed = index.remove(artifact)
+        if freed is None:
+            return None  # referenced since the sweep started
+        decision = {
+            "kind": kind,
+            "key": artifact.key,
+            "reason": reason,
+            "bytes": freed,
+            "idle_seconds": round(now - artifact.last_accessed),
+            "age_seconds": round(now - artifact.created),
+            "at": now,
+        }
+        self.decisions.append(decision)
+        self.evictions[kind, reason] += 1
+        self.bytes_freed[kind, reason] += freed
+        if self.log:
+            self.log(f"Janitor deleted {kind} artifact {artifact.key} ({reason}): {freed} bytes, "
+                     f"idle for {decision['idle_seconds']}s")
+        if self.on_evict:
+            self.on_evict(kind, artifact.key)
+        return decision
+
+    def start(self) -> None:
+        """Sweep now and then every ``interval`` seconds in a daemon thread."""
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="artifact-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                self.errors += 1
+                if self.log:
+                    self.log(f"Janitor sweep failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def metrics(self) -> dict:
+        """
+        Current size of every kind and what the janitor deleted so far.
+
+        Recent decisions leave out the artifact keys, which are the map ids
+        and upload names that grant access to them.
+        """
+        with self._lock:
+            kinds = {}
+            for kind, (index, policy) in self.kinds.items():
+                artifacts = index.artifacts()
+                kinds[kind] = {
+                    "count": len(artifacts),
+                    "bytes": sum(artifact.size for artifact in artifacts),
+                    **policy.as_dict(),
+                    "evictions": {reason: self.evictions[kind, reason] for reason in ("ttl", "quota")},
+                    "bytes_freed": {reason: self.bytes_freed[kind, reason] for reason in ("ttl", "quota")},
+                }
+            return {
+                "interval": self.interval,
+                "sweeps": self.sweeps,
+                "errors": self.errors,
+                "last_sweep": self.last_sweep,
+                "last_sweep_seconds": self.last_sweep_seconds,
+                "kinds": kinds,
+                "recent": [{name: value for name, value in decision.items() if name != "key"}
+                           for decision in self.decisions],
+            }
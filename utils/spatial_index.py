@@ -0,0 +1,163 @@
+"""
+Utility functions for viewport queries over the pins of one map
+
+Pins are bucketed on a uniform grid in Web Mercator space and stored sorted by
+cell key (row-major), so the cells of one grid row inside a bbox form a single
+contiguous slice: a bbox query is two binary searches per grid row plus an
+exact filter.  Views that contain too many pins are thinned to one pin per few
+screen pixels at the requested zoom before the response is capped.
+"""
+import math
+import os
+from typing import Sequence
+
+import numpy as np
+
+from utils.clustering import TILE_SIZE, _json_number, _project
+from utils.files import atomic_write
+
+# 2**GRID_ZOOM cells per axis, i.e. the grid of zoom 8 tiles
+GRID_ZOOM = 8
+MAX_VIEWPORT_PINS = int(os.environ.get("MAX_VIEWPORT_PINS", "5000"))
+# Spacing in screen pixels kept between pins when a view is thinned
+THIN_RADIUS = 4
+
+
+class PinGridIndex:
+    """Uniform grid spatial index of the pins of one map."""
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, keys: np.ndarray, points: np.ndarray,
+                 lats: np.ndarray, lons: np.ndarray, candidates: np.ndarray, names: np.ndarray,
+                 categories: np.ndarray, grid_zoom: int = GRID_ZOOM):
+        self.x = x
+        self.y = y
+        self.keys = keys
+        self.points = points
+        self.lats = lats
+        self.lons = lons
+        self.candidates = candidates
+        self.names = names
+        self.categories = categories
+        self.grid_zoom = grid_zoom
+
+    @property
+    def grid_size(self) -> int:
+        return 2 ** self.grid_zoom
+
+    @classmethod
+    def build(cls, lats: Sequence[float], lons: Sequence[float], candidates: Sequence[float],
+              names: Sequence[str], categories: Sequence[int], grid_zoom: int = GRID_ZOOM) -> "PinGridIndex":
+        """
+        Bucket pins into grid cells.
+
+        Args:
+            lats, lons: Pin coordinates in degrees, returned to clients as given
+            candidates: Electrification candidates per pin (NaN when missing)
+            names: Location name per pin
+            categories: Pin style index per pin
+            grid_zoom: The grid has 2**grid_zoom cells per axis
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        x, y = _project(lons, lats)
+        size = 2 ** grid_zoom
+        cx = np.clip(np.floor(x * size), 0, size - 1).astype(np.int64)
+        cy = np.clip(np.floor(y * size), 0, size - 1).astype(np.int64)
+        keys = cy * size + cx
+        order = np.argsort(keys, kind="stable")
+        return cls(
+            x[order], y[order], keys[order], order.astype(np.int64),
+            lats[order], lons[order],
+            np.asarray(candidates, dtype=float)[order],
+            np.asarray(list(names), dtype=str)[order],
+            np.asarray(categories, dtype=np.int64)[order],
+            grid_zoom=grid_zoom,
+        )
+
+    def query(self, bbox: Sequence[float]) -> np.ndarray:
+        """
+        Rows (in index order) of the pins inside a bbox.
+
+        Args:
+            bbox: (west, south, east, north) in degrees; west > east crosses the antimeridian
+        """
+        west, south, east, north = bbox
+        if east - west >= 360:
+            west, east = -180.0, 180.0
+        else:
+            west = (west + 180.0) % 360.0 - 180.0
+            east = (east + 180.0) % 360.0 - 180.0
+        (min_x, max_x), (max_y, min_y) = _project([west, east], [south, north])
+        size = self.grid_size
+
+        def cell(value):
+            return int(min(size - 1, max(0, math.floor(value * size))))
+
+        x_ranges = [(min_x, max_x)] if min_x <= max_x else [(0.0, max_x), (min_x, 1.0)]
+        found = []
+        for lo, hi in x_ranges:
+            cx0, cx1 = cell(lo), cell(hi)
+            for cy in range(cell(min_y), cell(max_y) + 1):
+                start = np.searchsorted(self.keys, cy * size + cx0, side="left")
+                stop = np.searchsorted(self.keys, cy * size + cx1, side="right")
+                if start == stop:
+                    continue
+                rows = np.arange(start, stop)
+                inside = ((self.x[rows] >= lo) & (self.x[rows] <= hi) &
+                          (self.y[rows] >= min_y) & (self.y[rows] <= max_y))
+                found.append(rows[inside])
+        return np.concatenate(found) if found else np.array([], dtype=np.int64)
+
+    def get_pins(self, bbox: Sequence[float], zoom: int, limit: int = MAX_VIEWPORT_PINS) -> dict:
+        """
+        Pins inside a bbox, thinned and capped when the view holds more than ``limit``.
+
+        Args:
+            bbox: (west, south, east, north) in degrees
+            zoom: Map zoom level, used to thin crowded views to one pin per few pixels
+            limit: Maximum number of pins in the response
+
+        Returns:
+            Dict with ``total`` (pins in the bbox), ``truncated`` and ``pins``
+            (``index``/``lat``/``lon``/``name``/``cat``/``candidates``)
+        """
+        rows = self.query(bbox)
+        total = len(rows)
+        if total > limit:
+            cell = THIN_RADIUS / (TILE_SIZE * 2 ** max(0, int(zoom)))
+            keys = np.stack([np.floor(self.x[rows] / cell), np.floor(self.y[rows] / cell)], axis=1)
+            _, first = np.unique(keys, axis=0, return_index=True)
+            rows = rows[np.sort(first)]
+            if len(rows) > limit:
+                rows = rows[np.linspace(0, len(rows) - 1, limit).astype(np.int64)]
+
+        pins = []
+        for row in rows.tolist():
+            candidates = self.candidates[row]
+            pins.append({
+                "index": int(self.points[row]),
+                "lat": float(self.lats[row]),
+                "lon": float(self.lons[row]),
+                "name": str(self.names[row]),
+                "cat": int(self.categories[row]),
+                "candidates": None if math.isnan(candidates) else _json_number(candidates),
+            })
+        return {"total": total, "truncated": len(pins) < total, "pins": pins}
+
+    def save(self, path: str) -> None:
+        """Store the index as a compressed ``.npz`` file next to its map; projections are recomputed on load."""
+        with atomic_write(path) as f:
+            np.savez_compressed(
+                f, keys=self.keys, points=self.points, lats=self.lats,
+                lons=self.lons, candidates=self.candidates, names=self.names,
+                categories=self.categories, grid_zoom=np.array(self.grid_zoom),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "PinGridIndex":
+        with np.load(path, allow_pickle=False) as data:
+            x, y = _project(data["lons"], data["lats"])
+            return cls(
+                x, y, data["keys"], data["points"], data["lats"], data["lons"],
+                data["candidates"], data["names"], data["categories"], grid_zoom=int(data["grid_zoom"]),
+            )
@@ -0,0 +1,74 @@
+"""
+Utility functions for Web Mercator tile math and the on-disk tile cache
+"""
+import math
+import os
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from utils.files import atomic_write
+
+# Latitude limit of the square Web Mercator world
+MAX_LATITUDE = 85.0511287798
+EARTH_HALF_CIRCUMFERENCE = 20037508.342789244
+MAX_TILE_ZOOM = 18
+
+
+def lonlat_to_mercator(lon, lat):
+    """Project lon/lat degrees (scalars or arrays) to EPSG:3857 metres."""
+    lon = np.asarray(lon, dtype=float)
+    lat = np.clip(np.asarray(lat, dtype=float), -MAX_LATITUDE, MAX_LATITUDE)
+    x = lon * EARTH_HALF_CIRCUMFERENCE / 180.0
+    y = np.log(np.tan((90.0 + lat) * math.pi / 360.0)) * EARTH_HALF_CIRCUMFERENCE / math.pi
+    return x, y
+
+
+def tile_bounds_mercator(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Return (minx, miny, maxx, maxy) of an XYZ tile in EPSG:3857 metres."""
+    size = 2 * EARTH_HALF_CIRCUMFERENCE / (2 ** z)
+    minx = -EARTH_HALF_CIRCUMFERENCE + x * size
+    maxy = EARTH_HALF_CIRCUMFERENCE - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tile_bounds_lonlat(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Return (west, south, east, north) of an XYZ tile in degrees."""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def is_valid_tile(z: int, x: int, y: int, max_zoom: int = MAX_TILE_ZOOM) -> bool:
+    """Check that z/x/y addresses an existing tile."""
+    return 0 <= z <= max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def cached_tile(cache_dir: str, relative_path: str, build: Callable[[], Optional[bytes]]) -> Optional[bytes]:
+    """
+    Return tile bytes from the disk cache, building and storing them on a miss.
+
+    Tiles are written to a temporary file and renamed into place so concurrent
+    workers never read a partially written tile.  ``build`` may return None
+    for a tile not worth storing (e.g. an empty one); None is returned then.
+    """
+    path = os.path.join(cache_dir, relative_path)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    data = build()
+    if data is None:
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with atomic_write(path) as f:
+            f.write(data)
+    except OSError:
+        pass  # served without caching
+    return data
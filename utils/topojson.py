@@ -0,0 +1,204 @@
+"""
+Utility functions for serializing boundary polygons as TopoJSON
+
+Adjacent states share borders, so encoding them as GeoJSON stores every shared
+edge twice at full floating point precision.  The encoder below quantizes the
+coordinates onto an integer grid, splits every ring at the points where
+neighbouring rings diverge and stores each resulting arc only once.  Arcs are
+delta-encoded as described in the TopoJSON specification so the output can be
+decoded in the browser with ``topojson.feature`` (used by ``folium.TopoJson``).
+"""
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_QUANTIZATION = 100000
+
+Point = Tuple[int, int]
+
+
+def _polygons(geom) -> list:
+    """Return the list of polygons making up a Polygon/MultiPolygon geometry."""
+    if geom is None or geom.is_empty:
+        return []
+    if geom.geom_type == "Polygon":
+        return [geom]
+    if geom.geom_type == "MultiPolygon":
+        return list(geom.geoms)
+    return []
+
+
+def _quantize_ring(coords: Iterable, x0: float, y0: float, kx: float, ky: float) -> List[Point]:
+    """Quantize a ring and drop consecutive duplicate points (open ring, no closing point)."""
+    ring: List[Point] = []
+    for x, y, *_ in coords:
+        point = (int(round((x - x0) / kx)), int(round((y - y0) / ky)))
+        if not ring or ring[-1] != point:
+            ring.append(point)
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    return ring
+
+
+def _find_junctions(rings: Sequence[List[Point]]) -> set:
+    """Points where two rings meet with different neighbours start or end a shared arc."""
+    neighbours: Dict[Point, Tuple[Point, Point]] = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring)
+        for i, point in enumerate(ring):
+            pair = (ring[i - 1], ring[(i + 1) % n])
+            seen = neighbours.get(point)
+            if seen is None:
+                neighbours[point] = pair
+            elif seen != pair and seen != (pair[1], pair[0]):
+                junctions.add(point)
+    return junctions
+
+
+def _canonical_closed_ring(ring: List[Point]) -> List[Point]:
+    """Rotate an open ring so it starts at its smallest point and close it."""
+    start = ring.index(min(ring))
+    rotated = ring[start:] + ring[:start]
+    return rotated + [rotated[0]]
+
+
+class _ArcIndex:
+    """Deduplicates arcs, returning TopoJSON arc references (``~i`` for reversed arcs)."""
+
+    def __init__(self):
+        self.arcs: List[List[Point]] = []
+        self._lookup: Dict[tuple, int] = {}
+
+    def add(self, arc: List[Point]) -> int:
+        key = tuple(arc)
+        if key in self._lookup:
+            return self._lookup[key]
+        reversed_key = key[::-1]
+        if reversed_key in self._lookup:
+            return ~self._lookup[reversed_key]
+        self._lookup[key] = len(self.arcs)
+        self.arcs.append(arc)
+        return len(self.arcs) - 1
+
+    def add_closed_ring(self, ring: List[Point]) -> int:
+        """Closed rings without junctions may be stored rotated and/or reversed."""
+        forward = _canonical_closed_ring(ring)
+        key = tuple(forward)
+        if key in self._lookup:
+            return self._lookup[key]
+        backward = _canonical_closed_ring(ring[::-1])
+        if tuple(backward) in self._lookup:
+            return ~self._lookup[tuple(backward)]
+        return self.add(forward)
+
+
+def _ring_arcs(ring: List[Point], junctions: set, index: _ArcIndex) -> List[int]:
+    """Cut a ring at its junctions and register the resulting arcs."""
+    cut_points = [i for i, point in enumerate(ring) if point in junctions]
+    if not cut_points:
+        return [index.add_closed_ring(ring)]
+
+    start = cut_points[0]
+    rotated = ring[start:] + ring[:start] + [ring[start]]
+    refs = []
+    arc = [rotated[0]]
+    for point in rotated[1:]:
+        arc.append(point)
+        if point in junctions:
+            refs.append(index.add(arc))
+            arc = [point]
+    return refs
+
+
+def _delta_encode(arc: List[Point]) -> List[List[int]]:
+    encoded = [[arc[0][0], arc[0][1]]]
+    for (px, py), (x, y) in zip(arc, arc[1:]):
+        encoded.append([x - px, y - py])
+    return encoded
+
+
+def _clean_value(value):
+    """JSON has no NaN, so missing attribute values are emitted as null."""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if hasattr(value, "item"):  # numpy scalar
+        return _clean_value(value.item())
+    return value
+
+
+def geodataframe_to_topojson(
+    gdf,
+    object_name: str = "states",
+    properties: Optional[Sequence[str]] = None,
+    quantization: int = DEFAULT_QUANTIZATION,
+) -> dict:
+    """
+    Encode the polygons of a GeoDataFrame as a quantized TopoJSON topology.
+
+    Args:
+        gdf: GeoDataFrame with Polygon/MultiPolygon geometries in lon/lat
+        object_name: Name of the geometry collection under ``objects``
+        properties: Attribute columns to copy into each geometry's properties
+        quantization: Number of distinct grid positions per axis
+
+    Returns:
+        TopoJSON topology dictionary
+    """
+    properties = list(properties or [])
+    x0, y0, x1, y1 = (float(v) for v in gdf.total_bounds)
+    kx = (x1 - x0) / (quantization - 1) or 1.0
+    ky = (y1 - y0) / (quantization - 1) or 1.0
+
+    # Quantize every ring first; junction detection needs all of them at once
+    features = []
+    all_rings = []
+    for _, row in gdf.iterrows():
+        polygons = []
+        for polygon in _polygons(row.geometry):
+            rings = [_quantize_ring(polygon.exterior.coords, x0, y0, kx, ky)]
+            rings += [_quantize_ring(interior.coords, x0, y0, kx, ky) for interior in polygon.interiors]
+            rings = [ring for ring in rings if len(ring) >= 3]
+            if rings:
+                polygons.append(rings)
+                all_rings.extend(rings)
+        if polygons:
+            props = {name: _clean_value(row.get(name)) for name in properties}
+            features.append((polygons, props))
+
+    junctions = _find_junctions(all_rings)
+    index = _ArcIndex()
+
+    geometries = []
+    for polygons, props in features:
+        arcs = [[_ring_arcs(ring, junctions, index) for ring in rings] for rings in polygons]
+        if len(arcs) == 1:
+            geometry = {"type": "Polygon", "arcs": arcs[0]}
+        else:
+            geometry = {"type": "MultiPolygon", "arcs": arcs}
+        geometry["properties"] = props
+        geometries.append(geometry)
+
+    return {
+        "type": "Topology",
+        "transform": {"scale": [kx, ky], "translate": [x0, y0]},
+        "objects": {object_name: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": [_delta_encode(arc) for arc in index.arcs],
+    }
+
+
+def copy_topology_for_styling(topology: dict, object_name: str = "states") -> dict:
+    """
+    Return a copy of a topology whose geometry properties can be mutated safely.
+
+    ``folium.TopoJson`` writes each feature's style into its properties, so a
+    cached topology must not be handed to it directly.  The (large) arc list is
+    shared with the original, only the geometry records are copied.
+    """
+    collection = topology["objects"][object_name]
+    geometries = [
+        dict(geometry, properties=dict(geometry.get("properties") or {}))
+        for geometry in collection["geometries"]
+    ]
+    objects = dict(topology["objects"])
+    objects[object_name] = dict(collection, geometries=geometries)
+    return dict(topology, objects=objects)
@@ -0,0 +1,211 @@
+"""
+Utility functions for cutting boundary polygons into Mapbox Vector Tiles
+
+The encoder writes the small subset of the vector tile protobuf schema needed
+for a single polygon layer with scalar attributes, so no protobuf dependency
+is required.
+"""
+import os
+import struct
+from typing import Dict, List, Sequence
+
+import numpy as np
+import shapely
+from shapely.geometry import box
+from shapely.geometry.polygon import orient
+
+from utils.tiles import cached_tile, lonlat_to_mercator, tile_bounds_lonlat, tile_bounds_mercator
+
+TILE_EXTENT = 4096
+# Geometry is clipped slightly outside the tile so strokes do not show seams
+TILE_BUFFER = 64
+# Douglas-Peucker tolerance in tile units (1/16 of a pixel at 256px tiles)
+SIMPLIFY_TOLERANCE = 4
+
+_CMD_MOVE_TO = 1
+_CMD_LINE_TO = 2
+_CMD_CLOSE_PATH = 7
+_GEOM_POLYGON = 3
+
+
+# ------------------------------------------
+# Minimal protobuf writer
+# ------------------------------------------
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _length_delimited(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field: int, values: Sequence[int]) -> bytes:
+    return _length_delimited(field, b"".join(_varint(v) for v in values))
+
+
+def _encode_value(value) -> bytes:
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack("<d", value)
+    return _length_delimited(1, str(value).encode("utf-8"))
+
+
+# ------------------------------------------
+# Geometry encoding
+# ------------------------------------------
+def _command(command_id: int, count: int) -> int:
+    return (command_id & 0x7) | (count << 3)
+
+
+def _ring_points(coords) -> np.ndarray:
+    """Round a ring to integer tile units and drop repeated points."""
+    points = np.rint(np.asarray(coords)[:-1, :2]).astype(np.int64)
+    if len(points) == 0:
+        return points
+    keep = np.any(np.diff(points, axis=0, prepend=points[-1:] + 1) != 0, axis=1)
+    points = points[keep]
+    if len(points) > 1 and np.array_equal(points[0], points[-1]):
+        points = points[:-1]
+    return points
+
+
+def _encode_polygons(polygons) -> List[int]:
+    """Encode polygons as MoveTo/LineTo/ClosePath commands with delta coordinates."""
+    commands: List[int] = []
+    cursor = (0, 0)
+    for polygon in polygons:
+        # Exterior rings must have a positive area in (y-down) tile space
+        polygon = orient(polygon, 1.0)
+        rings = [polygon.exterior] + list(polygon.interiors)
+        for ring_index, ring in enumerate(rings):
+            points = _ring_points(ring.coords)
+            if len(points) < 3:
+                if ring_index == 0:
+                    break  # drop the whole polygon, holes are meaningless without it
+                continue
+            x, y = (int(v) for v in points[0])
+            commands += [_command(_CMD_MOVE_TO, 1), _zigzag(x - cursor[0]), _zigzag(y - cursor[1])]
+            deltas = np.diff(points, axis=0)
+            commands.append(_command(_CMD_LINE_TO, len(deltas)))
+            for dx, dy in deltas.tolist():
+                commands += [_zigzag(dx), _zigzag(dy)]
+            cursor = tuple(int(v) for v in points[-1])
+            commands.append(_command(_CMD_CLOSE_PATH, 1))
+    return commands
+
+
+def _polygon_parts(geom) -> list:
+    if geom is None or geom.is_empty:
+        return []
+    if geom.geom_type == "Polygon":
+        return [geom]
+    if geom.geom_type in ("MultiPolygon", "GeometryCollection"):
+        return [part for g in geom.geoms for part in _polygon_parts(g)]
+    return []
+
+
+class VectorTileSource:
+    """
+    Serves a GeoDataFrame of polygons as Mapbox Vector Tiles with a disk cache.
+
+    The geometry is projected to Web Mercator once; each tile request only
+    touches the polygons returned by the GeoDataFrame's spatial index.
+    """
+
+    def __init__(self, gdf, layer_name: str, properties: Dict[str, str], cache_dir: str,
+                 max_zoom: int = 14):
+        """
+        Args:
+            gdf: GeoDataFrame with lon/lat polygon geometries
+            layer_name: Name of the vector tile layer
+            properties: Mapping of tile attribute name -> GeoDataFrame column
+            cache_dir: Directory for cached ``{z}/{x}/{y}.pbf`` files
+            max_zoom: Highest zoom level served
+        """
+        self.layer_name = layer_name
+        self.cache_dir = cache_dir
+        self.max_zoom = max_zoom
+        self._gdf = gdf.reset_index(drop=True)
+        self._properties = properties
+        self._mercator = shapely.transform(
+            self._gdf.geometry.values, lambda xy: np.column_stack(lonlat_to_mercator(xy[:, 0], xy[:, 1]))
+        )
+
+    def get_tile(self, z: int, x: int, y: int) -> bytes:
+        """Return the encoded tile, from the disk cache when available."""
+        return cached_tile(self.cache_dir, os.path.join(str(z), str(x), f"{y}.pbf"),
+                           lambda: self.build_tile(z, x, y))
+
+    def build_tile(self, z: int, x: int, y: int) -> bytes:
+        """Clip, project and encode all polygons intersecting tile z/x/y."""
+        candidates = self._gdf.sindex.query(box(*tile_bounds_lonlat(z, x, y)), predicate="intersects")
+
+        minx, miny, maxx, maxy = tile_bounds_mercator(z, x, y)
+        scale = TILE_EXTENT / (maxx - minx)
+
+        def to_tile(xy):
+            return np.column_stack(((xy[:, 0] - minx) * scale, (maxy - xy[:, 1]) * scale))
+
+        keys: List[str] = []
+        values: List = []
+        key_index: Dict[str, int] = {}
+        value_index: Dict[tuple, int] = {}
+        features = []
+        for row_index in sorted(int(i) for i in candidates):
+            geom = shapely.transform(self._mercator[row_index], to_tile)
+            geom = shapely.clip_by_rect(geom, -TILE_BUFFER, -TILE_BUFFER,
+                                        TILE_EXTENT + TILE_BUFFER, TILE_EXTENT + TILE_BUFFER)
+            geom = geom.simplify(SIMPLIFY_TOLERANCE, preserve_topology=True)
+            geometry = _encode_polygons(_polygon_parts(geom))
+            if not geometry:
+                continue
+
+            tags: List[int] = []
+            row = self._gdf.iloc[row_index]
+            for attr, column in self._properties.items():
+                value = row.get(column)
+                if value is None or (isinstance(value, float) and np.isnan(value)):
+                    continue
+                if hasattr(value, "item"):
+                    value = value.item()
+                if attr not in key_index:
+                    key_index[attr] = len(keys)
+                    keys.append(attr)
+                value_key = (type(value).__name__, value)
+                if value_key not in value_index:
+                    value_index[value_key] = len(values)
+                    values.append(value)
+                tags += [key_index[attr], value_index[value_key]]
+
+            feature = (_key(1, 0) + _varint(row_index + 1) + _packed(2, tags) +
+                       _key(3, 0) + _varint(_GEOM_POLYGON) + _packed(4, geometry))
+            features.append(feature)
+
+        if not features:
+            return b""
+
+        layer = _key(15, 0) + _varint(2) + _length_delimited(1, self.layer_name.encode("utf-8"))
+        layer += b"".join(_length_delimited(2, f) for f in features)
+        layer += b"".join(_length_delimited(3, k.encode("utf-8")) for k in keys)
+        layer += b"".join(_length_delimited(4, _encode_value(v)) for v in values)
+        layer += _key(5, 0) + _varint(TILE_EXTENT)
+        return _length_delimited(3, layer)